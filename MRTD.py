@@ -1,17 +1,143 @@
-import pprint
+import functools
 
-def scan_mrz():
-    
-    #Left empty as per requirements
-    
-    pass
+# OCR glyphs read in place of '<' filler
+_OCR_NOISE = str.maketrans({'\u00ab': '<<', '\u2039': '<'})
+# Characters an OCR pass confuses, mapped to the class a position calls for
+_AS_DIGITS = str.maketrans('OQDIZSGTB', '001125678')
+_AS_LETTERS = str.maketrans('0125678', 'OIZSGTB')
+_MRZ_CHARS = '<0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ '
 
 
-def query_database():
-    
-    #Left empty as per requirements
-    
-    pass
+def _ocr_lines(chunks):
+    """Split a stream of raw text chunks into lines, whatever the line breaks"""
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + chunk).splitlines(True)
+        # The last line continues in the next chunk unless it ended with a break;
+        # a '\r' is held back too, as the next chunk may start with its '\n'
+        pending = (lines.pop() if lines and (lines[-1].endswith('\r') or lines[-1] == lines[-1].splitlines()[0])
+                   else '')
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _mrz_candidates(chunks, line_length: int = 44):
+    """Lines of ``line_length`` MRZ characters found in raw OCR text
+
+    Lines are uppercased and stripped, OCR glyphs for filler are mapped to
+    '<', and two lines OCR merged into one or one line it wrapped into two
+    are put back together; blank lines between the two halves of a
+    wrapped line are skipped.
+    """
+    fragment = ''
+    for raw in _ocr_lines(chunks):
+        line = raw.strip().upper()
+        if not line:
+            continue
+        if not line.isascii():
+            line = line.translate(_OCR_NOISE)
+        if len(line) != line_length:
+            compact = ''.join(line.split())
+            if len(compact) % line_length == 0:
+                line = compact
+            elif fragment and len(fragment) + len(compact) == line_length:
+                line = fragment + compact
+        if line.strip(_MRZ_CHARS):
+            fragment = ''
+            continue
+        if len(line) < line_length:
+            fragment = line if '<' in line else ''
+            continue
+        fragment = ''
+        for start in range(0, len(line) - line_length + 1, line_length):
+            yield line[start:start + line_length]
+
+
+def _correct_field(value: str, check: str, max_corrections: int) -> str:
+    """The best ranked correction of ``value`` for check digit ``check``, or ``value`` itself"""
+    if _DIGITS[calculate_check_digit(value)] == check or check not in _DIGITS:
+        return value
+    candidates = correct_check_digit(value, check, max_corrections)
+    return candidates[0][0] if candidates else value
+
+
+def _correct_td3(line1: str, line2: str, max_corrections: int) -> tuple:
+    """Undo OCR misreads in a TD3 line pair, guided by the layout and check digits"""
+    # Line 1 holds only letters and filler; a K in the filler after the names is a misread '<'
+    line1 = line1[0] + '<' + line1[2:].translate(_AS_LETTERS)
+    names = line1.rstrip('<K')
+    filler = line1.find('<<<', len(names))
+    if filler >= 0:
+        line1 = line1[:filler].ljust(44, '<')
+
+    passport_check = line2[9].translate(_AS_DIGITS)
+    personal_check = line2[43].translate(_AS_DIGITS)
+    line2 = (_correct_field(line2[0:9], passport_check, max_corrections) + passport_check +
+             line2[10:13].translate(_AS_LETTERS) + line2[13:20].translate(_AS_DIGITS) +
+             line2[20].translate(_AS_LETTERS) + line2[21:28].translate(_AS_DIGITS) +
+             _correct_field(line2[28:37], personal_check, max_corrections) +
+             line2[37:43].replace('K', '<') + personal_check)
+    return line1, line2
+
+
+def scan_mrz(chunks=None, max_corrections: int = 2):
+    """Find, correct and decode TD3 MRZs in a stream of raw OCR text
+
+    ``chunks`` is any iterable of text pieces (file reads, socket frames,
+    OCR pages); they may split lines anywhere and use any line breaks.
+    Each line pair whose first line starts with 'P' is corrected for the
+    usual misreads (O/0, I/1, S/5, B/8, Z/2, G/6 by position class, K for
+    '<'); passport and personal numbers take the best ranked
+    correct_check_digit candidate with up to ``max_corrections``
+    substitutions.
+    Yields the decode_mrz dict of every pair whose four check digits then
+    verify; anything else in the stream is skipped.
+
+    Returns None when no stream is given.
+    """
+    if chunks is None:
+        return None
+    return _scan(chunks, max_corrections)
+
+
+def _scan(chunks, max_corrections: int):
+    line1 = None
+    for line in _mrz_candidates(chunks):
+        if line1 is not None:
+            decoded, mask = TD3.parse_and_verify(*_correct_td3(line1, line, max_corrections))
+            if mask == TD3.all_valid:
+                yield decoded
+                line1 = None
+                continue
+        # Otherwise this line may start the next document
+        line1 = line if line[0] == 'P' and line[1] in '<K' else None
+
+
+# (source signature, PassportStore) per encoded file, opened on first query
+_STORES = {}
+
+
+def query_database(passport_number: str = None, last_name: str = None, birth_date: str = None,
+                   database: str = 'records_encoded.json'):
+    """Look up encoded records by passport number and/or last name and birth date
+
+    Backed by an indexed SQLite sidecar of ``database`` (see store.py) that
+    is built on first use and rebuilt whenever the file's modification time
+    or size changes. Returns the matching records as decode_mrz dicts with
+    their ``row`` in the file, or None when no key is given.
+    """
+    if passport_number is None and last_name is None and birth_date is None:
+        return None
+    from store import open_store, source_signature
+    cached = _STORES.get(database)
+    if cached is None or cached[0] != source_signature(database):
+        if cached is not None:
+            cached[1].close()
+        store = open_store(database)
+        cached = _STORES[database] = (store.source(), store)
+    return cached[1].find(passport_number, last_name, birth_date)
+
 def fletcher16(data: bytes) -> int:
     """Pure Fletcher-16 implementation"""
     sum1 = sum2 = 0
@@ -20,227 +146,719 @@ def fletcher16(data: bytes) -> int:
         sum2 = (sum2 + sum1) % 255
     return (sum2 << 8) | sum1
 
-def calculate_check_digit(data: str) -> int:
-    """Calculate check digit using Fletcher-16 with MRZ rules"""
-    if not data:
-        return 0
-    
+# MRZ normalisation (uppercase, '<' becomes '0') as a single bytes table
+_MRZ_TRANSLATE = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz<',
+                                 b'ABCDEFGHIJKLMNOPQRSTUVWXYZ0')
+
+
+def _reference_check_digit(data: str) -> int:
+    """Original per-byte check digit, kept for non-ASCII input"""
     # Convert to MRZ format: uppercase and < becomes 0
     normalized = data.upper().replace('<', '0')
-    
+
     # Calculate checksum on the raw ASCII bytes
     return fletcher16(normalized.encode('ascii')) % 10
 
+
+def _compute_check_digit(data: str) -> int:
+    """Check digit of a non-empty field, computed without the cache"""
+    # str.upper() can map non-ASCII to ASCII, so leave those to the original
+    if not data.isascii():
+        return _reference_check_digit(data)
+
+    raw = data.encode().translate(_MRZ_TRANSLATE)
+
+    # Fletcher's first sum is the byte sum. Since 256 == 1 (mod 255), the
+    # big-endian integer of the bytes taken mod 255**2 is sum1 + 255 * W,
+    # where W is the position-weighted sum that makes up the rest of sum2.
+    sum1 = sum(raw)
+    weighted = (int.from_bytes(raw, 'big') - sum1) % 65025 // 255
+    sum2 = (weighted + sum1) % 255
+
+    # ((sum2 << 8) | sum1) % 10, with 256 == 6 (mod 10)
+    return (6 * sum2 + sum1 % 255) % 10
+
+
+# Default number of distinct field values the check digit cache keeps
+CHECK_DIGIT_CACHE_SIZE = 65536
+
+_check_digit_lookup = functools.lru_cache(maxsize=CHECK_DIGIT_CACHE_SIZE)(_compute_check_digit)
+
+
+def calculate_check_digit(data: str) -> int:
+    """Calculate check digit using Fletcher-16 with MRZ rules"""
+    if not data:
+        return 0
+    return _check_digit_lookup(data)
+
+
+def configure_check_digit_cache(maxsize: int = CHECK_DIGIT_CACHE_SIZE, precompute_dates: bool = False):
+    """Resize, disable or warm the check digit LRU cache
+
+    ``maxsize`` bounds the number of distinct values kept (least recently
+    used are evicted first); ``None`` means unbounded and ``0`` disables
+    caching. ``precompute_dates`` fills the cache with every YYMMDD value
+    (37,200 of them), which needs a cache at least that large.
+    """
+    global _check_digit_lookup
+    if maxsize == 0:
+        _check_digit_lookup = _compute_check_digit
+        return
+    _check_digit_lookup = functools.lru_cache(maxsize=maxsize)(_compute_check_digit)
+    if precompute_dates:
+        for year in range(100):
+            for month in range(1, 13):
+                for day in range(1, 32):
+                    _check_digit_lookup(f"{year:02d}{month:02d}{day:02d}")
+
+
+def check_digit_cache_info():
+    """Hits, misses, maxsize and current size of the cache, or None when disabled"""
+    cache_info = getattr(_check_digit_lookup, 'cache_info', None)
+    return cache_info() if cache_info is not None else None
+
+
+def calculate_check_digits(fields: list) -> list:
+    """Calculate check digits for many fields, computing each distinct value once"""
+    digits = {value: calculate_check_digit(value) for value in set(fields)}
+    return [digits[value] for value in fields]
+
+
+# Characters OCR reads in place of each MRZ character, most likely first
+OCR_CONFUSIONS = {
+    '0': 'ODQ', 'O': '0QD', 'D': '0O', 'Q': 'O0',
+    '1': 'IL7', 'I': '1L', 'L': '1I', '7': '1T', 'T': '7',
+    '2': 'Z', 'Z': '2', '4': 'A', 'A': '4', '5': 'S', 'S': '5',
+    '6': 'G', 'G': '6C', 'C': 'G', '8': 'B', 'B': '8',
+    'M': 'N', 'N': 'M', 'U': 'V', 'V': 'U', 'E': 'F', 'F': 'E',
+    '<': 'K', 'K': '<',
+}
+
+
+def _char_kind(char: str) -> int:
+    """0 for digits, 1 for letters, 2 for '<' and anything else"""
+    return 0 if char in _DIGITS else 1 if char.isalpha() else 2
+
+
+def correct_check_digit(data: str, expected, max_substitutions: int = 2, confusions: dict = None) -> list:
+    """Ranked OCR corrections of ``data`` whose check digit is ``expected``
+
+    Tries every way of replacing up to ``max_substitutions`` characters by
+    one of their ``confusions`` (OCR_CONFUSIONS by default). Returns
+    ``[(candidate, substitutions), ...]``, ``substitutions`` being the
+    ``(position, read, replacement)`` changes made, ordered by number of
+    substitutions, then by how well each replacement fits the kind of
+    character (digit, letter or filler) around it, then by how likely the
+    confusions are, then by position;
+    ``data`` itself comes first, with no substitutions, when it already
+    checks out.
+
+    Candidates are not re-hashed: a substitution at position i of an
+    n-character field shifts Fletcher's sum1 by the byte difference d and
+    sum2 by (n - i) * d, so each one is checked with a few additions on
+    sums computed once. Only ASCII fields can be corrected; lowercase
+    letters are read as uppercase, as calculate_check_digit reads them,
+    so candidates come back uppercase.
+
+    Raises ValueError if ``expected`` is not a digit 0-9 (int or str).
+    """
+    if isinstance(expected, str) and len(expected) == 1 and expected in _DIGITS:
+        expected = int(expected)
+    elif isinstance(expected, bool) or not isinstance(expected, int) or not 0 <= expected <= 9:
+        raise ValueError(f"Expected check digit must be a digit 0-9, not {expected!r}.")
+    confusions = OCR_CONFUSIONS if confusions is None else confusions
+    if not data.isascii():
+        return [(data, ())] if calculate_check_digit(data) == expected else []
+    data = data.upper()
+
+    raw = data.encode().translate(_MRZ_TRANSLATE)
+    length = len(raw)
+    sum1 = sum(raw)
+    sum2 = sum((length - position) * byte for position, byte in enumerate(raw))
+
+    # (position, read, replacement, cost, sum1 delta, sum2 delta) of every substitution;
+    # swaps '<' and '0' count as the same byte and can never change the digit
+    kinds = [_char_kind(char) for char in data]
+    deltas = []
+    for position, char in enumerate(data):
+        neighbours = kinds[max(position - 1, 0):position] + kinds[position + 1:position + 2]
+        for rank, replacement in enumerate(confusions.get(char, '')):
+            delta = _MRZ_TRANSLATE[ord(replacement)] - raw[position]
+            if delta:
+                # Fewer neighbours of another kind than the character read is better
+                fit = neighbours.count(kinds[position]) - neighbours.count(_char_kind(replacement))
+                deltas.append((position, char, replacement, (fit, rank), delta, (length - position) * delta))
+
+    # Substitutions are listed by position, so the ones after index i at a
+    # later position start at following[i]
+    following = [len(deltas)] * len(deltas)
+    for index in range(len(deltas) - 2, -1, -1):
+        following[index] = index + 1 if deltas[index + 1][0] != deltas[index][0] else following[index + 1]
+
+    matches = [()] if (6 * (sum2 % 255) + sum1 % 255) % 10 == expected else []
+
+    def extend(start: int, total1: int, total2: int, chosen: tuple):
+        for index in range(start, len(deltas)):
+            entry = deltas[index]
+            picked = chosen + (entry,)
+            if (6 * ((total2 + entry[5]) % 255) + (total1 + entry[4]) % 255) % 10 == expected:
+                matches.append(picked)
+            if len(picked) < max_substitutions:
+                extend(following[index], total1 + entry[4], total2 + entry[5], picked)
+
+    if max_substitutions > 0:
+        extend(0, sum1, sum2, ())
+
+    found = []
+    for chosen in matches:
+        chars = list(data)
+        for position, _, replacement, _, _, _ in chosen:
+            chars[position] = replacement
+        found.append((len(chosen), sum(entry[3][0] for entry in chosen), sum(entry[3][1] for entry in chosen),
+                      tuple(entry[0] for entry in chosen),
+                      ''.join(chars), tuple(entry[:3] for entry in chosen)))
+    found.sort(key=lambda item: item[:4])
+    return [(candidate, substitutions) for _, _, _, _, candidate, substitutions in found]
+
+_DIGITS = '0123456789'
+
+
+def _parse_names(name_field: str) -> tuple:
+    """Split an MRZ name field into (last, first, middle)"""
+    # Only the text up to the first '<<' and between the first and second
+    # '<<' count, so partition there instead of splitting all the filler
+    last_name, _, rest = name_field.partition('<<')
+    first_name, _, middle_name = rest.partition('<<')[0].partition('<')  # Split on first single <
+    return last_name.replace('<', ' ').strip(), first_name.strip(), middle_name.replace('<', ' ').strip()
+
+
+def _full_name(first_name: str, middle_name: str, last_name: str) -> str:
+    """' '.join of the non-empty names, without building a list for the usual cases"""
+    if middle_name:
+        if first_name and last_name:
+            return f'{first_name} {middle_name} {last_name}'
+        return ' '.join(filter(None, [first_name, middle_name, last_name]))
+    if first_name and last_name:
+        return f'{first_name} {last_name}'
+    return first_name or last_name
+
+
+def decode_names(lines: list, start: int = 5, stop: int = 44) -> tuple:
+    """Parse the name field ``line[start:stop]`` of many lines in one pass
+
+    Returns ``(last_names, first_names, middle_names, full_names)`` columns
+    holding exactly what decode_mrz gives for each line. Last and first
+    names are interned per call, so a surname shared by many records is
+    one string in the column.
+    """
+    last_names = []
+    first_names = []
+    middle_names = []
+    full_names = []
+    interned = {}
+    intern = interned.setdefault
+    for line in lines:
+        last_name, _, rest = line[start:stop].partition('<<')
+        first_name, _, middle_name = rest.partition('<<')[0].partition('<')
+        last_name = intern(last_name, last_name.replace('<', ' ').strip())
+        first_name = first_name.strip()
+        first_name = intern(first_name, first_name)
+        middle_name = middle_name.replace('<', ' ').strip()
+        last_names.append(last_name)
+        first_names.append(first_name)
+        middle_names.append(middle_name)
+        if middle_name:
+            full_names.append(f'{first_name} {middle_name} {last_name}' if first_name and last_name else
+                              ' '.join(filter(None, [first_name, middle_name, last_name])))
+        else:
+            full_names.append(f'{first_name} {last_name}' if first_name and last_name else
+                              first_name or last_name)
+    return last_names, first_names, middle_names, full_names
+
+
+def _mrz_names(values: list) -> list:
+    """``value.upper().replace(' ', '<')`` for a whole column"""
+    # One pass over the joined column, unless a value holds the separator
+    converted = '\n'.join(values).upper().replace(' ', '<').split('\n')
+    if len(converted) != len(values):
+        converted = [value.upper().replace(' ', '<') for value in values]
+    return converted
+
+
+def encode_names(last_names: list, first_names: list, middle_names: list, width: int = 39) -> list:
+    """Name fields (LAST<<FIRST<MIDDLE padded to ``width``) for columns of names"""
+    return [
+        (f'{last}<<{first}<{middle}' if middle else f'{last}<<{first}').ljust(width, '<')[:width]
+        for last, first, middle in zip(_mrz_names(last_names), _mrz_names(first_names), _mrz_names(middle_names))
+    ]
+
+
+def _join_names(fields: dict) -> str:
+    """Contents of the name field for encoding: LAST<<FIRST<MIDDLE"""
+    name_part = (fields.get('last_name', '').upper().replace(' ', '<') + '<<' +
+                 fields.get('first_name', '').upper().replace(' ', '<'))
+    middle_name = fields.get('middle_name', '')
+    if middle_name:
+        name_part += '<' + middle_name.upper().replace(' ', '<')  # Single < separator for middle name
+    return name_part
+
+
+# Encode formatters: expressions over the field's {value} and {width}
+ALPHANUMERIC = "{value}.upper().ljust({width}, '<')[:{width}]"
+CODE = "{value}.upper().ljust({width})[:{width}]"
+PADDED = "{value}.ljust({width}, '<')[:{width}]"
+SPACED = "{value}.ljust({width})[:{width}]"
+INITIAL = "{value}.upper()[0]"
+# Not padded, so a short value shifts everything after it on the line
+UNPADDED = "{value}.upper().replace(' ', '<')[:{width}]"
+VERBATIM = "{value}"
+
+
+class MRZLayout:
+    """Field layout of one MRZ document format, compiled for encode/decode/verify
+
+    ``lines`` gives, for each line, its fields in order as
+    ``(name, start, stop, formatter, check)``: the slice the field occupies,
+    the formatter encode applies to it and the position of its check digit
+    on the same line (None when it has none). Anything not covered is '<'
+    filler. A field called 'names' holds the name field and decodes into
+    last/first/middle/full names. ``composite`` is ``(line, position,
+    ((line, start, stop), ...))`` for formats with a composite check digit
+    over several ranges.
+
+    The spec is compiled into straight-line Python functions with every
+    slice and check digit spelled out, so a layout runs as fast as a
+    hand-written decoder for it. Each function is compiled on first use,
+    so importing the module builds none of them.
+    """
+
+    def __init__(self, name: str, line_length: int, lines: tuple, defaults: dict = None, composite: tuple = None):
+        self.name = name
+        self.line_length = line_length
+        self.line_count = len(lines)
+        self.lines = lines
+        self.defaults = defaults or {}
+        self.composite = composite
+
+        # (field, data expression, check digit expression) in spec order
+        self._checks = []
+        for index, fields in enumerate(lines):
+            for field, start, stop, _, check in fields:
+                if check is not None:
+                    self._checks.append((field, f'line{index + 1}[{start}:{stop}]', f'line{index + 1}[{check}]'))
+        if composite is not None:
+            line, check, ranges = composite
+            data = ' + '.join(f'line{source + 1}[{start}:{stop}]' for source, start, stop in ranges)
+            self._checks.append(('composite', data, f'line{line + 1}[{check}]'))
+
+        # One validity bit per check digit, in spec order
+        self.check_fields = tuple(field for field, _, _ in self._checks)
+        self.all_valid = (1 << len(self._checks)) - 1
+
+        self._arguments = ', '.join(f'line{index + 1}' for index in range(self.line_count))
+
+    @functools.cached_property
+    def decode(self):
+        statements, decoded = self._decoded()
+        return self._compile('decode', '\n    '.join(statements + [f'return {decoded}']))
+
+    def _mask(self) -> list:
+        """Statements setting ``mask`` to the validity bits of every check digit"""
+        return ['mask = 0'] + [f'if _DIGITS[calculate_check_digit({data})] == {expected}: mask |= {1 << bit}'
+                               for bit, (_, data, expected) in enumerate(self._checks)]
+
+    @functools.cached_property
+    def parse_and_verify(self):
+        statements, decoded = self._decoded()
+        return self._compile('parse_and_verify', '\n    '.join(statements + self._mask() +
+                                                               [f'return {decoded}, mask']))
+
+    @functools.cached_property
+    def check_mask(self):
+        """The validity mask of parse_and_verify alone, without decoding anything"""
+        return self._compile('check_mask', '\n    '.join(self._mask() + ['return mask']))
+
+    @functools.cached_property
+    def verify(self):
+        return self.verifier()
+
+    @functools.cached_property
+    def encode(self):
+        return self._compile_encode()
+
+    def __repr__(self):
+        return f"MRZLayout({self.name!r}, {self.line_count}x{self.line_length})"
+
+    def _compile(self, function: str, body: str, arguments: str = None):
+        """Build ``function`` from source; lines are padded to length on entry"""
+        if arguments is None:
+            arguments = self._arguments
+            padding = '<' * (self.line_length + 1)
+            body = ''.join(f"line{index + 1} = (line{index + 1} + {padding!r})[:{self.line_length}]\n    "
+                           for index in range(self.line_count)) + body
+        namespace = {}
+        exec(f"def {function}({arguments}):\n    {body}\n", globals(), namespace)
+        return namespace[function]
+
+    def _decoded(self) -> tuple:
+        """Source of (statements, expression) building the decoded dict"""
+        statements = []
+        parts = []
+        for index, fields in enumerate(self.lines):
+            line = f'line{index + 1}'
+            items = []
+            for field, start, stop, _, check in fields:
+                if field == 'names':
+                    last, first, middle = (f'{part}_name{index + 1}' for part in ('last', 'first', 'middle'))
+                    statements.append(f'{last}, {first}, {middle} = _parse_names({line}[{start}:{stop}])')
+                    items += [f"'last_name': {last}", f"'first_name': {first}", f"'middle_name': {middle}",
+                              f"'full_name': _full_name({first}, {middle}, {last})"]
+                    continue
+                items.append(f"{field!r}: {line}[{start}]" if stop == start + 1 else
+                             f"{field!r}: {line}[{start}:{stop}]")
+                if check is not None:
+                    items.append(f"'{field}_check_digit': {line}[{check}]")
+            if self.composite is not None and self.composite[0] == index:
+                items.append(f"'composite_check_digit': {line}[{self.composite[1]}]")
+            parts.append(f"{line!r}: {{{', '.join(items)}}}")
+        return statements, f"{{{', '.join(parts)}}}"
+
+    def verifier(self, fields: tuple = None):
+        """verify_mrz-style function over the check digits of ``fields`` (all by default)"""
+        labels = ', '.join(f"'line{index + 1}': line{index + 1}" for index in range(self.line_count))
+        statements, decoded = self._decoded()
+        body = statements + [f"results = {{'valid': True, 'details': {{}}, 'calculated': {{}}, "
+                             f"'debug': {{{labels}, 'decoded': {decoded}}}}}"]
+        for field, data, expected in self._checks:
+            if fields is None or field in fields:
+                body += [f"calculated = _DIGITS[calculate_check_digit({data})]",
+                         f"results['calculated'][{field!r}] = calculated",
+                         f"results['details'][{field!r}] = calculated == {expected}",
+                         f"if calculated != {expected}: results['valid'] = False"]
+        return self._compile('verify', '\n    '.join(body + ['return results']))
+
+    def _compile_encode(self):
+        body = []
+        lines = []
+        for index, fields in enumerate(self.lines):
+            parts = []
+            position = 0
+            for number, (field, start, stop, formatter, check) in enumerate(fields):
+                value = '_join_names(fields)' if field == 'names' else \
+                    f"fields.get({field!r}, {self.defaults.get(field, '')!r})"
+                variable = f'field{index + 1}_{number}'
+                body.append(f"{variable} = {formatter.format(value=value, width=stop - start)}")
+                if start > position:
+                    parts.append(repr('<' * (start - position)))
+                parts.append(variable)
+                position = stop
+                if check is not None:
+                    if check > stop:
+                        parts.append(repr('<' * (check - stop)))
+                    # Computed here so errors surface in field order
+                    body.append(f"check{index + 1}_{number} = _DIGITS[calculate_check_digit({variable})]")
+                    parts.append(f'check{index + 1}_{number}')
+                    position = check + 1
+            lines.append(f"({' + '.join(parts) or repr('')}).ljust({self.line_length}, '<')[:{self.line_length}]")
+        body += [f'line{index + 1} = {line}' for index, line in enumerate(lines)]
+        if self.composite is not None:
+            line, check, _ = self.composite
+            data = next(data for field, data, _ in self._checks if field == 'composite')
+            body.append(f"line{line + 1} = line{line + 1}[:{check}] + _DIGITS[calculate_check_digit({data})] + "
+                        f"line{line + 1}[{check + 1}:]")
+        body.append(f'return {self._arguments},')
+        return self._compile('encode', '\n    '.join(body), arguments='fields')
+
+
+
+# ICAO 9303 TD3 (passport) as this module has always encoded it: no
+# composite digit, the personal number digit at 43, and the issuing
+# country, dates and personal number are taken without normalising
+TD3 = MRZLayout('TD3', 44, (
+    (('document_type', 0, 1, VERBATIM, None),
+     ('issuing_country', 2, 5, SPACED, None),
+     ('names', 5, 44, PADDED, None)),
+    (('passport_number', 0, 9, ALPHANUMERIC, 9),
+     ('country_code', 10, 13, CODE, None),
+     ('birth_date', 13, 19, PADDED, 19),
+     ('sex', 20, 21, INITIAL, None),
+     ('expiration_date', 21, 27, PADDED, 27),
+     ('personal_number', 28, 37, UNPADDED, 43)),
+), defaults={'document_type': 'P', 'sex': '<'})
+
+# ICAO 9303 TD1 (identity card, 3x30)
+TD1 = MRZLayout('TD1', 30, (
+    (('document_type', 0, 2, ALPHANUMERIC, None),
+     ('issuing_country', 2, 5, ALPHANUMERIC, None),
+     ('document_number', 5, 14, ALPHANUMERIC, 14),
+     ('optional_data', 15, 30, ALPHANUMERIC, None)),
+    (('birth_date', 0, 6, PADDED, 6),
+     ('sex', 7, 8, ALPHANUMERIC, None),
+     ('expiration_date', 8, 14, PADDED, 14),
+     ('country_code', 15, 18, ALPHANUMERIC, None),
+     ('optional_data_2', 18, 29, ALPHANUMERIC, None)),
+    (('names', 0, 30, PADDED, None),),
+), defaults={'document_type': 'I'}, composite=(1, 29, ((0, 5, 30), (1, 0, 7), (1, 8, 15), (1, 18, 29))))
+
+# ICAO 9303 TD2 (identity card or visa, 2x36)
+TD2 = MRZLayout('TD2', 36, (
+    (('document_type', 0, 2, ALPHANUMERIC, None),
+     ('issuing_country', 2, 5, ALPHANUMERIC, None),
+     ('names', 5, 36, PADDED, None)),
+    (('document_number', 0, 9, ALPHANUMERIC, 9),
+     ('country_code', 10, 13, ALPHANUMERIC, None),
+     ('birth_date', 13, 19, PADDED, 19),
+     ('sex', 20, 21, ALPHANUMERIC, None),
+     ('expiration_date', 21, 27, PADDED, 27),
+     ('optional_data', 28, 35, ALPHANUMERIC, None)),
+), defaults={'document_type': 'I'}, composite=(1, 35, ((1, 0, 10), (1, 13, 20), (1, 21, 35))))
+
+LAYOUTS = {layout.name: layout for layout in (TD1, TD2, TD3)}
+
+
+def detect_layout(lines) -> MRZLayout:
+    """The layout whose line count and line length match ``lines``"""
+    for layout in LAYOUTS.values():
+        if len(lines) == layout.line_count and all(len(line) == layout.line_length for line in lines):
+            return layout
+    raise ValueError(f"No MRZ layout has {len(lines)} lines of {', '.join(str(len(line)) for line in lines)} characters.")
+
+def _verify_td3(line1: str, line2: str) -> dict:
+    """Compile the verifier behind verify_mrz on first use, then hand over to it"""
+    global _verify_td3
+    # verify_mrz leaves the personal number digit to verify_check_digits
+    _verify_td3 = TD3.verifier(('passport_number', 'birth_date', 'expiration_date'))
+    return _verify_td3(line1, line2)
+
 #This function isnt neccessary but is useful for testing
 def verify_mrz(line1: str, line2: str) -> dict:
     """Precision MRZ verification with exact field handling"""
-    # Perfect padding and truncation
-    line1 = (line1 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
-    line2 = (line2 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
-    
-    if len(line1) != 44 or len(line2) != 44:
-        raise ValueError("Each MRZ line must be exactly 44 characters.")
+    return _verify_td3(line1, line2)
 
+def decode_mrz(line1: str, line2: str) -> dict:
+    """Decode MRZ lines with perfect name handling"""
+    return TD3.decode(line1, line2)
 
-    # Precise name component separation
-    name_parts = line1[5:].split('<<')
-    last_name = name_parts[0].replace('<', ' ').strip()
-    
-    # Handle first and middle names correctly
-    if len(name_parts) > 1:
-        first_middle = name_parts[1].split('<', 1)  # Split on first single <
-        first_name = first_middle[0].strip()
-        middle_name = first_middle[1].replace('<', ' ').strip() if len(first_middle) > 1 else ''
-    else:
-        first_name = ''
-        middle_name = ''
-    
-    decoded = {
-        'line1': {
-            'document_type': line1[0],
-            'issuing_country': line1[2:5],
-            'last_name': last_name,
-            'first_name': first_name,  # Now only first name
-            'middle_name': middle_name,  # Properly separated middle name
-            'full_name': ' '.join(filter(None, [first_name, middle_name, last_name]))
-        },
-        'line2': {
-            'passport_number': line2[0:9],
-            'passport_number_check_digit': line2[9],
-            'country_code': line2[10:13],
-            'birth_date': line2[13:19],
-            'birth_date_check_digit': line2[19],
-            'sex': line2[20],
-            'expiration_date': line2[21:27],
-            'expiration_date_check_digit': line2[27],
-            'personal_number': line2[28:37],  # 14 characters (28–41)
-            'personal_number_check_digit': line2[43],  # actual check digit at position 43
-        }
-    }
+def _line_field(start: int, stop: int) -> property:
+    """Read-only attribute slicing the joined line pair of an MRZRecord"""
+    return property(lambda self: self._lines[start:stop])
 
-    results = {
-        'valid': True,
-        'details': {},
-        'calculated': {},
-        'debug': {
-            'line1': line1,
-            'line2': line2,
-            'decoded': decoded
-        }
-    }
-    
 
-    def _verify(field: str, data: str, expected: str):
-        """Precision verification with exact matching"""
-        calculated = str(calculate_check_digit(data)) if data else '0'
-        results['calculated'][field] = calculated
-        is_valid = calculated == expected
-        results['details'][field] = is_valid
-        if not is_valid:
-            results['valid'] = False
+class MRZRecord:
+    """Compact decoded TD3 record
 
-    # Exact field verifications
-    _verify('passport_number', decoded['line2']['passport_number'], 
-            decoded['line2']['passport_number_check_digit'])
-    _verify('birth_date', decoded['line2']['birth_date'],
-            decoded['line2']['birth_date_check_digit'])
-    _verify('expiration_date', decoded['line2']['expiration_date'],
-            decoded['line2']['expiration_date_check_digit'])
+    Holds only the 88-character line pair; every field is sliced out of it
+    on access instead of being stored, so a record costs one small object
+    plus one string. ``to_dict()`` returns the same shape as ``decode_mrz``.
+    """
 
-    
-    return results
+    __slots__ = ('_lines',)
 
-def decode_mrz(line1: str, line2: str) -> dict:
-    """Decode MRZ lines with perfect name handling"""
-    line1 = (line1 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
-    line2 = (line2 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
+    def __init__(self, line1: str, line2: str):
+        line1 = (line1 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
+        line2 = (line2 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
+        self._lines = line1 + line2
 
-    if len(line1) != 44 or len(line2) != 44:
-        raise ValueError("Each MRZ line must be exactly 44 characters.")
+    # Line 1 (offsets 0-43)
+    document_type = _line_field(0, 1)
+    issuing_country = _line_field(2, 5)
 
-    
-    # Precise name parsing (same as verify_mrz)
-    name_parts = line1[5:].split('<<')
-    last_name = name_parts[0].replace('<', ' ').strip()
-    
-    if len(name_parts) > 1:
-        first_middle = name_parts[1].split('<', 1)
-        first_name = first_middle[0].strip()
-        middle_name = first_middle[1].replace('<', ' ').strip() if len(first_middle) > 1 else ''
-    else:
-        first_name = ''
-        middle_name = ''
-    
-    return {
-        'line1': {
-            'document_type': line1[0],
-            'issuing_country': line1[2:5],
-            'last_name': last_name,
-            'first_name': first_name,
-            'middle_name': middle_name,
-            'full_name': ' '.join(filter(None, [first_name, middle_name, last_name]))
-        },
-        'line2': {
-            'passport_number': line2[0:9],
-            'passport_number_check_digit': line2[9],
-            'country_code': line2[10:13],
-            'birth_date': line2[13:19],
-            'birth_date_check_digit': line2[19],
-            'sex': line2[20],
-            'expiration_date': line2[21:27],
-            'expiration_date_check_digit': line2[27],
-            'personal_number': line2[28:37],  # 14 characters (28–41)
-            'personal_number_check_digit': line2[43],  # actual check digit at position 43
-            # No need for filler in TD3; it's all one field.
-        },
+    # Line 2 (offsets 44-87)
+    passport_number = _line_field(44, 53)
+    passport_number_check_digit = _line_field(53, 54)
+    country_code = _line_field(54, 57)
+    birth_date = _line_field(57, 63)
+    birth_date_check_digit = _line_field(63, 64)
+    sex = _line_field(64, 65)
+    expiration_date = _line_field(65, 71)
+    expiration_date_check_digit = _line_field(71, 72)
+    personal_number = _line_field(72, 81)
+    personal_number_check_digit = _line_field(87, 88)
 
-    }
+    @property
+    def line1(self) -> str:
+        return self._lines[:44]
+
+    @property
+    def line2(self) -> str:
+        return self._lines[44:]
+
+    @property
+    def last_name(self) -> str:
+        return _parse_names(self._lines[5:44])[0]
+
+    @property
+    def first_name(self) -> str:
+        return _parse_names(self._lines[5:44])[1]
+
+    @property
+    def middle_name(self) -> str:
+        return _parse_names(self._lines[5:44])[2]
+
+    @property
+    def full_name(self) -> str:
+        last_name, first_name, middle_name = _parse_names(self._lines[5:44])
+        return _full_name(first_name, middle_name, last_name)
+
+    def to_dict(self) -> dict:
+        """Decode into the nested dict decode_mrz returns"""
+        return TD3.decode(self._lines[:44], self._lines[44:])
+
+    def __eq__(self, other):
+        if not isinstance(other, MRZRecord):
+            return NotImplemented
+        return self._lines == other._lines
+
+    def __hash__(self):
+        return hash(self._lines)
+
+    def __repr__(self):
+        return f"MRZRecord({self.line1!r}, {self.line2!r})"
 
 def encode_mrz(fields: dict) -> tuple:
+    """Encode a dict of fields into TD3 (line1, line2)"""
+    return TD3.encode(fields)
+
+def encode_mrz_batch(columns: dict) -> tuple:
+    """Encode many records at once from columnar inputs
+
+    ``columns`` maps the field names ``encode_mrz`` accepts to equal-length
+    sequences; a missing column takes ``encode_mrz``'s default. Each field is
+    normalised column by column and check digits are computed per column, so
+    repeated values (dates especially) are only checksummed once.
+
+    Returns ``(line1_rows, line2_rows)``: two lists of rows holding exactly
+    what ``encode_mrz`` returns for each record, UTF-8 encoded as the
+    text-mode processor wrote them. Rows are 44 bytes unless a name or
+    country is non-ASCII, which encode_mrz passes through as-is.
+    """
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("All MRZ columns must have the same length.")
+    count = lengths.pop() if lengths else 0
+
+    def column(name: str, default: str):
+        values = columns.get(name)
+        return [default] * count if values is None else values
 
     # ===== Line 1 Construction =====
-    # Document type and fixed '<'
-    line1 = fields.get('document_type', 'P') + '<'
-    
-    # Issuing country (3 chars)
-    line1 += fields.get('issuing_country', '').upper().ljust(3)[:3]
-    
-    # Name components (last<<first<<middle)
-    last_name = fields.get('last_name', '').upper().replace(' ', '<')
-    first_name = fields.get('first_name', '').upper().replace(' ', '<')
-    middle_name = fields.get('middle_name', '').upper().replace(' ', '<')
-    
-    # Build name component
-    name_part = f"{last_name}<<{first_name}"
-    if middle_name:
-        name_part += f"<{middle_name}"  # Single < separator for middle name
-    
-    # Build line1
-    line1 = (
-        fields.get('document_type', 'P') + '<' +
-        fields.get('issuing_country', '').ljust(3)[:3] +
-        name_part.ljust(39, '<')[:39]
-    ).ljust(44, '<')[:44]
+    names = encode_names(column('last_name', ''), column('first_name', ''), column('middle_name', ''))
+
+    line1_rows = [
+        (doc + '<' + country.ljust(3)[:3] + name).ljust(44, '<')[:44].encode('utf-8')
+        for doc, country, name in zip(column('document_type', 'P'),
+                                      column('issuing_country', ''),
+                                      names)
+    ]
 
     # ===== Line 2 Construction =====
-    line2 = ''
-    
-    # Passport number (9 chars) + check digit
-    passport_num = fields.get('passport_number', '').upper().ljust(9, '<')[:9]
-    passport_check = str(calculate_check_digit(passport_num))
-    line2 += passport_num + passport_check
-    
-    # Country code (3 chars)
-    line2 += fields.get('country_code', '').upper().ljust(3)[:3]
-    
-    # Birth date (YYMMDD) + check digit
-    birth_date = fields.get('birth_date', '').ljust(6, '<')[:6]
-    birth_check = str(calculate_check_digit(birth_date))
-    line2 += birth_date + birth_check
-    
-    # Sex (1 char)
-    line2 += fields.get('sex', '<').upper()[0]
-    
-    # Expiration date (YYMMDD) + check digit
-    exp_date = fields.get('expiration_date', '').ljust(6, '<')[:6]
-    exp_check = str(calculate_check_digit(exp_date))
-    line2 += exp_date + exp_check
-    
-    # Personal number (up to 9 chars) + filler + check digit
-    # Personal number (9 characters max)
-    personal_num = fields.get('personal_number', '').upper().replace(' ', '<')[:9]
+    # Same field order as encode_mrz, so a bad record raises what encode_mrz would
+    passport_nums = [value.upper().ljust(9, '<')[:9] for value in column('passport_number', '')]
+    passport_checks = calculate_check_digits(passport_nums)
+    country_codes = [value.upper().ljust(3)[:3] for value in column('country_code', '')]
+    birth_dates = [value.ljust(6, '<')[:6] for value in column('birth_date', '')]
+    birth_checks = calculate_check_digits(birth_dates)
+    sexes = [value.upper()[0] for value in column('sex', '<')]
+    exp_dates = [value.ljust(6, '<')[:6] for value in column('expiration_date', '')]
+    exp_checks = calculate_check_digits(exp_dates)
+    personal_nums = [value.upper().replace(' ', '<')[:9] for value in column('personal_number', '')]
 
-    # Filler (6 characters, positions 37–42)
-    filler = '<' * 6
+    line2_rows = [
+        (passport + _DIGITS[passport_check] + country +
+         birth + _DIGITS[birth_check] + sex +
+         exp + _DIGITS[exp_check] +
+         personal + '<<<<<<' + _DIGITS[personal_check]).ljust(44, '<').encode('utf-8')
+        for passport, passport_check, country, birth, birth_check, sex,
+            exp, exp_check, personal, personal_check in zip(
+                passport_nums, passport_checks,
+                country_codes,
+                birth_dates, birth_checks,
+                sexes,
+                exp_dates, exp_checks,
+                personal_nums, calculate_check_digits(personal_nums))
+    ]
 
-    personal_check = str(calculate_check_digit(personal_num))
+    return line1_rows, line2_rows
 
+# Bits of the validity mask returned by parse_and_verify
+PASSPORT_NUMBER_VALID = 1
+BIRTH_DATE_VALID = 2
+EXPIRATION_DATE_VALID = 4
+PERSONAL_NUMBER_VALID = 8
+ALL_VALID = PASSPORT_NUMBER_VALID | BIRTH_DATE_VALID | EXPIRATION_DATE_VALID | PERSONAL_NUMBER_VALID
 
-    # Add to line2 (positions 28–43)
-    line2 += personal_num   # 28–36
-    line2 += filler         # 37–42
-    line2 += personal_check # 43
 
+def parse_and_verify(line1: str, line2: str) -> tuple:
+    """Decode and verify an MRZ in a single pass
+
+    Each line is padded and sliced once; the decoded dict is the one
+    decode_mrz returns and the check digits are the four verify_check_digits
+    covers (the personal number digit sits at position 43 in this layout,
+    where ICAO TD3 puts the composite digit, so there is no separate
+    composite digit to check).
+
+    Returns ``(decoded, mask)``; ``mask`` has a ``*_VALID`` bit set for every
+    check digit that matches, so the document is valid when it equals
+    ``ALL_VALID``.
+    """
+    return TD3.parse_and_verify(line1, line2)
+
+class CheckDigitDiagnostics:
+    """Sink for the check digit mismatches verify_check_digits finds
+
+    Always counts mismatches per field in ``counts``. With ``collect`` set,
+    each mismatch is also kept in ``mismatches``; ``callback`` and
+    ``logger`` receive every mismatch as it happens. Nothing is written
+    anywhere unless a callback or logger does so.
+    """
+
+    def __init__(self, collect: bool = False, callback=None, logger=None):
+        self.collect = collect
+        self.callback = callback
+        self.logger = logger
+        self.counts = {}
+        self.mismatches = []
+
+    def record(self, field_name: str, data: str, calculated: str, expected: str):
+        self.counts[field_name] = self.counts.get(field_name, 0) + 1
+        if self.collect or self.callback is not None or self.logger is not None:
+            mismatch = {
+                'field': field_name,
+                'data': data,
+                'calculated': calculated,
+                'expected': expected,
+            }
+            if self.collect:
+                self.mismatches.append(mismatch)
+            if self.callback is not None:
+                self.callback(mismatch)
+            if self.logger is not None:
+                self.logger.debug("Check digit mismatch for %s: data %r, calculated %s vs expected %s",
+                                  field_name, data, calculated, expected)
+
+    def reset(self):
+        self.counts = {}
+        self.mismatches = []
+
+
+# Process-wide sink used when verify_check_digits is not given one
+DIAGNOSTICS = CheckDigitDiagnostics()
 
-    if len(line2) < 44:
-        line2 = line2.ljust(44, '<')    
-    return line1, line2
 
-def verify_check_digits(mrz_data: dict) -> dict:
+def verify_check_digits(mrz_data: dict, diagnostics: CheckDigitDiagnostics = None) -> dict:
     results = {
         'valid': True,
         'details': {},
         'composite_data': None
     }
+    sink = DIAGNOSTICS if diagnostics is None else diagnostics
 
     def _verify(field_name: str, data: str, expected: str) -> bool:
-        """Helper function with debug output"""
+        """Helper function reporting mismatches to the diagnostics sink"""
         calculated = str(calculate_check_digit(data))
         is_valid = calculated == expected
         if not is_valid:
-            print(f"Check digit mismatch for {field_name}:")
-            print(f"Data: '{data}' (len:{len(data)})")
-            print(f"Calculated: {calculated} vs Expected: {expected}")
+            sink.record(field_name, data, calculated, expected)
         return is_valid
 
     line2 = mrz_data['line2']
@@ -1,9 +1,18 @@
 import unittest
 import importlib
+import contextlib
+import io
+import re
+import os
+import subprocess
+import tempfile
 import MRTD
 from mutpy import commandline
 import sys
 
+# Import MRTD and verify one MRZ in a fresh interpreter, in ms
+COLD_START_BUDGET_MS = 10
+
 
 class TestMRTD(unittest.TestCase):
 
@@ -12,6 +21,93 @@ class TestMRTD(unittest.TestCase):
         scan_mrz = MRTD.scan_mrz
         self.assertIsNone(scan_mrz())
 
+    def test_scan_mrz_corrects_ocr_noise(self):
+        fields = {
+            'document_type': 'P',
+            'issuing_country': 'UTO',
+            'last_name': 'ERIKSSON',
+            'first_name': 'ANNA',
+            'middle_name': 'MARIA',
+            'passport_number': 'L898902C3',
+            'country_code': 'UTO',
+            'birth_date': '740812',
+            'sex': 'F',
+            'expiration_date': '120415',
+            'personal_number': 'ZE184226B'
+        }
+        line1, line2 = MRTD.encode_mrz(fields)
+        other = MRTD.encode_mrz(dict(fields, last_name='DOE', passport_number='X12345678'))
+        # Lowercase, '«' filler, O for 0 in the passport number and birth date, K for '<'
+        noisy1 = line1.lower().replace('<<<<', '\u00ab<<', 1)
+        noisy2 = line2[:5] + 'O' + line2[6:15] + 'O' + line2[16:39] + 'K' + line2[40:]
+        text = (f"OCR page 1\r\n{noisy1}\r\n  {noisy2}  \r\n\r\n"
+                f"{'P<UTOBROKEN':<<44}\nnot an mrz\n"
+                f"{other[0]} {other[1]}\n")
+        chunks = [text[i:i + 7] for i in range(0, len(text), 7)]
+
+        records = list(MRTD.scan_mrz(iter(chunks)))
+        self.assertEqual(records, [MRTD.decode_mrz(line1, line2), MRTD.decode_mrz(*other)])
+        self.assertEqual(list(MRTD.scan_mrz(chunks, max_corrections=0)), [MRTD.decode_mrz(*other)])
+
+    def test_scan_mrz_any_chunk_boundary(self):
+        line1, line2 = MRTD.encode_mrz({'document_type': 'P', 'issuing_country': 'UTO', 'last_name': 'ERIKSSON',
+                                        'first_name': 'ANNA', 'passport_number': 'L898902C3',
+                                        'country_code': 'UTO', 'birth_date': '740812', 'sex': 'F',
+                                        'expiration_date': '120415', 'personal_number': 'ZE184226B'})
+        # Line 2 wrapped after 40 characters, with CRLF breaks and a blank line between the halves
+        text = f"{line1}\r\n{line2[:40]}\r\n\r\n{line2[40:]}\r\n"
+        expected = [MRTD.decode_mrz(line1, line2)]
+        self.assertEqual(list(MRTD.scan_mrz([text])), expected)
+        for cut in range(len(text) + 1):
+            self.assertEqual(list(MRTD.scan_mrz([text[:cut], text[cut:]])), expected, cut)
+        for pattern in (r'(?=[\r\n])', r'(?<=[\r\n])', r'(?<=\r)'):
+            self.assertEqual(list(MRTD.scan_mrz(re.split(pattern, text))), expected, pattern)
+
+    def test_correct_check_digit_ranks_candidates(self):
+        candidates = MRTD.correct_check_digit('L8989O2C3', 2)
+        self.assertEqual(candidates[0], ('L898902C3', ((5, 'O', '0'),)))
+        self.assertEqual(MRTD.correct_check_digit('L898902C3', '2')[0], ('L898902C3', ()))
+        self.assertEqual(MRTD.correct_check_digit('L8989O2C3', 2, max_substitutions=0), [])
+        # Lowercase OCR text is corrected like uppercase
+        self.assertEqual(MRTD.correct_check_digit('l8989o2c3', 2)[0], ('L898902C3', ((5, 'O', '0'),)))
+        for expected in ('<', '', '12', 10, -1, None):
+            with self.assertRaises(ValueError):
+                MRTD.correct_check_digit('L898902C3', expected)
+
+        for data, expected in (('L8989O2C3', 2), ('ZE1B4226B', 6), ('740B12', 3), ('', 0), ('K<<', 1)):
+            candidates = MRTD.correct_check_digit(data, expected)
+            counts = [len(substitutions) for _, substitutions in candidates]
+            self.assertEqual(counts, sorted(counts))
+            self.assertLessEqual(max(counts, default=0), 2)
+            for candidate, substitutions in candidates:
+                self.assertEqual(MRTD.calculate_check_digit(candidate), expected)
+                self.assertEqual(sum(a != b for a, b in zip(candidate, data)), len(substitutions))
+                for position, read, replacement in substitutions:
+                    self.assertEqual((data[position], candidate[position]), (read, replacement))
+                    self.assertIn(replacement, MRTD.OCR_CONFUSIONS[read])
+
+    def test_cold_start_within_budget(self):
+        # Fresh interpreter with cached bytecode, as on a kiosk: import MRTD and verify one MRZ
+        code = ("import sys, time\n"
+                "start = time.perf_counter()\n"
+                "import MRTD\n"
+                "result = MRTD.verify_mrz('P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<', "
+                "'L898902C32UTO7408123F1204154ZE184226B<<<<<<6')\n"
+                "elapsed = (time.perf_counter() - start) * 1e3\n"
+                "print(result['valid'], 'pprint' in sys.modules, 'decode' in vars(MRTD.TD1), elapsed)\n")
+        env = {key: value for key, value in os.environ.items() if key != 'PYTHONDONTWRITEBYTECODE'}
+        timings = []
+        with tempfile.TemporaryDirectory() as pycache:
+            for _ in range(4):
+                result = subprocess.run([sys.executable, '-X', f'pycache_prefix={pycache}', '-c', code],
+                                        capture_output=True, text=True, check=True, env=env,
+                                        cwd=os.path.dirname(os.path.abspath(MRTD.__file__)))
+                valid, pprint_loaded, td1_compiled, elapsed = result.stdout.split()
+                self.assertEqual((valid, pprint_loaded, td1_compiled), ('True', 'False', 'False'))
+                timings.append(float(elapsed))
+        # The first run compiles the bytecode; best of the rest against the budget
+        self.assertLess(min(timings[1:]), COLD_START_BUDGET_MS)
+
     def test_query_database_exists(self):
         importlib.reload(MRTD)
         query_database = MRTD.query_database
@@ -358,6 +454,287 @@ class TestMRTD(unittest.TestCase):
         self.assertEqual(fletcher16(b"L898902C3"), 33032)
         self.assertEqual(fletcher16(b"0000"), 57792)  # Used internally for <<<< normalization
 
+    def test_calculate_check_digit_matches_fletcher_reference(self):
+        importlib.reload(MRTD)
+        calculate_check_digit = MRTD.calculate_check_digit
+        for data in ['L898902C3', 'l898902c3', '<<<<<<<<<', 'A1<', '~!@ 09az', 'X' * 300, 'ß<ı']:
+            self.assertEqual(calculate_check_digit(data), self.expected_check_digit(data))
+
+    def test_calculate_check_digits_bulk(self):
+        importlib.reload(MRTD)
+        calculate_check_digit = MRTD.calculate_check_digit
+        calculate_check_digits = MRTD.calculate_check_digits
+        fields = ['740812', 'L898902C3', '', '740812', 'ZE184226B']
+        self.assertEqual(calculate_check_digits(fields), [calculate_check_digit(f) for f in fields])
+        self.assertEqual(calculate_check_digits([]), [])
+
+
+    def test_encode_mrz_batch_matches_encode_mrz(self):
+        importlib.reload(MRTD)
+        encode_mrz = MRTD.encode_mrz
+        encode_mrz_batch = MRTD.encode_mrz_batch
+        records = [
+            {
+                'document_type': 'P',
+                'issuing_country': 'UTO',
+                'last_name': 'ERIKSSON',
+                'first_name': 'ANNA',
+                'middle_name': 'MARIA',
+                'passport_number': 'L898902C3',
+                'country_code': 'UTO',
+                'birth_date': '740812',
+                'sex': 'F',
+                'expiration_date': '120415',
+                'personal_number': 'ZE184226B'
+            },
+            {
+                'document_type': 'P',
+                'issuing_country': 'ut',
+                'last_name': 'van der berg',
+                'first_name': 'jan',
+                'middle_name': '',
+                'passport_number': 'x12',
+                'country_code': 'd',
+                'birth_date': '7408',
+                'sex': 'm',
+                'expiration_date': '1204150',
+                'personal_number': 'ab 1'
+            },
+        ]
+        columns = {name: [record[name] for record in records] for name in records[0]}
+        line1_rows, line2_rows = encode_mrz_batch(columns)
+        for record, line1, line2 in zip(records, line1_rows, line2_rows):
+            expected1, expected2 = encode_mrz(record)
+            self.assertEqual(line1, expected1.encode('ascii'))
+            self.assertEqual(line2, expected2.encode('ascii'))
+            self.assertEqual(len(line1), 44)
+            self.assertEqual(len(line2), 44)
+
+    def test_encode_mrz_batch_defaults_and_lengths(self):
+        importlib.reload(MRTD)
+        encode_mrz = MRTD.encode_mrz
+        encode_mrz_batch = MRTD.encode_mrz_batch
+        self.assertEqual(encode_mrz_batch({}), ([], []))
+        line1_rows, line2_rows = encode_mrz_batch({'last_name': ['DOE']})
+        self.assertEqual((line1_rows[0].decode(), line2_rows[0].decode()), encode_mrz({'last_name': 'DOE'}))
+        with self.assertRaises(ValueError):
+            encode_mrz_batch({'last_name': ['DOE'], 'first_name': []})
+
+    def test_mrz_record_matches_decode_mrz(self):
+        importlib.reload(MRTD)
+        MRZRecord = MRTD.MRZRecord
+        decode_mrz = MRTD.decode_mrz
+        cases = [
+            ("P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<", "L898902C36UTO7408122F1204159ZE184226B<<<<<10"),
+            ("P<UTOVAN<DER<BERG<<JAN<<<<<<<<<<<<<<<<<<<<<<", "L898902C36UTO7408122F1204159ZE184226B"),
+            ("P<UTODOE", ""),
+        ]
+        for line1, line2 in cases:
+            record = MRZRecord(line1, line2)
+            decoded = decode_mrz(line1, line2)
+            self.assertEqual(record.to_dict(), decoded)
+            self.assertEqual(record.last_name, decoded['line1']['last_name'])
+            self.assertEqual(record.full_name, decoded['line1']['full_name'])
+            for field, value in decoded['line2'].items():
+                self.assertEqual(getattr(record, field), value)
+            self.assertEqual(len(record.line1 + record.line2), 88)
+
+    def test_mrz_record_is_compact_and_hashable(self):
+        importlib.reload(MRTD)
+        MRZRecord = MRTD.MRZRecord
+        record = MRZRecord("P<UTOERIKSSON<<ANNA<MARIA", "L898902C36UTO7408122F1204159ZE184226B<<<<<10")
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual(record, MRZRecord(record.line1, record.line2))
+        self.assertEqual(len({record, MRZRecord(record.line1, record.line2)}), 1)
+        with self.assertRaises(AttributeError):
+            record.sex = 'M'
+
+    def test_parse_and_verify_matches_decode_and_verify(self):
+        importlib.reload(MRTD)
+        encode_mrz = MRTD.encode_mrz
+        decode_mrz = MRTD.decode_mrz
+        parse_and_verify = MRTD.parse_and_verify
+        fields = {
+            'document_type': 'P',
+            'issuing_country': 'UTO',
+            'last_name': 'ERIKSSON',
+            'first_name': 'ANNA',
+            'middle_name': 'MARIA',
+            'passport_number': 'L898902C3',
+            'country_code': 'UTO',
+            'birth_date': '740812',
+            'sex': 'F',
+            'expiration_date': '120415',
+            'personal_number': 'ZE184226B'
+        }
+        line1, line2 = encode_mrz(fields)
+        decoded, mask = parse_and_verify(line1, line2)
+        self.assertEqual(decoded, decode_mrz(line1, line2))
+        self.assertEqual(mask, MRTD.ALL_VALID)
+
+    def test_parse_and_verify_mask_bits(self):
+        importlib.reload(MRTD)
+        parse_and_verify = MRTD.parse_and_verify
+        line1 = "P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<"
+        line2 = "L898902C36UTO7408125F1204159ZE184226B<<<<<0"
+        decoded, mask = parse_and_verify(line1, line2)
+        self.assertEqual(decoded, MRTD.decode_mrz(line1, line2))
+        self.assertFalse(mask & MRTD.BIRTH_DATE_VALID)
+        self.assertNotEqual(mask, MRTD.ALL_VALID)
+        self.assertEqual(MRTD.TD3.check_mask(line1, line2), mask)
+        for bit, field in ((MRTD.PASSPORT_NUMBER_VALID, 'passport_number'),
+                           (MRTD.BIRTH_DATE_VALID, 'birth_date'),
+                           (MRTD.EXPIRATION_DATE_VALID, 'expiration_date'),
+                           (MRTD.PERSONAL_NUMBER_VALID, 'personal_number')):
+            expected = str(MRTD.calculate_check_digit(decoded['line2'][field])) == decoded['line2'][field + '_check_digit']
+            self.assertEqual(bool(mask & bit), expected)
+
+    def test_verify_check_digits_is_silent_and_counts_mismatches(self):
+        importlib.reload(MRTD)
+        decode_mrz = MRTD.decode_mrz
+        verify_check_digits = MRTD.verify_check_digits
+        line1 = "P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<"
+        line2 = "L898902C30UTO7408125F1204159ZE184226B<<<<<0"
+        decoded = decode_mrz(line1, line2)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = verify_check_digits(decoded)
+        self.assertEqual(output.getvalue(), '')
+        self.assertFalse(result['valid'])
+        self.assertEqual(MRTD.DIAGNOSTICS.counts['passport_number'], 1)
+        self.assertEqual(MRTD.DIAGNOSTICS.counts['birth_date'], 1)
+        self.assertEqual(MRTD.DIAGNOSTICS.mismatches, [])
+
+    def test_verify_check_digits_custom_diagnostics(self):
+        importlib.reload(MRTD)
+        decode_mrz = MRTD.decode_mrz
+        verify_check_digits = MRTD.verify_check_digits
+        seen = []
+        diagnostics = MRTD.CheckDigitDiagnostics(collect=True, callback=seen.append)
+        line1 = "P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<"
+        line2 = "L898902C30UTO7408122F1204159ZE184226B<<<<<0"
+        verify_check_digits(decode_mrz(line1, line2), diagnostics)
+        verify_check_digits(decode_mrz(line1, line2), diagnostics)
+        self.assertEqual(diagnostics.counts['passport_number'], 2)
+        self.assertEqual(diagnostics.mismatches, seen)
+        self.assertEqual(seen[0], {
+            'field': 'passport_number',
+            'data': 'L898902C3',
+            'calculated': str(MRTD.calculate_check_digit('L898902C3')),
+            'expected': '0',
+        })
+        self.assertEqual(MRTD.DIAGNOSTICS.counts, {})
+        diagnostics.reset()
+        self.assertEqual((diagnostics.counts, diagnostics.mismatches), ({}, []))
+
+    def test_check_digit_cache_stats_and_results(self):
+        values = ['740812', '740812', 'L898902C3', '120415', '740812']
+        expected = [self.expected_check_digit(data) for data in values]
+        importlib.reload(MRTD)
+        calculate_check_digit = MRTD.calculate_check_digit
+        MRTD.configure_check_digit_cache(maxsize=2)
+        self.assertEqual([calculate_check_digit(data) for data in values], expected)
+        info = MRTD.check_digit_cache_info()
+        self.assertEqual((info.hits, info.misses, info.maxsize, info.currsize), (1, 4, 2, 2))
+
+    def test_check_digit_cache_disable_and_precompute(self):
+        expected_personal = self.expected_check_digit('ZE184226B')
+        expected_birth = self.expected_check_digit('740812')
+        importlib.reload(MRTD)
+        calculate_check_digit = MRTD.calculate_check_digit
+        MRTD.configure_check_digit_cache(maxsize=0)
+        self.assertIsNone(MRTD.check_digit_cache_info())
+        self.assertEqual(calculate_check_digit('ZE184226B'), expected_personal)
+        MRTD.configure_check_digit_cache(precompute_dates=True)
+        self.assertEqual(MRTD.check_digit_cache_info().currsize, 37200)
+        self.assertEqual(calculate_check_digit('740812'), expected_birth)
+        self.assertEqual(MRTD.check_digit_cache_info().hits, 1)
+
+    def test_td3_layout_drives_passport_functions(self):
+        fields = {
+            'document_type': 'P',
+            'issuing_country': 'uto',
+            'last_name': 'ERIKSSON',
+            'first_name': 'ANNA',
+            'middle_name': 'MARIA',
+            'passport_number': 'l898902c3',
+            'country_code': 'ut',
+            'birth_date': '740812',
+            'sex': 'f',
+            'expiration_date': '120415',
+            'personal_number': 'ZE18'
+        }
+        line1, line2 = MRTD.TD3.encode(fields)
+        self.assertEqual((line1, line2), MRTD.encode_mrz(fields))
+        self.assertEqual(MRTD.TD3.decode(line1, line2), MRTD.decode_mrz(line1, line2))
+        self.assertEqual(MRTD.TD3.check_fields,
+                         ('passport_number', 'birth_date', 'expiration_date', 'personal_number'))
+        self.assertEqual(MRTD.TD3.all_valid, MRTD.ALL_VALID)
+        self.assertIs(MRTD.detect_layout((line1, line2)), MRTD.TD3)
+
+    def test_td1_and_td2_round_trip_with_composite(self):
+        fields = {
+            'issuing_country': 'UTO',
+            'document_number': 'D23145890',
+            'last_name': 'ERIKSSON',
+            'first_name': 'ANNA',
+            'middle_name': 'MARIA',
+            'country_code': 'UTO',
+            'birth_date': '740812',
+            'sex': 'F',
+            'expiration_date': '120415',
+        }
+        for layout, shape in ((MRTD.TD1, (30, 30, 30)), (MRTD.TD2, (36, 36))):
+            lines = layout.encode(fields)
+            self.assertEqual(tuple(len(line) for line in lines), shape)
+            self.assertIs(MRTD.detect_layout(lines), layout)
+
+            decoded, mask = layout.parse_and_verify(*lines)
+            self.assertEqual(mask, layout.all_valid)
+            self.assertEqual(decoded, layout.decode(*lines))
+            self.assertEqual(decoded['line1']['document_type'], 'I<')
+            names, numbers = ('line3', 'line1') if layout is MRTD.TD1 else ('line1', 'line2')
+            self.assertEqual(decoded[names]['full_name'], 'ANNA MARIA ERIKSSON')
+            self.assertEqual(decoded[numbers]['document_number'], 'D23145890')
+
+            # Altering an optional field only breaks the composite digit
+            line_index = 0 if layout is MRTD.TD1 else 1
+            altered = list(lines)
+            altered[line_index] = altered[line_index][:-2] + 'Y' + altered[line_index][-1]
+            result = layout.verify(*altered)
+            self.assertFalse(result['valid'])
+            self.assertEqual([field for field, valid in result['details'].items() if not valid], ['composite'])
+
+    def test_detect_layout_rejects_unknown_shapes(self):
+        with self.assertRaises(ValueError):
+            MRTD.detect_layout(('P' * 44, 'P' * 30))
+        with self.assertRaises(TypeError):
+            MRTD.TD1.decode('I<UTO', 'X')
+
+    def test_decode_names_matches_decode_mrz(self):
+        lines = [
+            'P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<',
+            'P<UTODE<LA<CRUZ<<JUAN<<<<<<<<<<<<<<<<<<<<<<<',
+            'P<UTODOE<<<JANE<<<<<<<<<<<<<<<<<<<<<<<<<<<<<',
+            'P<UTOSMITH<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<',
+            'P<UTO<<JOHN<PAUL<GEORGE',
+            'P<UTOO<<A<<B<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<',
+            'P<UTO',
+            'P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<',
+        ]
+        columns = MRTD.decode_names(lines)
+        expected = [MRTD.decode_mrz(line1, '')['line1'] for line1 in lines]
+        for column, key in zip(columns, ('last_name', 'first_name', 'middle_name', 'full_name')):
+            self.assertEqual(column, [decoded[key] for decoded in expected])
+        # Repeated surnames come back as one object
+        self.assertIs(columns[0][0], columns[0][-1])
+
+    def test_encode_names_matches_encode_mrz(self):
+        names = [('Eriksson', 'Anna', 'Maria'), ('de la cruz', 'juan', ''), ('', '', ''),
+                 ('A' * 30, 'B' * 10, 'C'), ('Smith\nJones', 'x', 'y z')]
+        expected = [MRTD.encode_mrz(dict(zip(('last_name', 'first_name', 'middle_name'), name)))[0][5:]
+                    for name in names]
+        self.assertEqual(MRTD.encode_names(*zip(*names)), expected)
 
 if __name__ == '__main__':
     unittest.main(commandline.main(sys.argv))
@@ -0,0 +1,481 @@
+"""Compact binary archive of encoded MRZ line pairs
+
+Layout (all integers little-endian unless noted):
+
+    header   magic b'MRZA', version, record count, block size and the
+             offsets of the two dictionaries and the block index
+    blocks   ``block_size`` records each (the last may be shorter)
+    countries  dictionary: varint count, then varint length + UTF-8 text
+    tokens     name token dictionary: varint count, varint length, then
+               the tokens as UTF-8 joined by '<' (which no token contains)
+    index    one u64 file offset per block
+
+Line pairs that do not fit the TD3 shape are stored raw: a block starts
+with its record count and its raw records, each as its position in the
+block plus both lines as length-prefixed text, so every archive
+round-trips exactly. The block's other records are packed and stored
+column by column:
+
+    id width   1, 2 or 4: bytes per country and name token id
+    symbols    document type, passport number (9), sex and personal
+               number (9) as 20 6-bit symbols, 4 to every 3 bytes (big-endian)
+    dates      birth and expiration date as 20-bit integers in 5 bytes
+    digits     the four check digits as nibbles in 2 bytes
+    countries  ids of the issuing country and nationality
+    names      the number of '<'-separated tokens of each name field,
+               one byte each, then the ids of all the tokens
+
+Each column is unpacked for the whole block at once with bytes slicing,
+translate and big-integer arithmetic, so per record only the fields are
+sliced out. MRZArchive.column formats a single decode_mrz field for
+every record, several times faster than reading the text file and
+decoding every line; iter_decoded builds the full dicts from the columns
+at about the speed of decode_mrz on the text.
+
+    python archive.py pack records_encoded.json records.mrza
+    python archive.py unpack records.mrza records_encoded.json
+"""
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+from MRTD import decode_mrz, decode_names
+
+MAGIC = b'MRZA'
+VERSION = 2
+HEADER = struct.Struct('<4sB3xQIQQQ')
+
+# 6-bit alphabet; the space comes from encode_mrz padding country codes
+SYMBOLS = '<0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ '
+_SYMBOL_VALUES = {symbol: value for value, symbol in enumerate(SYMBOLS)}
+_SYMBOL_BYTES = 15
+_FILLER = '<<<<<<'
+
+# Byte values to text: 6-bit symbol values, and the low/high nibble of a check digit byte
+_SYMBOL_TEXT = SYMBOLS.encode('ascii').ljust(256, b'?')
+_LOW_DIGITS = bytes(48 + (value & 0xF) for value in range(256))
+_HIGH_DIGITS = bytes(48 + (value >> 4) for value in range(256))
+
+_ID_TYPES = {1: 'B', 2: 'H', 4: 'I'}
+
+# Where each decode_mrz field comes from in the unpacked columns
+_LINE1_FIELDS = ('document_type', 'issuing_country', 'last_name', 'first_name', 'middle_name', 'full_name')
+_LINE2_FIELDS = ('passport_number', 'passport_number_check_digit', 'country_code', 'birth_date',
+                 'birth_date_check_digit', 'sex', 'expiration_date', 'expiration_date_check_digit',
+                 'personal_number', 'personal_number_check_digit')
+_SYMBOL_FIELDS = {'document_type': (0, 1), 'passport_number': (1, 10), 'sex': (10, 11), 'personal_number': (11, 20)}
+_DIGIT_FIELDS = {'passport_number_check_digit': 0, 'birth_date_check_digit': 1,
+                 'expiration_date_check_digit': 2, 'personal_number_check_digit': 3}
+_DATE_FIELDS = {'birth_date': 0, 'expiration_date': 20}
+_NAME_FIELDS = {'last_name': 0, 'first_name': 1, 'middle_name': 2, 'full_name': 3}
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos: int) -> tuple:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class _Interner:
+    """Assigns consecutive ids to strings in first-seen order"""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def __call__(self, value: str) -> int:
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def serialize(self, separator: str = None) -> bytes:
+        """Length-prefixed values, or one text joined by ``separator`` when no value contains it"""
+        out = bytearray()
+        _write_varint(out, len(self.values))
+        if separator is not None:
+            encoded = separator.join(self.values).encode('utf-8')
+            _write_varint(out, len(encoded))
+            return bytes(out + encoded)
+        for value in self.values:
+            encoded = value.encode('utf-8')
+            _write_varint(out, len(encoded))
+            out += encoded
+        return bytes(out)
+
+
+def _read_dictionary(data, pos: int, separator: str = None) -> list:
+    count, pos = _read_varint(data, pos)
+    if separator is not None:
+        length, pos = _read_varint(data, pos)
+        return data[pos:pos + length].decode('utf-8').split(separator) if count else []
+    values = []
+    for _ in range(count):
+        length, pos = _read_varint(data, pos)
+        values.append(bytes(data[pos:pos + length]).decode('utf-8'))
+        pos += length
+    return values
+
+
+def _ids(data, typecode: str) -> array:
+    """Little-endian ids of a column as an array"""
+    ids = array(typecode, data)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+def _pack(line1: str, line2: str, countries: _Interner, tokens: _Interner) -> tuple:
+    """Column values of a line pair, or None when it does not fit the packed shape"""
+    if len(line1) != 44 or len(line2) != 44 or line1[1] != '<' or line2[37:43] != _FILLER:
+        return None
+    numeric = line2[13:19] + line2[21:27] + line2[9] + line2[19] + line2[27] + line2[43]
+    if not (numeric.isascii() and numeric.isdigit()):
+        return None
+    symbols = line1[0] + line2[0:9] + line2[20] + line2[28:37]
+    try:
+        packed = 0
+        for symbol in symbols:
+            packed = (packed << 6) | _SYMBOL_VALUES[symbol]
+    except KeyError:
+        return None
+
+    dates = int(line2[13:19]) | int(line2[21:27]) << 20
+    digits = int(line2[9]) | int(line2[19]) << 4 | int(line2[27]) << 8 | int(line2[43]) << 12
+    name_tokens = [tokens(token) for token in line1[5:].rstrip('<').split('<')]
+    return packed, dates, digits, countries(line1[2:5]), countries(line2[10:13]), name_tokens
+
+
+def _write_block(records: list, out: bytearray):
+    """Append one block; ``records`` holds _pack results, or (line1, line2) for raw records"""
+    _write_varint(out, len(records))
+    raw = [(position, record) for position, record in enumerate(records) if len(record) == 2]
+    _write_varint(out, len(raw))
+    for position, lines in raw:
+        _write_varint(out, position)
+        for line in lines:
+            encoded = line.encode('utf-8')
+            _write_varint(out, len(encoded))
+            out += encoded
+
+    packed = [record for record in records if len(record) != 2]
+    country_ids = [country for record in packed for country in record[3:5]]
+    token_ids = [token for record in packed for token in record[5]]
+    largest = max(country_ids + token_ids, default=0)
+    width = 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+    out.append(width)
+    for symbols, _, _, _, _, _ in packed:
+        out += symbols.to_bytes(_SYMBOL_BYTES, 'big')
+    for _, dates, _, _, _, _ in packed:
+        out += dates.to_bytes(5, 'little')
+    for _, _, digits, _, _, _ in packed:
+        out += digits.to_bytes(2, 'little')
+    id_type = _ID_TYPES[width]
+    for column in (array(id_type, country_ids), array('B', [len(record[5]) for record in packed]),
+                   array(id_type, token_ids)):
+        if sys.byteorder == 'big':
+            column.byteswap()
+        out += column.tobytes()
+
+
+def write_archive(pairs, path: str, block_size: int = 256) -> int:
+    """Write (line1, line2) pairs to a binary archive; returns the record count"""
+    countries = _Interner()
+    tokens = _Interner()
+    index = []
+    count = 0
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, block_size, 0, 0, 0))
+        block = []
+        for line1, line2 in pairs:
+            block.append(_pack(line1, line2, countries, tokens) or (line1, line2))
+            count += 1
+            if len(block) == block_size:
+                index.append(f.tell())
+                out = bytearray()
+                _write_block(block, out)
+                f.write(out)
+                block = []
+        if block:
+            index.append(f.tell())
+            out = bytearray()
+            _write_block(block, out)
+            f.write(out)
+
+        countries_offset = f.tell()
+        f.write(countries.serialize())
+        tokens_offset = f.tell()
+        f.write(tokens.serialize('<'))
+        index_offset = f.tell()
+        f.write(struct.pack(f'<{len(index)}Q', *index))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, count, block_size, countries_offset, tokens_offset, index_offset))
+    return count
+
+
+def _name_fields(name_counts: bytes, tokens: list) -> list:
+    """The 39-character name field of every packed record of a block"""
+    fields = []
+    start = 0
+    for count in name_counts:
+        fields.append('<'.join(tokens[start:start + count]).ljust(39, '<'))
+        start += count
+    return fields
+
+
+def _merge(count: int, raw: dict, packed: list) -> list:
+    """A block's packed records with its raw ones put back at their positions"""
+    if not raw:
+        return packed
+    packed = iter(packed)
+    return [raw[position] if position in raw else next(packed) for position in range(count)]
+
+
+class MRZArchive:
+    """Reader for archives produced by write_archive
+
+    Records are unpacked a block at a time. Iteration yields the exact
+    (line1, line2) strings that were packed and iter_decoded yields the
+    dicts decode_mrz gives for them. ``archive[i]`` unpacks the block
+    holding record ``i`` through the index and keeps it, so nearby
+    lookups reuse it.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, block_size, countries_offset, tokens_offset, index_offset = \
+            HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("Not an MRZ archive (bad magic or version).")
+        self._count = count
+        self._block_size = block_size
+        self._countries = _read_dictionary(self._data, countries_offset)
+        self._tokens = _read_dictionary(self._data, tokens_offset, '<')
+        blocks = (count + block_size - 1) // block_size
+        self._index = struct.unpack_from(f'<{blocks}Q', self._data, index_offset)
+        self._cached = (None, None)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def _unpack(self, block: int) -> tuple:
+        """Columns of a block: ``(count, raw, fields)``
+
+        ``raw`` maps positions in the block to their (line1, line2);
+        ``fields`` holds, for the packed records in order, the symbol text
+        (20 characters each), the dates as integers, the check digit text
+        (4 characters each), the countries (2 each), the name token counts
+        and the name tokens.
+        """
+        data = self._data
+        count, pos = _read_varint(data, self._index[block])
+        raw_count, pos = _read_varint(data, pos)
+        raw = {}
+        for _ in range(raw_count):
+            position, pos = _read_varint(data, pos)
+            lines = []
+            for _ in range(2):
+                length, pos = _read_varint(data, pos)
+                lines.append(data[pos:pos + length].decode('utf-8'))
+                pos += length
+            raw[position] = tuple(lines)
+        packed = count - raw_count
+        width = data[pos]
+        pos += 1
+
+        # 4 symbols per 3 bytes: unpack all groups at once, one 6-bit lane per byte
+        groups = 5 * packed
+        symbols = data[pos:pos + 3 * groups]
+        pos += 3 * groups
+        first, second, third = (int.from_bytes(symbols[offset::3], 'big') for offset in range(3))
+        low2, low4, low6 = (int.from_bytes(bytes([mask]) * groups, 'big') for mask in (0x03, 0x0F, 0x3F))
+        text = bytearray(4 * groups)
+        for offset, lane in enumerate(((first >> 2) & low6,
+                                       (first & low2) << 4 | (second >> 4) & low4,
+                                       (second & low4) << 2 | (third >> 6) & low2,
+                                       third & low6)):
+            text[offset::4] = lane.to_bytes(groups, 'big')
+        symbols = text.translate(_SYMBOL_TEXT).decode('ascii')
+
+        # 5-byte dates widened to 8-byte integers
+        widened = bytearray(8 * packed)
+        for offset in range(5):
+            widened[offset::8] = data[pos + offset:pos + 5 * packed:5]
+        dates = _ids(widened, 'Q')
+        pos += 5 * packed
+
+        digit_bytes = data[pos:pos + 2 * packed]
+        pos += 2 * packed
+        digits = bytearray(4 * packed)
+        digits[0::2] = digit_bytes.translate(_LOW_DIGITS)
+        digits[1::2] = digit_bytes.translate(_HIGH_DIGITS)
+        digits = digits.decode('ascii')
+
+        id_type = _ID_TYPES[width]
+        countries = list(map(self._countries.__getitem__, _ids(data[pos:pos + 2 * width * packed], id_type)))
+        pos += 2 * width * packed
+        name_counts = data[pos:pos + packed]
+        pos += packed
+        tokens = list(map(self._tokens.__getitem__, _ids(data[pos:pos + width * sum(name_counts)], id_type)))
+        return count, raw, (symbols, dates, digits, countries, name_counts, tokens)
+
+    def _lines(self, block: int) -> list:
+        """(line1, line2) of every record of a block"""
+        count, raw, (symbols, dates, digits, countries, name_counts, tokens) = self._unpack(block)
+        lines = [
+            (symbols[s] + '<' + issuing_country + name,
+             '%s%s%s%06d%s%s%06d%s%s%s%s' % (
+                 symbols[s + 1:s + 10], digits[d], country_code, date & 0xFFFFF, digits[d + 1],
+                 symbols[s + 10], date >> 20, digits[d + 2], symbols[s + 11:s + 20], _FILLER, digits[d + 3]))
+            for s, d, date, issuing_country, country_code, name in zip(
+                range(0, len(symbols), 20), range(0, len(digits), 4), dates, countries[0::2], countries[1::2],
+                _name_fields(name_counts, tokens))
+        ]
+        return _merge(count, raw, lines)
+
+    def _decoded(self, block: int) -> list:
+        """decode_mrz dicts of every record of a block"""
+        count, raw, (symbols, dates, digits, countries, name_counts, tokens) = self._unpack(block)
+        last_names, first_names, middle_names, full_names = decode_names(_name_fields(name_counts, tokens), 0, 39)
+        records = [
+            {
+                'line1': {
+                    'document_type': document_type,
+                    'issuing_country': issuing_country,
+                    'last_name': last_name,
+                    'first_name': first_name,
+                    'middle_name': middle_name,
+                    'full_name': full_name,
+                },
+                'line2': {
+                    'passport_number': passport_number,
+                    'passport_number_check_digit': passport_check,
+                    'country_code': country_code,
+                    'birth_date': birth_date,
+                    'birth_date_check_digit': birth_check,
+                    'sex': sex,
+                    'expiration_date': expiration_date,
+                    'expiration_date_check_digit': expiration_check,
+                    'personal_number': personal_number,
+                    'personal_number_check_digit': personal_check,
+                },
+            }
+            for (document_type, issuing_country, last_name, first_name, middle_name, full_name, passport_number,
+                 passport_check, country_code, birth_date, birth_check, sex, expiration_date, expiration_check,
+                 personal_number, personal_check) in zip(
+                symbols[0::20], countries[0::2], last_names, first_names, middle_names, full_names,
+                [symbols[s:s + 9] for s in range(1, len(symbols), 20)], digits[0::4], countries[1::2],
+                ['%06d' % (date & 0xFFFFF) for date in dates], digits[1::4], symbols[10::20],
+                ['%06d' % (date >> 20) for date in dates], digits[2::4],
+                [symbols[s:s + 9] for s in range(11, len(symbols), 20)], digits[3::4])
+        ]
+        return _merge(count, {position: decode_mrz(*lines) for position, lines in raw.items()}, records)
+
+    def _column(self, block: int, name: str) -> list:
+        """One decode_mrz field of every record of a block"""
+        count, raw, (symbols, dates, digits, countries, name_counts, tokens) = self._unpack(block)
+        if name in _SYMBOL_FIELDS:
+            start, stop = _SYMBOL_FIELDS[name]
+            values = (list(symbols[start::20]) if stop == start + 1 else
+                      [symbols[s:s + stop - start] for s in range(start, len(symbols), 20)])
+        elif name in _DIGIT_FIELDS:
+            values = list(digits[_DIGIT_FIELDS[name]::4])
+        elif name in _DATE_FIELDS:
+            shift = _DATE_FIELDS[name]
+            values = ['%06d' % (date >> shift & 0xFFFFF) for date in dates]
+        elif name in _NAME_FIELDS:
+            values = decode_names(_name_fields(name_counts, tokens), 0, 39)[_NAME_FIELDS[name]]
+        else:
+            values = countries[0::2] if name == 'issuing_country' else countries[1::2]
+        line = 'line1' if name in _LINE1_FIELDS else 'line2'
+        return _merge(count, {position: decode_mrz(*lines)[line][name] for position, lines in raw.items()}, values)
+
+    def column(self, name: str) -> list:
+        """One field of every record, as decode_mrz gives it, in archive order
+
+        ``name`` is any key of decode_mrz's 'line1' or 'line2' dicts. Only
+        that field is formatted, so this is the fastest way to scan one
+        field of an archive.
+        """
+        if name not in _LINE1_FIELDS and name not in _LINE2_FIELDS:
+            raise KeyError(f"No MRZ field named {name!r}.")
+        return [value for block in range(len(self._index)) for value in self._column(block, name)]
+
+    def __getitem__(self, index: int) -> tuple:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("archive index out of range")
+        block, position = divmod(index, self._block_size)
+        if self._cached[0] != block:
+            self._cached = (block, self._lines(block))
+        return self._cached[1][position]
+
+    def __iter__(self):
+        for block in range(len(self._index)):
+            yield from self._lines(block)
+
+    def iter_decoded(self):
+        """Yield every record as the dict decode_mrz gives for its lines, without rebuilding the lines"""
+        for block in range(len(self._index)):
+            yield from self._decoded(block)
+
+
+def read_encoded_pairs(path: str):
+    """(line1, line2) pairs of a records_encoded.json file"""
+    with open(path, 'r') as f:
+        for line in f:
+            line1, _, line2 = line.rstrip('\n').partition(';')
+            yield line1, line2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack or unpack MRZ archives.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help='records_encoded.json -> archive')
+    pack.add_argument('source')
+    pack.add_argument('archive')
+    pack.add_argument('--block-size', type=int, default=256)
+    unpack = commands.add_parser('unpack', help='archive -> records_encoded.json')
+    unpack.add_argument('archive')
+    unpack.add_argument('output')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        count = write_archive(read_encoded_pairs(args.source), args.archive, args.block_size)
+        print(f"Packed {count} records into {args.archive}")
+    else:
+        with MRZArchive(args.archive) as archive, open(args.output, 'w') as out:
+            for line1, line2 in archive:
+                out.write(f"{line1};{line2}\n")
+        print(f"Unpacked {len(archive)} records into {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+import MRTD
+import archive
+import testdata
+
+
+FIELDS = [
+    testdata.ERIKSSON,
+    dict(testdata.ERIKSSON, issuing_country='can', last_name='DOE', first_name='JANE', middle_name='',
+         passport_number='A1234', country_code='CA', birth_date='900101', sex='f', expiration_date='300101',
+         personal_number='12'),
+]
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'records.mrza')
+
+    def round_trip(self, pairs, block_size=256):
+        self.assertEqual(archive.write_archive(pairs, self.path, block_size), len(pairs))
+        records = archive.MRZArchive(self.path)
+        self.addCleanup(records.close)
+        self.assertEqual(len(records), len(pairs))
+        self.assertEqual(list(records), pairs)
+        return records
+
+    def test_round_trip_encoded_lines(self):
+        pairs = [MRTD.encode_mrz(fields) for fields in FIELDS * 3]
+        self.round_trip(pairs)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(4), archive.MAGIC)
+
+    def test_packed_records_are_smaller_than_text(self):
+        pairs = [MRTD.encode_mrz(dict(FIELDS[0], passport_number=f'X{n:08d}')) for n in range(100)]
+        self.round_trip(pairs)
+        self.assertLess(os.path.getsize(self.path), len(pairs) * 90 / 2)
+
+    def test_random_access(self):
+        pairs = [MRTD.encode_mrz(dict(FIELDS[0], passport_number=f'X{n:08d}')) for n in range(50)]
+        records = self.round_trip(pairs, block_size=8)
+        for index in (0, 7, 8, 23, 49):
+            self.assertEqual(records[index], pairs[index])
+        self.assertEqual(records[-1], pairs[-1])
+        with self.assertRaises(IndexError):
+            records[50]
+
+    def test_unpackable_lines_stored_raw(self):
+        line1, line2 = MRTD.encode_mrz(FIELDS[0])
+        pairs = [
+            ('', ''),
+            ('P<UTO;X', 'abc'),
+            (line1, line2[:13] + '١٢' + line2[15:]),
+            (line1.replace('ERIKSSON', 'ÉRIKSSON'), line2),
+            (line1, line2.lower()),
+            MRTD.encode_mrz(FIELDS[1]),
+        ]
+        records = self.round_trip(pairs, block_size=2)
+        self.assertEqual(list(records.iter_decoded()), [MRTD.decode_mrz(*lines) for lines in pairs])
+
+    def test_decoded_records_and_columns(self):
+        line1, line2 = MRTD.encode_mrz(FIELDS[0])
+        pairs = [MRTD.encode_mrz(fields) for fields in FIELDS * 3] + [(line1, line2.lower())]
+        records = self.round_trip(pairs, block_size=4)
+        expected = [MRTD.decode_mrz(*lines) for lines in pairs]
+        self.assertEqual(list(records.iter_decoded()), expected)
+        for line in ('line1', 'line2'):
+            for name in expected[0][line]:
+                self.assertEqual(records.column(name), [decoded[line][name] for decoded in expected], name)
+        with self.assertRaises(KeyError):
+            records.column('given_name')
+
+    def test_empty_archive(self):
+        records = self.round_trip([])
+        self.assertEqual(list(records.iter_decoded()), [])
+        self.assertEqual(records.column('sex'), [])
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * archive.HEADER.size)
+        with self.assertRaises(ValueError):
+            archive.MRZArchive(self.path)
+        archive.write_archive([MRTD.encode_mrz(FIELDS[0])], self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(4)
+            f.write(bytes([archive.VERSION - 1]))
+        with self.assertRaises(ValueError):
+            archive.MRZArchive(self.path)
+
+    def test_pack_unpack_cli(self):
+        source = self.path + '.json'
+        output = self.path + '.out.json'
+        testdata.write_encoded(source, FIELDS)
+        archive.main(['pack', source, self.path])
+        archive.main(['unpack', self.path, output])
+        with open(source, 'rb') as expected, open(output, 'rb') as actual:
+            self.assertEqual(actual.read(), expected.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Sorted date indexes over the birth and expiration dates of encoded files
+
+The YYMMDD column of an encoded file is gathered with
+EncodedRecords.column, given a century once (years up to ``pivot`` are
+20xx, later ones 19xx) and packed into YYYYMMDD integers, which sort like
+the dates they stand for. The packed dates and their row numbers are
+kept sorted in two arrays, so a range query is two binary searches plus
+a copy of the matching rows; no record is decoded.
+
+    python dateindex.py records_encoded.json --expiring-within 90
+    python dateindex.py records_encoded.json --born-before 1960-01-01
+"""
+import argparse
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+from mrzfile import EncodedRecords
+
+# Two-digit years up to the pivot are 20xx, the rest 19xx. Nobody is born
+# in the future, while passports run at most a few decades ahead
+DEFAULT_PIVOTS = {
+    'birth_date': datetime.date.today().year % 100,
+    'expiration_date': 68,
+}
+
+
+def pack_date(value) -> int:
+    """YYYYMMDD integer of a date (or of an already packed integer)"""
+    if isinstance(value, datetime.date):
+        return value.year * 10000 + value.month * 100 + value.day
+    return int(value)
+
+
+def unpack_date(packed: int) -> datetime.date:
+    return datetime.date(packed // 10000, packed // 100 % 100, packed % 100)
+
+
+class DateIndex:
+    """Rows of an encoded file ordered by one of its date fields
+
+    ``invalid`` lists the rows whose field is not six digits (filler or
+    garbage); they are left out of every query.
+    """
+
+    def __init__(self, dates: array, rows: array, invalid: list, field: str, pivot: int):
+        self.dates = dates
+        self.rows = rows
+        self.invalid = invalid
+        self.field = field
+        self.pivot = pivot
+
+    @classmethod
+    def build(cls, path: str, field: str = 'birth_date', pivot: int = None) -> 'DateIndex':
+        """Index the ``field`` column (birth_date or expiration_date) of an encoded file"""
+        pivot = DEFAULT_PIVOTS[field] if pivot is None else pivot
+        with EncodedRecords(path) as records:
+            column = records.column(field).data.decode('ascii')
+
+        # Century offset of every two-digit year, applied to the YYMMDD value
+        centuries = [20000000 if year <= pivot else 19000000 for year in range(100)]
+        packed = []
+        invalid = []
+        for row, start in enumerate(range(0, len(column), 6)):
+            value = column[start:start + 6]
+            if value.isdigit():
+                packed.append((int(value) + centuries[int(value[:2])], row))
+            else:
+                invalid.append(row)
+        packed.sort()
+        return cls(array('L', [date for date, _ in packed]), array('L', [row for _, row in packed]),
+                   invalid, field, pivot)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def between(self, first=None, last=None) -> list:
+        """Rows dated from ``first`` to ``last`` inclusive, in file order
+
+        Bounds are datetime.date or YYYYMMDD integers; None leaves that
+        end open.
+        """
+        start = 0 if first is None else bisect_left(self.dates, pack_date(first))
+        stop = len(self.dates) if last is None else bisect_right(self.dates, pack_date(last))
+        return sorted(self.rows[start:stop])
+
+    def before(self, day) -> list:
+        """Rows dated strictly before ``day``, in file order"""
+        return sorted(self.rows[:bisect_left(self.dates, pack_date(day))])
+
+    def after(self, day) -> list:
+        """Rows dated strictly after ``day``, in file order"""
+        return sorted(self.rows[bisect_right(self.dates, pack_date(day)):])
+
+    def within(self, days: int, today: datetime.date = None) -> list:
+        """Rows dated from ``today`` up to ``days`` days later, e.g. passports about to expire"""
+        today = datetime.date.today() if today is None else today
+        return self.between(today, today + datetime.timedelta(days=days))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query encoded records by birth or expiration date.")
+    parser.add_argument('input', nargs='?', default='records_encoded.json')
+    parser.add_argument('--pivot', type=int, help='last two-digit year read as 20xx')
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument('--expiring-within', type=int, metavar='DAYS')
+    query.add_argument('--expired', action='store_true', help='passports that expired before today')
+    query.add_argument('--born-before', type=datetime.date.fromisoformat, metavar='YYYY-MM-DD')
+    query.add_argument('--born-after', type=datetime.date.fromisoformat, metavar='YYYY-MM-DD')
+    args = parser.parse_args(argv)
+
+    field = 'birth_date' if args.born_before or args.born_after else 'expiration_date'
+    index = DateIndex.build(args.input, field, args.pivot)
+    if args.expiring_within is not None:
+        rows = index.within(args.expiring_within)
+    elif args.expired:
+        rows = index.before(datetime.date.today())
+    elif args.born_before:
+        rows = index.before(args.born_before)
+    else:
+        rows = index.after(args.born_after)
+    for row in rows:
+        print(row)
+    print(f"{len(rows)} of {len(index)} dated rows match ({len(index.invalid)} rows have no valid {field})")
+
+if __name__ == '__main__':
+    main()
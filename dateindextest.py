@@ -0,0 +1,51 @@
+import contextlib
+import datetime
+import io
+import unittest
+import dateindex
+import testdata
+
+
+# (birth_date, expiration_date) of each row
+DATES = [('740812', '120415'), ('550101', '261101'), ('051230', '270301'), ('', '261020'),
+         ('591231', '991231'), ('600101', '261017')]
+
+
+class TestDateIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path, _ = testdata.encoded_file(self, [dict(testdata.ERIKSSON, birth_date=birth_date,
+                                                          expiration_date=expiration_date)
+                                                     for birth_date, expiration_date in DATES])
+
+    def test_birth_date_queries(self):
+        index = dateindex.DateIndex.build(self.path, 'birth_date', pivot=25)
+        self.assertEqual(index.invalid, [3])
+        self.assertEqual(len(index), 5)
+        self.assertEqual(list(index.dates), [19550101, 19591231, 19600101, 19740812, 20051230])
+        self.assertEqual(index.before(datetime.date(1960, 1, 1)), [1, 4])
+        self.assertEqual(index.after(datetime.date(1974, 8, 12)), [2])
+        self.assertEqual(index.between(19591231, 19740812), [0, 4, 5])
+        self.assertEqual(index.between(), [0, 1, 2, 4, 5])
+
+        # With an earlier pivot 05 is read as 1905
+        self.assertEqual(dateindex.DateIndex.build(self.path, 'birth_date', pivot=4).before(19100101), [2])
+
+    def test_expiring_within(self):
+        index = dateindex.DateIndex.build(self.path, 'expiration_date')
+        today = datetime.date(2026, 10, 17)
+        self.assertEqual(index.within(0, today), [5])
+        self.assertEqual(index.within(10, today), [3, 5])
+        self.assertEqual(index.within(90, today), [1, 3, 5])
+        self.assertEqual(index.before(today), [0, 4])
+        self.assertEqual(dateindex.unpack_date(index.dates[-1]), datetime.date(2027, 3, 1))
+
+    def test_cli(self):
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            dateindex.main([self.path, '--born-before', '1960-01-01'])
+        self.assertEqual(stdout.getvalue().splitlines(),
+                         ['1', '4', '2 of 5 dated rows match (1 rows have no valid birth_date)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+"""Duplicate and collision detection over records_encoded.json rows
+
+Keys are cut straight out of the fixed-width rows (see mrzfile.FIELDS),
+so no row is ever decoded: a key is the bytes of one or more field
+slices, optionally with the name field reduced to a fuzzy key. Rows
+sharing a key form a group; with ``distinct`` a group is only reported
+when its rows differ in that field, e.g. the same name and birth date
+issued by different countries.
+
+With ``partitions`` > 1 the file is streamed once into that many
+temporary partition files by key hash and each partition is then grouped
+on its own, so memory is bounded by the largest partition instead of the
+whole file.
+
+    python dedup.py records_encoded.json                      # shared passport numbers
+    python dedup.py records_encoded.json --identity --fuzzy   # same person, other country
+    python dedup.py huge.json --partitions 64 --output groups.ndjson
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+import zlib
+from mrzfile import FIELDS, LINE_LENGTH, ROW_SIZE
+
+# Keys of the two standard checks
+PASSPORT_KEY = ('passport_number',)
+IDENTITY_KEY = ('names', 'birth_date')
+
+# Digits OCR left in names, read as the letters they stand for
+_NAME_LETTERS = bytes.maketrans(b'0125678', b'OIZSGTB')
+_REPEATS = re.compile(rb'(.)\1+')
+
+
+def _skeleton(name: bytes) -> bytes:
+    """First letter plus the consonants of a name, with repeats collapsed"""
+    return _REPEATS.sub(rb'\1', name[:1] + name[1:].translate(None, b'AEIOUY<'))
+
+
+def fuzzy_name_key(names: bytes) -> bytes:
+    """Order-insensitive sound-alike key of an MRZ name field
+
+    Only the surname and first given name count, each reduced to its
+    consonant skeleton, so ERIKSSON<<ANNA, ERIKSON<<ANA and ANNA<<ERIKSSON
+    share a key while middle names and truncation do not matter.
+    """
+    last_name, _, given_names = names.translate(_NAME_LETTERS).partition(b'<<')
+    first_name = given_names.lstrip(b'<').split(b'<', 1)[0]
+    return b'<'.join(sorted((_skeleton(last_name.replace(b'<', b'')), _skeleton(first_name))))
+
+
+def _key_columns(chunk: bytes, key: tuple, fuzzy: bool) -> list:
+    """Per-field lists of key bytes for every row of ``chunk``"""
+    columns = []
+    for name in key:
+        offset, width = FIELDS[name]
+        column = [chunk[start:start + width] for start in range(offset, len(chunk), ROW_SIZE)]
+        if fuzzy and name == 'names':
+            column = [fuzzy_name_key(names) for names in column]
+        columns.append(column)
+    return columns
+
+
+def iter_keys(path: str, key: tuple = PASSPORT_KEY, distinct: str = None, fuzzy: bool = False,
+              chunk_rows: int = 50000):
+    """Yield ``(row, key, distinct value)`` for every row of an encoded file
+
+    Rows are read ``chunk_rows`` at a time and keys are sliced per column,
+    so throughput does not depend on decoding. Key fields are joined with
+    ';', which never occurs inside a field.
+    """
+    size = os.path.getsize(path)
+    if size % ROW_SIZE:
+        raise ValueError(f"Encoded file size {size} is not a multiple of {ROW_SIZE} bytes.")
+    row = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_rows * ROW_SIZE)
+            if not chunk:
+                return
+            count = len(chunk) // ROW_SIZE
+            if chunk[LINE_LENGTH::ROW_SIZE].count(b';') != count:
+                raise ValueError(f"Encoded file is not a sequence of {ROW_SIZE}-byte 'line1;line2' rows.")
+            columns = _key_columns(chunk, key, fuzzy)
+            keys = columns[0] if len(columns) == 1 else [b';'.join(parts) for parts in zip(*columns)]
+            if distinct is None:
+                values = [b''] * count
+            else:
+                offset, width = FIELDS[distinct]
+                values = [chunk[start:start + width] for start in range(offset, len(chunk), ROW_SIZE)]
+            yield from zip(range(row, row + count), keys, values)
+            row += count
+
+
+def _groups(entries) -> list:
+    """(key, rows, distinct values) of every key held by more than one row"""
+    groups = {}
+    for row, key, value in entries:
+        group = groups.get(key)
+        if group is None:
+            groups[key] = ([row], {value})
+        else:
+            group[0].append(row)
+            group[1].add(value)
+    return [(key, rows, values) for key, (rows, values) in groups.items() if len(rows) > 1]
+
+
+def _partitioned_entries(entries, partitions: int, workdir: str = None):
+    """Spill entries to ``partitions`` files by key hash, then yield them partition by partition"""
+    with tempfile.TemporaryDirectory(dir=workdir) as directory:
+        paths = [os.path.join(directory, f'{index}.part') for index in range(partitions)]
+        files = [open(path, 'wb') for path in paths]
+        try:
+            for row, key, value in entries:
+                files[zlib.crc32(key) % partitions].write(b'%d;%s;%s\n' % (row, value, key))
+        finally:
+            for f in files:
+                f.close()
+
+        for path in paths:
+            with open(path, 'rb') as f:
+                # Keys may hold ';' and values may be short, so split from both ends
+                yield [(int(row), key, value) for row, value, key in
+                       (line[:-1].split(b';', 2) for line in f)]
+            os.remove(path)
+
+
+def find_duplicates(path: str, key: tuple = PASSPORT_KEY, distinct: str = None, fuzzy: bool = False,
+                    partitions: int = 1, workdir: str = None, chunk_rows: int = 50000) -> list:
+    """Groups of rows of an encoded file that share ``key``
+
+    ``key`` names fields of mrzfile.FIELDS; with ``fuzzy`` the 'names'
+    field is compared by fuzzy_name_key. With ``distinct`` (a field name)
+    only groups whose rows differ in that field are kept. ``partitions`` >
+    1 streams through temporary files under ``workdir`` so files larger
+    than memory can be checked.
+
+    Returns ``[(key, rows), ...]`` ordered by first row, with each key as
+    text and rows in file order.
+    """
+    entries = iter_keys(path, key, distinct, fuzzy, chunk_rows)
+    if partitions > 1:
+        groups = [group for partition in _partitioned_entries(entries, partitions, workdir)
+                  for group in _groups(partition)]
+    else:
+        groups = _groups(entries)
+    if distinct is not None:
+        groups = [group for group in groups if len(group[2]) > 1]
+    groups.sort(key=lambda group: group[1][0])
+    return [(key.decode('ascii'), rows) for key, rows, _ in groups]
+
+
+def passport_collisions(path: str, **options) -> list:
+    """Rows sharing a passport number"""
+    return find_duplicates(path, PASSPORT_KEY, **options)
+
+
+def identity_collisions(path: str, fuzzy: bool = False, distinct: str = 'issuing_country', **options) -> list:
+    """Rows sharing name and birth date but issued by different countries"""
+    return find_duplicates(path, IDENTITY_KEY, distinct=distinct, fuzzy=fuzzy, **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find duplicate records in an encoded file.")
+    parser.add_argument('input', nargs='?', default='records_encoded.json')
+    parser.add_argument('--key', nargs='+', choices=sorted(FIELDS), default=list(PASSPORT_KEY),
+                        help='fields rows must share (default: passport_number)')
+    parser.add_argument('--distinct', choices=sorted(FIELDS),
+                        help='only report groups whose rows differ in this field')
+    parser.add_argument('--identity', action='store_true',
+                        help='shorthand for --key names birth_date --distinct issuing_country')
+    parser.add_argument('--fuzzy', action='store_true', help='compare names by a sound-alike key')
+    parser.add_argument('--partitions', type=int, default=1,
+                        help='spill keys to this many temporary files for inputs larger than memory')
+    parser.add_argument('--workdir', help='directory for the partition files')
+    parser.add_argument('--output', help='write one JSON group per line here instead of a summary')
+    args = parser.parse_args(argv)
+
+    key, distinct = (IDENTITY_KEY, 'issuing_country') if args.identity else (tuple(args.key), args.distinct)
+    groups = find_duplicates(args.input, key, distinct, args.fuzzy, args.partitions, args.workdir)
+    if args.output:
+        with open(args.output, 'w') as f:
+            for group_key, rows in groups:
+                f.write(json.dumps({'key': group_key, 'rows': rows}) + '\n')
+    else:
+        for group_key, rows in groups[:20]:
+            print(f"{group_key}: rows {', '.join(map(str, rows))}")
+    print(f"Found {len(groups)} groups covering {sum(len(rows) for _, rows in groups)} rows")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import contextlib
+import io
+import json
+import os
+import unittest
+import dedup
+import testdata
+
+
+BASE = testdata.ERIKSSON
+
+FIELDS = [
+    BASE,
+    dict(BASE, last_name='DOE', first_name='JANE', middle_name='', passport_number='A12345678',
+         birth_date='900101'),
+    # Same passport number as row 0
+    dict(BASE, last_name='SMITH', first_name='JOHN', birth_date='650301'),
+    # Same person as row 0, issued by another country under a new number
+    dict(BASE, issuing_country='CAN', passport_number='C00000001'),
+    # Same name and birth date as row 1, same country
+    dict(BASE, last_name='DOE', first_name='JANE', middle_name='', passport_number='A99999999',
+         birth_date='900101'),
+    # Row 0 misspelt, with given and family name swapped, in a third country
+    dict(BASE, issuing_country='FRA', last_name='ANA', first_name='ERIKSON', middle_name='',
+         passport_number='F12345678'),
+]
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.path, _ = testdata.encoded_file(self, FIELDS)
+        self.directory = os.path.dirname(self.path)
+
+    def test_passport_collisions(self):
+        self.assertEqual(dedup.passport_collisions(self.path), [('L898902C3', [0, 2])])
+
+    def test_identity_collisions_across_countries(self):
+        groups = dedup.identity_collisions(self.path)
+        self.assertEqual([rows for _, rows in groups], [[0, 3]])
+        self.assertTrue(groups[0][0].startswith('ERIKSSON<<ANNA<MARIA<'))
+        self.assertTrue(groups[0][0].endswith(';740812'))
+
+        self.assertEqual([rows for _, rows in dedup.identity_collisions(self.path, distinct=None)], [[0, 3], [1, 4]])
+        self.assertEqual([rows for _, rows in dedup.identity_collisions(self.path, fuzzy=True)], [[0, 3, 5]])
+
+    def test_partitioned_matches_in_memory(self):
+        for key, distinct, fuzzy in ((dedup.PASSPORT_KEY, None, False), (dedup.IDENTITY_KEY, None, True),
+                                     (dedup.IDENTITY_KEY, 'issuing_country', False)):
+            expected = dedup.find_duplicates(self.path, key, distinct, fuzzy)
+            self.assertEqual(dedup.find_duplicates(self.path, key, distinct, fuzzy, partitions=4,
+                                                   workdir=self.directory, chunk_rows=2), expected)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['records_encoded.json'])
+
+    def test_fuzzy_name_key(self):
+        self.assertEqual(dedup.fuzzy_name_key(b'ERIKSSON<<ANNA<MARIA<<<<'), dedup.fuzzy_name_key(b'ANA<<ERIKS0N<<'))
+        self.assertNotEqual(dedup.fuzzy_name_key(b'ERIKSSON<<ANNA<<<'), dedup.fuzzy_name_key(b'ERIKSSON<<JOHN<<<'))
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'a') as f:
+            f.write('x')
+        with self.assertRaises(ValueError):
+            dedup.passport_collisions(self.path)
+
+    def test_cli(self):
+        output = os.path.join(self.directory, 'groups.ndjson')
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            dedup.main([self.path, '--identity', '--fuzzy', '--output', output])
+        with open(output) as f:
+            self.assertEqual([json.loads(line)['rows'] for line in f], [[0, 3, 5]])
+        self.assertIn('Found 1 groups covering 3 rows', stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+"""Differential tests: every optimised path in MRTD against reference.py
+
+Inputs are random but reproducible and lean on the edges: empty and
+overlong fields, lowercase, spaces and filler other than '<', non-ASCII
+text (some of which str.upper() turns into ASCII), missing fields and
+lines of the wrong length. Each path must give the reference's result,
+or raise the same exception type.
+
+    MRTD_DIFFERENTIAL_CASES=200000 python -m pytest differentialtest.py
+    MRTD_DIFFERENTIAL_SEED=7 python differentialtest.py
+"""
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+import MRTD
+import archive
+import mrzfile
+import processor
+import reference
+
+CASES = int(os.environ.get('MRTD_DIFFERENTIAL_CASES', '2000'))
+SEED = int(os.environ.get('MRTD_DIFFERENTIAL_SEED', '9303'))
+
+MRZ_CHARS = '<0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+ALPHABETS = (
+    MRZ_CHARS,
+    MRZ_CHARS + 'abcdefghijklmnopqrstuvwxyz',
+    MRZ_CHARS + ' .-/#*',
+    MRZ_CHARS + 'Ééßﬁøıİ',
+)
+
+# Longest meaningful value of each field; values run up to 30 characters past it
+FIELD_LENGTHS = {
+    'document_type': 1, 'issuing_country': 3, 'last_name': 20, 'first_name': 12, 'middle_name': 12,
+    'passport_number': 9, 'country_code': 3, 'birth_date': 6, 'sex': 1, 'expiration_date': 6,
+    'personal_number': 9,
+}
+
+
+def outcome(function, *args):
+    """('ok', result) or ('error', exception type) of a call"""
+    try:
+        return 'ok', function(*args)
+    except Exception as error:
+        return 'error', type(error)
+
+
+def random_text(rng: random.Random, max_length: int) -> str:
+    alphabet = rng.choice(ALPHABETS)
+    length = rng.choice((0, 1, rng.randint(0, max_length), max_length, max_length + rng.randint(1, 30)))
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def random_fields(rng: random.Random) -> dict:
+    """encode_mrz fields, each one missing now and then"""
+    return {name: random_text(rng, length) for name, length in FIELD_LENGTHS.items() if rng.random() < 0.9}
+
+
+def random_lines(rng: random.Random) -> tuple:
+    """A line pair: a mangled encoding of random fields, or plain noise"""
+    if rng.random() < 0.2:
+        return random_text(rng, 44), random_text(rng, 44)
+    status, lines = outcome(reference.encode_mrz, random_fields(rng))
+    if status != 'ok':
+        return random_text(rng, 44), random_text(rng, 44)
+    mangled = []
+    for line in lines:
+        action = rng.random()
+        if action < 0.2:
+            line = line[:rng.randint(0, 44)]
+        elif action < 0.3:
+            line += random_text(rng, 10)
+        elif action < 0.6 and line:
+            position = rng.randrange(len(line))
+            line = line[:position] + rng.choice(rng.choice(ALPHABETS)) + line[position + 1:]
+        mangled.append(line)
+    return tuple(mangled)
+
+
+class TestDifferential(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(SEED)
+
+    def assertSameOutcome(self, actual, expected, *inputs):
+        self.assertEqual(actual, expected, f"inputs: {inputs!r}")
+
+    def test_fletcher16(self):
+        cases = [b'', b'\xff' * 5000, bytes(range(256))]
+        cases += [bytes(self.rng.randrange(256) for _ in range(self.rng.randint(0, 100))) for _ in range(CASES)]
+        for data in cases:
+            self.assertSameOutcome(MRTD.fletcher16(data), reference.fletcher16(data), data)
+
+    def test_check_digit_paths(self):
+        values = [random_text(self.rng, 12) for _ in range(CASES)]
+        expected = [outcome(reference.calculate_check_digit, value) for value in values]
+        self.addCleanup(MRTD.configure_check_digit_cache)
+
+        for maxsize in (MRTD.CHECK_DIGIT_CACHE_SIZE, 16, 0):
+            MRTD.configure_check_digit_cache(maxsize)
+            # Twice, so cached answers are checked as well as fresh ones
+            for _ in range(2):
+                for value, result in zip(values, expected):
+                    self.assertSameOutcome(outcome(MRTD.calculate_check_digit, value), result, value)
+        for value, result in zip(values, expected):
+            if value:
+                self.assertSameOutcome(outcome(MRTD._compute_check_digit, value), result, value)
+
+        valid = [value for value, (status, _) in zip(values, expected) if status == 'ok']
+        self.assertEqual(MRTD.calculate_check_digits(valid), [reference.calculate_check_digit(value) for value in valid])
+
+        # correct_check_digit predicts digits from Fletcher deltas instead of recomputing them
+        for value in valid[:max(1, CASES // 10)]:
+            if value.isascii():
+                digit = self.rng.randrange(10)
+                for candidate, _ in MRTD.correct_check_digit(value, digit):
+                    self.assertEqual(reference.calculate_check_digit(candidate), digit, (value, candidate))
+
+    def test_encode_paths(self):
+        records = [random_fields(self.rng) for _ in range(CASES)]
+        expected = [outcome(reference.encode_mrz, fields) for fields in records]
+        for fields, result in zip(records, expected):
+            self.assertSameOutcome(outcome(MRTD.encode_mrz, fields), result, fields)
+            self.assertSameOutcome(outcome(MRTD.TD3.encode, fields), result, fields)
+
+        # A column missing a value takes encode_mrz's default for it
+        def columns(batch):
+            return {name: [fields.get(name, '<' if name == 'sex' else 'P' if name == 'document_type' else '')
+                           for fields in batch] for name in FIELD_LENGTHS}
+
+        def batch_lines(batch):
+            line1_rows, line2_rows = MRTD.encode_mrz_batch(columns(batch))
+            return [(line1.decode('utf-8'), line2.decode('utf-8')) for line1, line2 in zip(line1_rows, line2_rows)]
+
+        for fields, (status, result) in zip(records, expected):
+            self.assertSameOutcome(outcome(batch_lines, [fields]), (status, [result] if status == 'ok' else result),
+                                   fields)
+        encodable = [fields for fields, (status, _) in zip(records, expected) if status == 'ok']
+        self.assertEqual(batch_lines(encodable), [reference.encode_mrz(fields) for fields in encodable])
+
+        names = [(fields.get('last_name', ''), fields.get('first_name', ''), fields.get('middle_name', ''))
+                 for fields in encodable]
+        self.assertEqual(MRTD.encode_names(*zip(*names)) if names else [],
+                         [reference.encode_mrz({'last_name': last, 'first_name': first, 'middle_name': middle})[0][5:]
+                          for last, first, middle in names])
+
+    def test_processor_encode(self):
+        def decoded_record(fields):
+            given_name = ' '.join(filter(None, (fields.get('first_name'), fields.get('middle_name'))))
+            line1 = {'issuing_country': fields.get('issuing_country', ''), 'last_name': fields.get('last_name', ''),
+                     'given_name': given_name}
+            return {'line1': {key: value for key, value in line1.items() if self.rng.random() < 0.9},
+                    'line2': {name: fields[name] for name in ('passport_number', 'country_code', 'birth_date', 'sex',
+                                                              'expiration_date', 'personal_number') if name in fields}}
+
+        def processor_lines(records):
+            out = io.BytesIO()
+            processor.write_encoded(records, out)
+            return out.getvalue().decode('utf-8').splitlines()
+
+        records = [decoded_record(random_fields(self.rng)) for _ in range(CASES)]
+        expected = [outcome(reference.encode_decoded_records, [record]) for record in records]
+        for record, result in zip(records, expected):
+            self.assertSameOutcome(outcome(processor_lines, [record]), result, record)
+
+        encodable = [record for record, (status, _) in zip(records, expected) if status == 'ok']
+        lines = reference.encode_decoded_records(encodable)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'records_decoded.json')
+            output = os.path.join(directory, 'records_encoded.json')
+            with open(path, 'w') as f:
+                json.dump({'records_decoded': encodable}, f)
+            for options in ([], ['--stream', '--verify', '--chunk-size', '7']):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    processor.main(['--input', path, '--output', output] + options)
+                with open(output, encoding='utf-8', newline='') as f:
+                    self.assertEqual(f.read(), ''.join(line + '\n' for line in lines))
+
+    def test_decode_paths(self):
+        pairs = [random_lines(self.rng) for _ in range(CASES)]
+        for line1, line2 in pairs:
+            decoded = reference.decode_mrz(line1, line2)
+            self.assertSameOutcome(MRTD.decode_mrz(line1, line2), decoded, line1, line2)
+            self.assertSameOutcome(MRTD.TD3.decode(line1, line2), decoded, line1, line2)
+            self.assertSameOutcome(outcome(MRTD.verify_mrz, line1, line2),
+                                   outcome(reference.verify_mrz, line1, line2), line1, line2)
+
+            checks = outcome(reference.verify_check_digits, decoded)
+            self.assertSameOutcome(outcome(MRTD.verify_check_digits, decoded, MRTD.CheckDigitDiagnostics()),
+                                   checks, line1, line2)
+            parsed = outcome(MRTD.parse_and_verify, line1, line2)
+            mask = outcome(MRTD.TD3.check_mask, line1, line2)
+            if checks[0] == 'ok':
+                bits = sum(1 << bit for bit, valid in enumerate(checks[1]['details'].values()) if valid)
+                self.assertSameOutcome(parsed, ('ok', (decoded, bits)), line1, line2)
+                self.assertSameOutcome(mask, ('ok', bits), line1, line2)
+            else:
+                self.assertSameOutcome(parsed[0], 'error', line1, line2)
+                self.assertSameOutcome(mask[0], 'error', line1, line2)
+
+            record = MRTD.MRZRecord(line1, line2)
+            self.assertSameOutcome(record.to_dict(), decoded, line1, line2)
+            for line in ('line1', 'line2'):
+                for name, value in decoded[line].items():
+                    self.assertSameOutcome(getattr(record, name), value, line1, line2, name)
+
+        names = MRTD.decode_names([(line1 + '<' * 44)[:44] for line1, _ in pairs])
+        expected = [reference.decode_mrz(line1, '')['line1'] for line1, _ in pairs]
+        for key, column in zip(('last_name', 'first_name', 'middle_name', 'full_name'), names):
+            self.assertEqual(column, [line[key] for line in expected])
+
+    def test_file_paths(self):
+        # The fixed-width readers take 44-character ASCII lines only
+        pairs = [lines for lines in (random_lines(self.rng) for _ in range(CASES))
+                 if all(len(line) == 44 and line.isascii() and ';' not in line and '\n' not in line
+                        for line in lines)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'records_encoded.json')
+            with open(path, 'w') as f:
+                f.writelines(f"{line1};{line2}\n" for line1, line2 in pairs)
+            expected = [reference.decode_mrz(line1, line2) for line1, line2 in pairs]
+
+            with mrzfile.EncodedRecords(path) as records:
+                self.assertEqual(records[:], expected)
+                self.assertEqual(list(records.column('passport_number')),
+                                 [decoded['line2']['passport_number'].encode('ascii') for decoded in expected])
+                last_names, first_names, middle_names, full_names = records.name_columns()
+                self.assertEqual(full_names, [decoded['line1']['full_name'] for decoded in expected])
+
+            failures = [failure for _, block in processor.verify_blocks(path, chunk_size=97) for failure in block]
+            self.assertEqual([row for row, _ in failures],
+                             [row for row, decoded in enumerate(expected)
+                              if not reference.verify_check_digits(decoded)['valid']])
+
+            archive_path = os.path.join(directory, 'records.mrza')
+            archive.write_archive(pairs, archive_path, block_size=64)
+            with archive.MRZArchive(archive_path) as packed:
+                self.assertEqual(list(packed), pairs)
+                self.assertEqual(list(packed.iter_decoded()), expected)
+                for line in ('line1', 'line2'):
+                    for name in reference.decode_mrz('', '')[line]:
+                        self.assertEqual(packed.column(name), [decoded[line][name] for decoded in expected], name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+"""Opt-in per-stage timing for MRTD and processor
+
+Nothing here runs until a profiler is enabled: ``enable()`` swaps the
+entry points below for timed wrappers in every loaded module that refers
+to them (MRTD, processor, store, ... and a script run as __main__) and
+``disable()`` puts the original functions back, so a disabled profiler
+costs nothing.
+
+Each stage keeps its call count, the records it handled, its total time
+and its self time (total minus time spent in other timed stages), so for
+encode_mrz with ``detail=True`` the self time is the padding and
+formatting left after name building and check digits. Generators such as
+processor's streaming reader are timed across every ``next()``.
+
+    profiler = Profiler()
+    with profiler:
+        processor.main([...])
+    print(profiler.format_table())
+
+Timings are process-wide and assume a single thread; chunks encoded in
+``--workers`` processes are not seen by the parent's profiler.
+"""
+import functools
+import inspect
+import json
+import os
+import sys
+import time
+
+
+def _one(args, result) -> int:
+    return 1
+
+
+def _rows(args, result) -> int:
+    return len(result[0])
+
+
+def _length(args, result) -> int:
+    return len(result)
+
+
+def _chunk(args, result) -> int:
+    return result[1]
+
+
+def _columns(args, result) -> int:
+    return len(result['passport_number'])
+
+
+def _loaded(args, result) -> int:
+    # Streamed input is counted as it is read, by the iter_* stages
+    return len(result) if isinstance(result, list) else 0
+
+
+def _written(args, result) -> int:
+    return result[0]
+
+
+def _updated(args, result) -> int:
+    return result['added'] + result['changed'] + result['unchanged']
+
+
+# (module, function, records handled per call) of every timed stage
+ENTRY_POINTS = (
+    ('MRTD', 'encode_mrz', _one),
+    ('MRTD', 'decode_mrz', _one),
+    ('MRTD', 'verify_mrz', _one),
+    ('MRTD', 'parse_and_verify', _one),
+    ('MRTD', 'verify_check_digits', _one),
+    ('MRTD', 'encode_mrz_batch', _rows),
+    ('MRTD', 'decode_names', _rows),
+    ('MRTD', 'calculate_check_digits', _length),
+    ('MRTD', 'query_database', _one),
+    ('processor', '_open_records', _loaded),
+    ('processor', 'iter_decoded_records', _one),
+    ('processor', 'iter_ndjson_records', _one),
+    ('processor', 'records_to_columns', _columns),
+    ('processor', 'encode_chunk', _chunk),
+    ('processor', 'encode_blocks', _chunk),
+    ('processor', 'write_encoded', _written),
+    ('processor', 'update_encoded', _updated),
+)
+
+# Per-field stages, timed only with ``detail`` as they run several times per record
+DETAIL_POINTS = (
+    ('MRTD', 'calculate_check_digit', _one),
+    ('MRTD', '_join_names', _one),
+    ('MRTD', '_parse_names', _one),
+    ('MRTD', 'encode_names', _length),
+)
+
+# Modules whose references to a timed function are swapped as well
+_MODULES = ('MRTD', 'processor', 'store', 'mrzfile', 'service', 'archive')
+
+
+def _loaded_modules() -> dict:
+    """Loaded copies of the modules in _MODULES, including a script run as __main__"""
+    modules = {name: [sys.modules[name]] for name in _MODULES if name in sys.modules}
+    main = sys.modules.get('__main__')
+    script = os.path.splitext(os.path.basename(getattr(main, '__file__', None) or ''))[0]
+    if script in _MODULES:
+        modules.setdefault(script, []).append(main)
+    return modules
+
+
+def _defined_in(function, module_name: str, modules: dict) -> bool:
+    """Whether ``function`` is a function defined in (a copy of) ``module_name``"""
+    return (inspect.isfunction(function) and
+            any(function.__module__ == module.__name__ for module in modules.get(module_name, ())))
+
+
+class Profiler:
+    """Per-stage timers and counters for MRTD and processor entry points"""
+
+    def __init__(self):
+        self.stats = {}
+        self._stack = []
+        self._patches = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._patches)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def reset(self):
+        self.stats = {}
+
+    def enable(self, detail: bool = False):
+        """Start timing the entry points (and per-field stages with ``detail``)"""
+        if self._patches:
+            return
+        modules = _loaded_modules()
+        holders = [module for copies in modules.values() for module in copies]
+        points = ENTRY_POINTS + DETAIL_POINTS if detail else ENTRY_POINTS
+        for module_name, name, items in points:
+            stage = f"{module_name}.{name}"
+            # Match on the defining module, so copies left behind by a reload are timed too
+            wrappers = {}
+            for holder in holders:
+                function = holder.__dict__.get(name)
+                if _defined_in(function, module_name, modules):
+                    wrapper = wrappers.get(id(function))
+                    if wrapper is None:
+                        wrapper = wrappers[id(function)] = self._wrap(stage, function, items)
+                    self._patches.append((holder, name, function))
+                    setattr(holder, name, wrapper)
+
+    def disable(self):
+        """Restore the original functions; the collected stats are kept"""
+        while self._patches:
+            holder, name, function = self._patches.pop()
+            setattr(holder, name, function)
+
+    def _record(self, stage: str, items: int, elapsed: int):
+        children = self._stack.pop()
+        stat = self.stats.get(stage)
+        if stat is None:
+            stat = self.stats[stage] = [0, 0, 0, 0]
+        stat[0] += 1
+        stat[1] += items
+        stat[2] += elapsed
+        stat[3] += elapsed - children
+        if self._stack:
+            self._stack[-1] += elapsed
+
+    def _wrap(self, stage: str, function, items):
+        clock = time.perf_counter_ns
+        stack = self._stack
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                iterator = function(*args, **kwargs)
+                while True:
+                    stack.append(0)
+                    start = clock()
+                    try:
+                        value = next(iterator)
+                    except StopIteration:
+                        self._record(stage, 0, clock() - start)
+                        return
+                    except BaseException:
+                        self._record(stage, 0, clock() - start)
+                        raise
+                    self._record(stage, items(args, value), clock() - start)
+                    yield value
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stack.append(0)
+            start = clock()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                self._record(stage, 0, clock() - start)
+                raise
+            self._record(stage, items(args, result), clock() - start)
+            return result
+        return wrapper
+
+    def snapshot(self) -> dict:
+        """Stats as plain data, ready for json.dumps"""
+        stages = {}
+        for stage, (calls, items, total, own) in sorted(self.stats.items(), key=lambda item: -item[1][3]):
+            stages[stage] = {
+                'calls': calls,
+                'records': items,
+                'total_s': total / 1e9,
+                'self_s': own / 1e9,
+                'mean_us': total / calls / 1e3 if calls else 0.0,
+            }
+        snapshot = {'stages': stages}
+        mrtd = sys.modules.get('MRTD')
+        cache = mrtd.check_digit_cache_info() if mrtd is not None else None
+        if cache is not None:
+            snapshot['check_digit_cache'] = {'hits': cache.hits, 'misses': cache.misses, 'size': cache.currsize}
+        return snapshot
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = 'mrtd') -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        metrics = (
+            ('stage_calls_total', 'calls', 'Calls of each timed stage'),
+            ('stage_records_total', 'records', 'Records handled by each timed stage'),
+            ('stage_seconds_total', 'total_s', 'Wall time spent in each stage, including nested stages'),
+            ('stage_self_seconds_total', 'self_s', 'Wall time spent in each stage, excluding nested stages'),
+        )
+        lines = []
+        for metric, key, description in metrics:
+            lines += [f"# HELP {prefix}_{metric} {description}", f"# TYPE {prefix}_{metric} counter"]
+            lines += [f'{prefix}_{metric}{{stage="{stage}"}} {values[key]}'
+                      for stage, values in snapshot['stages'].items()]
+        for key, value in snapshot.get('check_digit_cache', {}).items():
+            kind = 'gauge' if key == 'size' else 'counter'
+            metric = f"{prefix}_check_digit_cache_{key}" + ('' if kind == 'gauge' else '_total')
+            lines += [f"# TYPE {metric} {kind}", f"{metric} {value}"]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Write the snapshot to ``path``: Prometheus text for *.prom, JSON otherwise"""
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+    def format_table(self) -> str:
+        """Stages sorted by self time, as an aligned text table"""
+        rows = [f"{'stage':<34}{'calls':>10}{'records':>10}{'total ms':>12}{'self ms':>12}{'self %':>8}{'mean us':>10}"]
+        stages = self.snapshot()['stages']
+        overall = sum(values['self_s'] for values in stages.values()) or 1.0
+        for stage, values in stages.items():
+            rows.append(f"{stage:<34}{values['calls']:>10}{values['records']:>10}"
+                        f"{values['total_s'] * 1e3:>12.3f}{values['self_s'] * 1e3:>12.3f}"
+                        f"{values['self_s'] / overall:>8.1%}{values['mean_us']:>10.2f}")
+        return '\n'.join(rows)
+
+
+# Process-wide profiler used by processor --profile
+PROFILER = Profiler()
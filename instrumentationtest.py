@@ -0,0 +1,81 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import MRTD
+import instrumentation
+import processor
+import testdata
+
+
+FIELDS = testdata.ERIKSSON
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_disabled_profiler_leaves_functions_untouched(self):
+        originals = (MRTD.encode_mrz, MRTD.calculate_check_digit, processor.encode_mrz_batch)
+        profiler = instrumentation.Profiler()
+        profiler.enable(detail=True)
+        self.assertTrue(profiler.enabled)
+        self.assertIsNot(MRTD.encode_mrz, originals[0])
+        self.assertIsNot(processor.encode_mrz_batch, originals[2])
+        profiler.disable()
+        self.assertFalse(profiler.enabled)
+        self.assertEqual((MRTD.encode_mrz, MRTD.calculate_check_digit, processor.encode_mrz_batch), originals)
+
+    def test_encode_mrz_stage_breakdown(self):
+        expected = MRTD.encode_mrz(FIELDS)
+        profiler = instrumentation.Profiler()
+        profiler.enable(detail=True)
+        self.assertEqual(MRTD.encode_mrz(FIELDS), expected)
+        profiler.disable()
+        with profiler:
+            MRTD.decode_mrz(*expected)
+        stages = profiler.snapshot()['stages']
+
+        self.assertEqual(stages['MRTD.encode_mrz']['calls'], 1)
+        self.assertEqual(stages['MRTD.calculate_check_digit']['calls'], 4)
+        self.assertEqual(stages['MRTD._join_names']['calls'], 1)
+        self.assertEqual(stages['MRTD.decode_mrz']['records'], 1)
+        self.assertNotIn('MRTD._parse_names', stages)
+        encode = stages['MRTD.encode_mrz']
+        nested = stages['MRTD.calculate_check_digit']['total_s'] + stages['MRTD._join_names']['total_s']
+        self.assertAlmostEqual(encode['self_s'], encode['total_s'] - nested, places=6)
+
+    def test_processor_profile_and_metrics(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'records_decoded.json')
+            with open(input_path, 'w') as f:
+                json.dump({'records_decoded': [{
+                    'line1': {'issuing_country': 'UTO', 'last_name': 'ERIKSSON', 'given_name': 'ANNA MARIA'},
+                    'line2': {'passport_number': f'L{n:08d}', 'country_code': 'UTO', 'birth_date': '740812',
+                              'sex': 'F', 'expiration_date': '120415', 'personal_number': 'ZE184226B'},
+                } for n in range(25)]}, f)
+            stderr = io.StringIO()
+            for metrics in ('metrics.json', 'metrics.prom'):
+                instrumentation.PROFILER.reset()
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+                    processor.main(['--input', input_path, '--output', os.path.join(directory, 'out.json'),
+                                    '--chunk-size', '10', '--stream', '--profile',
+                                    '--metrics', os.path.join(directory, metrics)])
+            self.assertFalse(instrumentation.PROFILER.enabled)
+
+            with open(os.path.join(directory, 'metrics.json')) as f:
+                stages = json.load(f)['stages']
+            with open(os.path.join(directory, 'metrics.prom')) as f:
+                prometheus = f.read()
+
+        self.assertEqual(stages['processor.iter_decoded_records']['records'], 25)
+        self.assertEqual(stages['processor.encode_chunk']['calls'], 3)
+        self.assertEqual(stages['MRTD.encode_mrz_batch']['records'], 25)
+        self.assertEqual(stages['processor.write_encoded']['records'], 25)
+        self.assertIn('processor.records_to_columns', stderr.getvalue())
+        self.assertIn('# TYPE mrtd_stage_seconds_total counter', prometheus)
+        self.assertIn('mrtd_stage_records_total{stage="MRTD.encode_mrz_batch"} 25', prometheus)
+
+
+if __name__ == '__main__':
+    unittest.main()
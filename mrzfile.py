@@ -0,0 +1,185 @@
+import mmap
+from MRTD import MRZRecord, decode_mrz, decode_names
+
+# Every row processor.main writes is line1 + ';' + line2 + '\n'
+LINE_LENGTH = 44
+ROW_SIZE = LINE_LENGTH + 1 + LINE_LENGTH + 1
+LINE2_OFFSET = LINE_LENGTH + 1
+
+# (offset within the row, width) of each field decode_mrz returns as a slice
+FIELDS = {
+    'document_type': (0, 1),
+    'issuing_country': (2, 3),
+    'names': (5, 39),
+    'passport_number': (LINE2_OFFSET + 0, 9),
+    'passport_number_check_digit': (LINE2_OFFSET + 9, 1),
+    'country_code': (LINE2_OFFSET + 10, 3),
+    'birth_date': (LINE2_OFFSET + 13, 6),
+    'birth_date_check_digit': (LINE2_OFFSET + 19, 1),
+    'sex': (LINE2_OFFSET + 20, 1),
+    'expiration_date': (LINE2_OFFSET + 21, 6),
+    'expiration_date_check_digit': (LINE2_OFFSET + 27, 1),
+    'personal_number': (LINE2_OFFSET + 28, 9),
+    'personal_number_check_digit': (LINE2_OFFSET + 43, 1),
+}
+
+
+class FieldColumn:
+    """One fixed-width field of every row, packed into a contiguous buffer"""
+
+    __slots__ = ('data', 'width')
+
+    def __init__(self, data: bytes, width: int):
+        self.data = data
+        self.width = width
+
+    def __len__(self) -> int:
+        return len(self.data) // self.width
+
+    def __getitem__(self, index: int) -> bytes:
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("column index out of range")
+        start = index * self.width
+        return self.data[start:start + self.width]
+
+    def __iter__(self):
+        width = self.width
+        data = self.data
+        for start in range(0, len(data), width):
+            yield data[start:start + width]
+
+    @property
+    def buffer(self) -> memoryview:
+        """Zero-copy view of the packed column"""
+        return memoryview(self.data)
+
+
+class EncodedRecords:
+    """Random-access, struct-of-arrays reader for a records_encoded.json file
+
+    The file is memory-mapped and treated as a fixed-stride byte array, so
+    ``records[i]`` and ``records[a:b]`` only touch the rows they return and
+    decode them with decode_mrz on demand; ``iter_chunks`` pages through the
+    file one block at a time. ``column(name)`` gathers one field of every
+    row with one strided copy per byte of field width, without building any
+    per-record objects.
+
+    Opening checks the file size and the separators of a sample of rows
+    (every row with ``full_check``); each row is checked again when read.
+    """
+
+    # Rows whose separators are checked on open, spread across the file
+    SAMPLE_ROWS = 64
+
+    def __init__(self, path: str, full_check: bool = False):
+        self._file = open(path, 'rb')
+        size = self._file.seek(0, 2)
+        if size % ROW_SIZE:
+            self._file.close()
+            raise ValueError(f"Encoded file size {size} is not a multiple of {ROW_SIZE} bytes.")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._count = size // ROW_SIZE
+
+        if full_check:
+            valid = (self._data[LINE_LENGTH::ROW_SIZE].count(b';') == self._count and
+                     self._data[ROW_SIZE - 1::ROW_SIZE].count(b'\n') == self._count)
+        else:
+            sample = {self._count - 1, *(i * self._count // self.SAMPLE_ROWS for i in range(self.SAMPLE_ROWS))}
+            valid = all(self._row_is_valid(index) for index in sample if 0 <= index < self._count)
+        if not valid:
+            self.close()
+            raise ValueError(f"Encoded file is not a sequence of {ROW_SIZE}-byte 'line1;line2' rows.")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def _row_is_valid(self, index: int) -> bool:
+        start = index * ROW_SIZE
+        return (self._data[start + LINE_LENGTH:start + LINE_LENGTH + 1] == b';' and
+                self._data[start + ROW_SIZE - 1:start + ROW_SIZE] == b'\n')
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("record index out of range")
+        return index
+
+    def column(self, name: str) -> FieldColumn:
+        """Gather one field of every row into a contiguous FieldColumn"""
+        offset, width = FIELDS[name]
+        packed = bytearray(self._count * width)
+        for position in range(width):
+            packed[position::width] = self._data[offset + position::ROW_SIZE]
+        return FieldColumn(bytes(packed), width)
+
+    def name_columns(self) -> tuple:
+        """(last_names, first_names, middle_names, full_names) of every row, parsed in bulk"""
+        names = self.column('names')
+        text = names.data.decode('ascii')
+        width = names.width
+        return decode_names([text[start:start + width] for start in range(0, len(text), width)], 0, width)
+
+    def lines(self, index: int) -> tuple:
+        """Raw (line1, line2) strings of one row"""
+        index = self._index(index)
+        if not self._row_is_valid(index):
+            raise ValueError(f"Row {index} is not a 'line1;line2' row.")
+        start = index * ROW_SIZE
+        row = self._data[start:start + ROW_SIZE].decode('ascii')
+        return row[:LINE_LENGTH], row[LINE2_OFFSET:LINE2_OFFSET + LINE_LENGTH]
+
+    def row(self, index: int) -> dict:
+        """Decode one row into the same dict shape as decode_mrz"""
+        return decode_mrz(*self.lines(index))
+
+    def record(self, index: int) -> MRZRecord:
+        """Wrap one row in a compact MRZRecord"""
+        return MRZRecord(*self.lines(index))
+
+    def _decode_range(self, start: int, stop: int) -> list:
+        """Decode consecutive rows from a single read of their bytes"""
+        block = self._data[start * ROW_SIZE:stop * ROW_SIZE].decode('ascii')
+        decoded = []
+        for offset in range(0, len(block), ROW_SIZE):
+            if block[offset + LINE_LENGTH] != ';' or block[offset + ROW_SIZE - 1] != '\n':
+                raise ValueError(f"Row {start + offset // ROW_SIZE} is not a 'line1;line2' row.")
+            decoded.append(decode_mrz(block[offset:offset + LINE_LENGTH],
+                                      block[offset + LINE2_OFFSET:offset + LINE2_OFFSET + LINE_LENGTH]))
+        return decoded
+
+    def __getitem__(self, index):
+        """``records[i]`` decodes one row; ``records[a:b:c]`` decodes a list of rows"""
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            if step == 1:
+                return self._decode_range(start, max(start, stop))
+            return [self.row(i) for i in range(start, stop, step)]
+        return self.row(index)
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    def iter_chunks(self, chunk_size: int = 10000):
+        """Yield lists of up to ``chunk_size`` decoded rows, in file order"""
+        for start in range(0, self._count, chunk_size):
+            yield self._decode_range(start, min(start + chunk_size, self._count))
+
+    def rows(self):
+        """Lazily decode every row in file order"""
+        return iter(self)
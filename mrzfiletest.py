@@ -0,0 +1,90 @@
+import unittest
+import MRTD
+import mrzfile
+import testdata
+
+
+FIELDS = [
+    testdata.ERIKSSON,
+    dict(testdata.ERIKSSON, issuing_country='CAN', last_name='DOE', first_name='JANE', middle_name='',
+         passport_number='A12345678', country_code='CAN', birth_date='900101', sex='M', expiration_date='300101',
+         personal_number='123456789'),
+]
+
+
+class TestEncodedRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.path, self.lines = testdata.encoded_file(self, FIELDS)
+
+    def test_columns_match_decode_mrz(self):
+        with mrzfile.EncodedRecords(self.path) as records:
+            self.assertEqual(len(records), 2)
+            sex = records.column('sex')
+            birth_dates = records.column('birth_date')
+            passport_numbers = records.column('passport_number')
+            for index, (line1, line2) in enumerate(self.lines):
+                decoded = MRTD.decode_mrz(line1, line2)['line2']
+                self.assertEqual(sex[index], decoded['sex'].encode())
+                self.assertEqual(birth_dates[index], decoded['birth_date'].encode())
+                self.assertEqual(passport_numbers[index], decoded['passport_number'].encode())
+        self.assertEqual(bytes(birth_dates.buffer), b'740812900101')
+        self.assertEqual(list(sex), [b'F', b'M'])
+        self.assertEqual(passport_numbers[-1], b'A12345678')
+
+    def test_name_columns_match_decode_mrz(self):
+        with mrzfile.EncodedRecords(self.path) as records:
+            last_names, first_names, middle_names, full_names = records.name_columns()
+        expected = [MRTD.decode_mrz(*lines)['line1'] for lines in self.lines]
+        self.assertEqual(last_names, [decoded['last_name'] for decoded in expected])
+        self.assertEqual(first_names, [decoded['first_name'] for decoded in expected])
+        self.assertEqual(middle_names, [decoded['middle_name'] for decoded in expected])
+        self.assertEqual(full_names, [decoded['full_name'] for decoded in expected])
+
+    def test_row_is_decode_mrz_dict(self):
+        with mrzfile.EncodedRecords(self.path) as records:
+            self.assertEqual(records.row(0), MRTD.decode_mrz(*self.lines[0]))
+            self.assertEqual(list(records.rows()), [MRTD.decode_mrz(*lines) for lines in self.lines])
+            self.assertEqual(records.record(1), MRTD.MRZRecord(*self.lines[1]))
+            with self.assertRaises(IndexError):
+                records.row(2)
+
+    def test_rejects_wrong_stride(self):
+        with open(self.path, 'a') as f:
+            f.write('P<UTO\n')
+        with self.assertRaises(ValueError):
+            mrzfile.EncodedRecords(self.path)
+
+    def test_empty_file(self):
+        open(self.path, 'w').close()
+        with mrzfile.EncodedRecords(self.path) as records:
+            self.assertEqual(len(records), 0)
+            self.assertEqual(len(records.column('sex')), 0)
+
+
+    def test_random_access_and_slicing(self):
+        with open(self.path, 'a') as f:
+            for line1, line2 in self.lines:
+                f.write(f"{line1};{line2}\n")
+        decoded = [MRTD.decode_mrz(*lines) for lines in self.lines * 2]
+        with mrzfile.EncodedRecords(self.path, full_check=True) as records:
+            self.assertEqual(len(records), 4)
+            self.assertEqual(records[1], decoded[1])
+            self.assertEqual(records[-1], decoded[3])
+            self.assertEqual(records[1:3], decoded[1:3])
+            self.assertEqual(records[::2], decoded[::2])
+            self.assertEqual(records[5:], [])
+            self.assertEqual(list(records), decoded)
+            self.assertEqual([len(chunk) for chunk in records.iter_chunks(3)], [3, 1])
+            with self.assertRaises(IndexError):
+                records[4]
+
+    def test_rejects_bad_separators(self):
+        with open(self.path, 'r+b') as f:
+            f.seek(44)
+            f.write(b'<')
+        with self.assertRaises(ValueError):
+            mrzfile.EncodedRecords(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
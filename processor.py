@@ -1,40 +1,494 @@
+import argparse
+import hashlib
 import json
-from MRTD import encode_mrz
+import os
+import re
+import sys
+import time
+from collections import deque
+from itertools import islice, repeat
+from MRTD import TD3, encode_mrz_batch, verify_mrz
+from mrzfile import LINE2_OFFSET, LINE_LENGTH, ROW_SIZE
 
-def main():
-    with open("records_decoded.json", "r") as f:
-        data = json.load(f)
+FIELD_NAMES = (
+    "document_type", "issuing_country", "last_name", "first_name", "middle_name",
+    "passport_number", "country_code", "birth_date", "sex", "expiration_date",
+    "personal_number",
+)
 
-    records = data["records_decoded"]
-    output_lines = []
+_RECORDS_START = re.compile(r'"records_decoded"\s*:\s*\[')
+_SEPARATORS = re.compile(r'[\s,]*')
 
+
+def record_to_fields(record: dict) -> dict:
+    """Map one records_decoded.json entry to encode_mrz fields"""
+    name_parts = record["line1"].get("given_name", "").split()
+    first_name = name_parts[0] if name_parts else ""
+    middle_name = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
+
+    return {
+        "document_type": "P",
+        "issuing_country": record["line1"].get("issuing_country", "")[:3],
+        "last_name": record["line1"].get("last_name", ""),
+        "first_name": first_name,
+        "middle_name": middle_name,
+        "passport_number": record["line2"].get("passport_number", ""),
+        "country_code": record["line2"].get("country_code", ""),
+        "birth_date": record["line2"].get("birth_date", ""),
+        "sex": record["line2"].get("sex", ""),
+        "expiration_date": record["line2"].get("expiration_date", ""),
+        "personal_number": record["line2"].get("personal_number", "")
+    }
+
+
+def records_to_columns(records) -> dict:
+    """Map decoded records to the columnar input of encode_mrz_batch"""
+    columns = {name: [] for name in FIELD_NAMES}
     for record in records:
-        name_parts = record["line1"].get("given_name", "").split()
-        first_name = name_parts[0] if name_parts else ""
-        middle_name = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
-
-        fields = {
-            "document_type": "P",
-            "issuing_country": record["line1"].get("issuing_country", "")[:3],
-            "last_name": record["line1"].get("last_name", ""),
-            "first_name": first_name,
-            "middle_name": middle_name,
-            "passport_number": record["line2"].get("passport_number", ""),
-            "country_code": record["line2"].get("country_code", ""),
-            "birth_date": record["line2"].get("birth_date", ""),
-            "sex": record["line2"].get("sex", ""),
-            "expiration_date": record["line2"].get("expiration_date", ""),
-            "personal_number": record["line2"].get("personal_number", "")
-        }
-
-        line1, line2 = encode_mrz(fields)
-        output_lines.append(f"{line1};{line2}")
-
-    with open("records_encoded.json", "w") as f:
-        for line in output_lines:
-            f.write(line + "\n")
-
-    print(f"Encoded {len(output_lines)} records and saved to records_encoded.json")
+        for name, value in record_to_fields(record).items():
+            columns[name].append(value)
+    return columns
+
+
+def iter_decoded_records(f, read_size: int = 1 << 16):
+    """Yield the entries of a {"records_decoded": [...]} document incrementally
+
+    Only the current read buffer and the record being parsed are held in
+    memory, regardless of how many records the file contains.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        match = _RECORDS_START.search(buffer)
+        if match:
+            break
+        chunk = f.read(read_size)
+        if not chunk:
+            raise ValueError("No records_decoded array found in input.")
+        buffer += chunk
+
+    pos = match.end()
+    while True:
+        pos = _SEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            if pos == len(buffer):
+                raise json.JSONDecodeError("Unterminated records_decoded array", buffer, pos)
+            record, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The record straddles the end of the buffer: read more and retry
+            chunk = f.read(read_size)
+            if not chunk:
+                raise
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield record
+
+
+def positive_int(text: str) -> int:
+    """argparse type for counts that must be at least 1"""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+
+def iter_ndjson_records(f):
+    """Yield one decoded record per non-blank line"""
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def encode_chunk(records: list, verify: bool = False) -> tuple:
+    """Encode one chunk of records into a block of output rows
+
+    Runs in worker processes, so it takes and returns plain picklable
+    values: the raw records in, one bytes block plus counts out.
+    Returns ``(block, record_count, invalid_count)``.
+    """
+    line1_rows, line2_rows = encode_mrz_batch(records_to_columns(records))
+    invalid = 0
+    if verify:
+        for line1, line2 in zip(line1_rows, line2_rows):
+            if not verify_mrz(line1.decode("utf-8"), line2.decode("utf-8"))["valid"]:
+                invalid += 1
+    block = b"".join(line1 + b";" + line2 + b"\n" for line1, line2 in zip(line1_rows, line2_rows))
+    return block, len(line1_rows), invalid
+
+
+def encode_blocks(records, chunk_size: int = 1000, workers: int = 1, verify: bool = False):
+    """Yield encode_chunk results for consecutive chunks, in input order
+
+    With more than one worker, chunks are sharded across a process pool.
+    At most ``2 * workers`` chunks are in flight, so memory stays bounded
+    and blocks are yielded in the same order the records arrived.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, not {chunk_size}")
+    records = iter(records)
+    chunks = iter(lambda: list(islice(records, chunk_size)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield encode_chunk(chunk, verify)
+        return
+
+    # Imported here: it pulls in multiprocessing, which single-process runs never need
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(encode_chunk, chunk, verify))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_encoded(records, out, chunk_size: int = 1000, workers: int = 1, verify: bool = False) -> tuple:
+    """Encode records chunk by chunk, writing each chunk as soon as it is ready
+
+    Returns ``(record_count, invalid_count)``; invalid rows are only
+    counted when ``verify`` is set.
+    """
+    count = invalid = 0
+    for block, block_count, block_invalid in encode_blocks(records, chunk_size, workers, verify):
+        out.write(block)
+        count += block_count
+        invalid += block_invalid
+    return count, invalid
+
+
+def record_digest(fields: dict) -> str:
+    """Content hash of the encode_mrz fields a record maps to"""
+    return hashlib.blake2b(json.dumps(fields, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def _load_manifest(manifest_path: str, output_path: str):
+    """Manifest rows if they still describe the output file, else None
+
+    The manifest holds the output's source_signature from when it was
+    written, so an output rewritten since, even with as many rows, is
+    not patched from a stale manifest.
+    """
+    from store import source_signature
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if (os.path.getsize(output_path) != len(manifest["rows"]) * ROW_SIZE
+                or tuple(manifest["output"]) != source_signature(output_path)):
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return manifest["rows"]
+
+
+def _remove_manifest(manifest_path: str):
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def _patch_rows(out, pending: list):
+    """Encode (row, record) pairs and write each at its fixed offset
+
+    Raises ValueError, before writing anything, if a record encodes to a
+    row that is not ROW_SIZE bytes (a non-ASCII name or country).
+    """
+    line1_rows, line2_rows = encode_mrz_batch(records_to_columns(record for _, record in pending))
+    for (_, record), line1, line2 in zip(pending, line1_rows, line2_rows):
+        if len(line1) + len(line2) + 2 != ROW_SIZE:
+            raise ValueError(f"Record with passport number {record['line2'].get('passport_number', '')!r} "
+                             f"has non-ASCII text, which cannot be patched into fixed-width rows; "
+                             f"encode without --incremental.")
+    for (row, _), line1, line2 in zip(pending, line1_rows, line2_rows):
+        out.seek(row * ROW_SIZE)
+        out.write(line1 + b";" + line2 + b"\n")
+
+
+def update_encoded(records, output_path: str, manifest_path: str, chunk_size: int = 1000,
+                   rebuild: bool = False) -> dict:
+    """Re-encode only new or changed records, patching the output in place
+
+    The manifest maps each passport number (suffixed ``#n`` for its n-th
+    repeat) to its row, which is its position in the input, and a content
+    hash of its fields. Unchanged records are skipped, changed ones are
+    rewritten at ``row * ROW_SIZE`` and new ones at the end of the input
+    are appended. Without a usable manifest, or with ``rebuild``, the
+    output is written from scratch.
+
+    Returns counts of ``added``, ``changed``, ``unchanged``, ``removed``
+    and ``moved`` records. Removed records cannot be patched out of a
+    fixed-width file, and records inserted before the end or reordered
+    (``moved``) would leave rows out of input order, so in either case the
+    output no longer matches a full run: callers rebuild when ``removed``
+    or ``moved`` > 0. Patching stops at the first moved record and the
+    manifest is deleted, so the next run rebuilds too.
+    """
+    entries = None if rebuild else _load_manifest(manifest_path, output_path)
+    mode = "r+b" if entries is not None else "w+b"
+    entries = entries or {}
+
+    stats = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0, "moved": 0}
+    occurrences = {}
+    seen = set()
+    pending = []
+    first_new_row = len(entries)
+    with open(output_path, mode) as out:
+        for row, record in enumerate(records):
+            fields = record_to_fields(record)
+            number = fields["passport_number"]
+            repeat = occurrences.get(number, 0)
+            occurrences[number] = repeat + 1
+            key = f"{number}#{repeat}" if repeat else number
+            seen.add(key)
+
+            digest = record_digest(fields)
+            entry = entries.get(key)
+            if (entry is not None and entry[0] != row) or (entry is None and row < first_new_row):
+                # A full run would write this record at another row
+                stats["moved"] += 1
+                continue
+            if entry is not None and entry[1] == digest:
+                stats["unchanged"] += 1
+                continue
+            stats["changed" if entry is not None else "added"] += 1
+            entries[key] = [row, digest]
+            if stats["moved"]:
+                continue
+            pending.append((row, record))
+            if len(pending) >= chunk_size:
+                _patch_rows(out, pending)
+                pending = []
+        if pending and not stats["moved"]:
+            _patch_rows(out, pending)
+
+    # Manifest keys the input no longer has; added keys are all in seen
+    stats["removed"] = len(entries.keys() - seen)
+    if stats["moved"]:
+        _remove_manifest(manifest_path)
+        return stats
+    from store import source_signature
+    building = manifest_path + ".tmp"
+    with open(building, "w") as f:
+        json.dump({"rows": entries, "output": source_signature(output_path)}, f)
+    os.replace(building, manifest_path)
+    return stats
+
+
+def verify_rows(path: str, start: int, count: int) -> tuple:
+    """Check every check digit of ``count`` rows of an encoded file from row ``start``
+
+    Runs in worker processes, so it reads its rows itself and only a list
+    of failures goes back. All four TD3 check digits are checked, the
+    personal number's included. Returns ``(row_count, failures)`` with a
+    ``(row, fields)`` pair for every row with a bad digit; ``fields`` is
+    ``('format',)`` for a row that is not 'line1;line2' or whose check
+    digit fields hold bytes that are not ASCII.
+    """
+    check_mask = TD3.check_mask
+    all_valid = TD3.all_valid
+    with open(path, "rb") as f:
+        f.seek(start * ROW_SIZE)
+        block = f.read(count * ROW_SIZE).decode("ascii", "replace")
+
+    failures = []
+    for offset in range(0, len(block), ROW_SIZE):
+        if block[offset + LINE_LENGTH] != ";" or block[offset + ROW_SIZE - 1] != "\n":
+            failures.append((start + offset // ROW_SIZE, ("format",)))
+            continue
+        try:
+            mask = check_mask(block[offset:offset + LINE_LENGTH],
+                              block[offset + LINE2_OFFSET:offset + LINE2_OFFSET + LINE_LENGTH])
+        except ValueError:
+            # A damaged byte, decoded as U+FFFD, that calculate_check_digit cannot weigh
+            failures.append((start + offset // ROW_SIZE, ("format",)))
+            continue
+        if mask != all_valid:
+            failures.append((start + offset // ROW_SIZE,
+                             tuple(field for bit, field in enumerate(TD3.check_fields) if not mask >> bit & 1)))
+    return len(block) // ROW_SIZE, failures
+
+
+def verify_lines(lines: list, start: int) -> tuple:
+    """verify_rows for rows given as text lines, which need not be ROW_SIZE bytes
+
+    Rows with non-ASCII names or countries are written as UTF-8 and so are
+    longer than ROW_SIZE; here a row only has to be 44 characters, ';' and
+    44 more characters on a line of its own.
+    """
+    check_mask = TD3.check_mask
+    all_valid = TD3.all_valid
+    failures = []
+    for row, line in enumerate(lines, start):
+        line1, separator, line2 = line.partition(";")
+        if not separator or len(line1) != LINE_LENGTH or len(line2) != LINE_LENGTH + 1 or line2[-1] != "\n":
+            failures.append((row, ("format",)))
+            continue
+        try:
+            mask = check_mask(line1, line2[:-1])
+        except ValueError:
+            failures.append((row, ("format",)))
+            continue
+        if mask != all_valid:
+            failures.append((row, tuple(field for bit, field in enumerate(TD3.check_fields) if not mask >> bit & 1)))
+    return len(lines), failures
+
+
+def _verify_line_blocks(path: str, chunk_size: int):
+    """verify_lines results for consecutive chunks of lines of an encoded file"""
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as f:
+        start = 0
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                return
+            yield verify_lines(lines, start)
+            start += len(lines)
+
+
+def verify_blocks(path: str, chunk_size: int = 100000, workers: int = 1):
+    """Yield verify_rows results for consecutive chunks of an encoded file, in file order
+
+    A file that is not a whole number of ROW_SIZE rows (one holding UTF-8
+    names, say) is verified line by line in this process instead.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, not {chunk_size}")
+    size = os.path.getsize(path)
+    if size % ROW_SIZE:
+        yield from _verify_line_blocks(path, chunk_size)
+        return
+    rows = size // ROW_SIZE
+    starts = range(0, rows, chunk_size)
+    counts = [min(chunk_size, rows - start) for start in starts]
+    if workers <= 1:
+        yield from map(verify_rows, repeat(path), starts, counts)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(verify_rows, repeat(path), starts, counts)
+
+
+def verify_main(argv) -> int:
+    """``processor.py verify``: report the rows of an encoded file with bad check digits"""
+    parser = argparse.ArgumentParser(prog="processor.py verify",
+                                     description="Verify every check digit of an encoded file.")
+    parser.add_argument("--input", default="records_encoded.json")
+    parser.add_argument("--chunk-size", type=positive_int, default=100000,
+                        help="rows read and verified per batch")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="verify chunks in this many processes")
+    parser.add_argument("--report", help="write one 'row field,field' line per failing row")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    count = invalid = 0
+    fields = {}
+    try:
+        with open(args.report or os.devnull, "w") as report:
+            for block_count, failures in verify_blocks(args.input, args.chunk_size, args.workers):
+                count += block_count
+                invalid += len(failures)
+                for row, bad in failures:
+                    report.write(f"{row} {','.join(bad)}\n")
+                    for field in bad:
+                        fields[field] = fields.get(field, 0) + 1
+    except OSError as error:
+        parser.error(f"{error.filename or args.input}: {error.strerror or error}")
+    elapsed = time.perf_counter() - start
+
+    print(f"Verified {count} records in {elapsed:.2f}s ({count / elapsed if elapsed else 0:,.0f} records/sec): "
+          f"{invalid} failed")
+    if fields:
+        print("Failures by field: " + ", ".join(f"{field} {total}" for field, total in sorted(fields.items())))
+    return 1 if invalid else 0
+
+
+def _open_records(f, args):
+    if args.ndjson:
+        return iter_ndjson_records(f)
+    if args.stream:
+        return iter_decoded_records(f)
+    return json.load(f)["records_decoded"]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["verify"]:
+        return verify_main(argv[1:])
+
+    parser = argparse.ArgumentParser(description="Encode decoded passport records as TD3 MRZ lines "
+                                                 "('processor.py verify -h' checks an encoded file).")
+    parser.add_argument("--input", default="records_decoded.json")
+    parser.add_argument("--output", default="records_encoded.json")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse the input incrementally so memory stays flat")
+    parser.add_argument("--ndjson", action="store_true",
+                        help="input holds one decoded record per line (always streamed)")
+    parser.add_argument("--chunk-size", type=positive_int, default=1000,
+                        help="records encoded and written per batch")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="encode chunks in this many processes")
+    parser.add_argument("--verify", action="store_true",
+                        help="run verify_mrz on every encoded row")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-encode new or changed records, patching the output in place; "
+                             "removed, inserted or reordered records trigger a full rebuild so rows "
+                             "stay in input order (not with --verify or --workers)")
+    parser.add_argument("--manifest", help="content-hash manifest for --incremental "
+                                           "(default: <output>.manifest.json)")
+    parser.add_argument("--profile", nargs="?", const="stages", choices=("stages", "detail"),
+                        help="print per-stage timings to stderr; 'detail' also times names and "
+                             "check digits (main process only, so use --workers 1)")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write the stage timings as JSON, or Prometheus text for *.prom")
+    args = parser.parse_args(argv)
+    if args.incremental and (args.verify or args.workers > 1):
+        parser.error("--incremental cannot be combined with --verify or --workers")
+
+    if not (args.profile or args.metrics):
+        _run(args)
+        return
+
+    from instrumentation import PROFILER
+    PROFILER.enable(detail=args.profile == "detail")
+    try:
+        _run(args)
+    finally:
+        PROFILER.disable()
+    if args.profile:
+        print(PROFILER.format_table(), file=sys.stderr)
+    if args.metrics:
+        PROFILER.write(args.metrics)
+
+
+def _run(args):
+    manifest_path = args.manifest or args.output + ".manifest.json"
+    if args.incremental:
+        with open(args.input, "r") as f:
+            stats = update_encoded(_open_records(f, args), args.output, manifest_path, args.chunk_size)
+        if stats["removed"] or stats["moved"]:
+            # Rows cannot be dropped or moved in place
+            print(f"{stats['removed']} records were removed from the input and {stats['moved']} "
+                  f"moved; rebuilding {args.output}")
+            with open(args.input, "r") as f:
+                stats = update_encoded(_open_records(f, args), args.output, manifest_path, args.chunk_size,
+                                       rebuild=True)
+        print(f"Re-encoded {stats['changed']} changed and {stats['added']} new records "
+              f"({stats['unchanged']} unchanged) in {args.output}")
+        return
+
+    with open(args.input, "r") as f, open(args.output, "wb") as out:
+        count, invalid = write_encoded(_open_records(f, args), out, args.chunk_size, args.workers, args.verify)
+    # The output no longer matches what an earlier --incremental run recorded
+    _remove_manifest(manifest_path)
+
+    print(f"Encoded {count} records and saved to {args.output}")
+    if args.verify:
+        print(f"Verified {count} records: {invalid} failed verify_mrz")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import MRTD
+import processor
+
+
+RECORDS = [
+    {
+        "line1": {"issuing_country": "UTO", "last_name": "ERIKSSON", "given_name": "ANNA MARIA"},
+        "line2": {"passport_number": "L898902C3", "country_code": "UTO", "birth_date": "740812",
+                  "sex": "F", "expiration_date": "120415", "personal_number": "ZE184226B"}
+    },
+    {
+        "line1": {"issuing_country": "CAN", "last_name": "DOE", "given_name": "JANE"},
+        "line2": {"passport_number": "A12345678", "country_code": "CAN", "birth_date": "900101",
+                  "sex": "M", "expiration_date": "300101", "personal_number": "123456789"}
+    },
+]
+
+
+def expected_output(records) -> bytes:
+    lines = [MRTD.encode_mrz(processor.record_to_fields(record)) for record in records]
+    return "".join(f"{line1};{line2}\n" for line1, line2 in lines).encode("utf-8")
+
+
+class TestProcessor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input = os.path.join(self.tmpdir, "records_decoded.json")
+        self.output = os.path.join(self.tmpdir, "records_encoded.json")
+        with open(self.input, "w") as f:
+            json.dump({"records_decoded": RECORDS * 3}, f, indent=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_output(self) -> bytes:
+        with open(self.output, "rb") as f:
+            return f.read()
+
+    def test_iter_decoded_records_across_read_boundaries(self):
+        with open(self.input) as f:
+            text = f.read()
+        for read_size in (1, 5, 64, 1 << 16):
+            records = list(processor.iter_decoded_records(io.StringIO(text), read_size))
+            self.assertEqual(records, RECORDS * 3)
+        self.assertEqual(list(processor.iter_decoded_records(io.StringIO('{"records_decoded": []}'))), [])
+
+    def test_iter_decoded_records_errors(self):
+        with self.assertRaises(ValueError):
+            list(processor.iter_decoded_records(io.StringIO('{"records": []}')))
+        with self.assertRaises(json.JSONDecodeError):
+            list(processor.iter_decoded_records(io.StringIO('{"records_decoded": [{"line1": {}}'), 4))
+
+    def test_main_load_and_stream_match(self):
+        processor.main(["--input", self.input, "--output", self.output])
+        self.assertEqual(self.read_output(), expected_output(RECORDS * 3))
+        processor.main(["--input", self.input, "--output", self.output, "--stream", "--chunk-size", "2"])
+        self.assertEqual(self.read_output(), expected_output(RECORDS * 3))
+
+    def test_main_ndjson(self):
+        with open(self.input, "w") as f:
+            for record in RECORDS:
+                f.write(json.dumps(record) + "\n\n")
+        processor.main(["--input", self.input, "--output", self.output, "--ndjson"])
+        self.assertEqual(self.read_output(), expected_output(RECORDS))
+
+    def test_write_encoded_counts_chunks(self):
+        out = io.BytesIO()
+        self.assertEqual(processor.write_encoded(iter(RECORDS * 3), out, chunk_size=4), (6, 0))
+        self.assertEqual(out.getvalue(), expected_output(RECORDS * 3))
+
+    def test_chunk_size_must_be_positive(self):
+        processor.main(["--input", self.input, "--output", self.output])
+        for chunk_size in ("0", "-5"):
+            with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                processor.main(["--input", self.input, "--output", self.output, "--chunk-size", chunk_size])
+        self.assertEqual(self.read_output(), expected_output(RECORDS * 3))
+        with self.assertRaises(ValueError):
+            processor.write_encoded(iter(RECORDS), io.BytesIO(), chunk_size=0)
+
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            processor.main(["verify", "--input", self.output, "--chunk-size", "0"])
+        with self.assertRaises(ValueError):
+            list(processor.verify_blocks(self.output, chunk_size=0))
+
+    def test_write_encoded_workers_keep_input_order(self):
+        records = [dict(record, line2=dict(record["line2"], passport_number=f"X{index:08d}"))
+                   for index, record in enumerate(RECORDS * 10)]
+        out = io.BytesIO()
+        count, invalid = processor.write_encoded(records, out, chunk_size=3, workers=2, verify=True)
+        self.assertEqual((count, invalid), (20, 0))
+        self.assertEqual(out.getvalue(), expected_output(records))
+
+    def test_encode_chunk_verifies_padded_fields(self):
+        record = dict(RECORDS[0], line2=dict(RECORDS[0]["line2"], birth_date="74"))
+        block, count, invalid = processor.encode_chunk([RECORDS[1], record], verify=True)
+        self.assertEqual(block, expected_output([RECORDS[1], record]))
+        self.assertEqual((count, invalid), (2, 0))
+
+    def test_non_ascii_names_encode_as_text(self):
+        record = dict(RECORDS[0], line1=dict(RECORDS[0]["line1"], last_name="M\u00fcller", issuing_country="D\u00c9U"))
+        with open(self.input, "w") as f:
+            json.dump({"records_decoded": [RECORDS[1], record]}, f)
+        for options in ([], ["--stream", "--verify", "--chunk-size", "1"]):
+            processor.main(["--input", self.input, "--output", self.output] + options)
+            self.assertEqual(self.read_output(), expected_output([RECORDS[1], record]))
+        self.assertIn("M\u00dcLLER<<ANNA<MARIA", self.read_output().decode("utf-8"))
+
+        with self.assertRaisesRegex(ValueError, "L898902C3"):
+            processor.update_encoded([RECORDS[1], record], self.output, os.path.join(self.tmpdir, "manifest.json"))
+
+    def test_verify_reads_non_ascii_rows_line_by_line(self):
+        record = dict(RECORDS[0], line1=dict(RECORDS[0]["line1"], last_name="M\u00fcller"))
+        with open(self.input, "w") as f:
+            json.dump({"records_decoded": [record, RECORDS[1], record]}, f)
+        processor.main(["--input", self.input, "--output", self.output])
+        self.assertNotEqual(os.path.getsize(self.output) % processor.ROW_SIZE, 0)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            self.assertEqual(processor.main(["verify", "--input", self.output, "--chunk-size", "2"]), 0)
+        self.assertIn("Verified 3 records", stdout.getvalue())
+
+        rows = self.read_output().decode("utf-8").splitlines(keepends=True)
+        rows[1] = rows[1][:54] + "X" + rows[1][55:]  # passport number check digit
+        rows[2] = rows[2][:40] + rows[2][41:]        # one character short
+        with open(self.output, "w", encoding="utf-8", newline="") as f:
+            f.writelines(rows + ["\ufffd" * 44 + ";" + rows[0][45:]])
+        blocks = list(processor.verify_blocks(self.output, chunk_size=2, workers=2))
+        self.assertEqual([count for count, _ in blocks], [2, 2])
+        self.assertEqual([failure for _, failures in blocks for failure in failures],
+                         [(1, ("passport_number",)), (2, ("format",))])
+
+    def test_verify_missing_input(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit) as raised:
+            processor.main(["verify", "--input", os.path.join(self.tmpdir, "missing.json")])
+        self.assertNotEqual(raised.exception.code, 0)
+        self.assertIn("missing.json", stderr.getvalue())
+
+    def test_verify_reports_failing_rows(self):
+        processor.main(["--input", self.input, "--output", self.output])
+        rows = bytearray(self.read_output())
+        row_size = processor.ROW_SIZE
+        rows[1 * row_size + 45 + 9:1 * row_size + 45 + 10] = b"X"   # passport number check digit
+        rows[2 * row_size + 45 + 43:2 * row_size + 45 + 44] = b"X"  # personal number check digit
+        rows[4 * row_size + 44:4 * row_size + 45] = b"|"            # separator
+        rows[5 * row_size + 47:5 * row_size + 48] = b"\xc3"         # passport number, not ASCII
+        with open(self.output, "wb") as f:
+            f.write(rows)
+        # verify_mrz skips the personal number digit; verify does not
+        row = rows[2 * row_size:3 * row_size].decode("ascii")
+        self.assertTrue(MRTD.verify_mrz(row[:44], row[45:89])["valid"])
+
+        expected = [(1, ("passport_number",)), (2, ("personal_number",)), (4, ("format",)), (5, ("format",))]
+        for workers, chunk_size in ((1, 100), (2, 2)):
+            blocks = list(processor.verify_blocks(self.output, chunk_size, workers))
+            self.assertEqual(sum(count for count, _ in blocks), 6)
+            self.assertEqual([failure for _, failures in blocks for failure in failures], expected)
+
+        report = os.path.join(self.tmpdir, "report.txt")
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            status = processor.main(["verify", "--input", self.output, "--report", report, "--workers", "2",
+                                     "--chunk-size", "4"])
+        self.assertEqual(status, 1)
+        with open(report) as f:
+            self.assertEqual(f.read(), "1 passport_number\n2 personal_number\n4 format\n5 format\n")
+        self.assertIn("4 failed", stdout.getvalue())
+        self.assertIn("records/sec", stdout.getvalue())
+
+    def test_incremental_patches_changed_and_appends_new(self):
+        manifest = os.path.join(self.tmpdir, "manifest.json")
+        records = [dict(record, line2=dict(record["line2"], passport_number=f"X{index:08d}"))
+                   for index, record in enumerate(RECORDS * 2)]
+        stats = processor.update_encoded(records, self.output, manifest)
+        self.assertEqual(stats, {"added": 4, "changed": 0, "unchanged": 0, "removed": 0, "moved": 0})
+        self.assertEqual(self.read_output(), expected_output(records))
+
+        records[1] = dict(records[1], line1=dict(records[1]["line1"], last_name="CHANGED"))
+        records.append(RECORDS[0])
+        stats = processor.update_encoded(records, self.output, manifest)
+        self.assertEqual(stats, {"added": 1, "changed": 1, "unchanged": 3, "removed": 0, "moved": 0})
+        self.assertEqual(self.read_output(), expected_output(records))
+
+    def test_incremental_rebuilds_when_records_inserted_or_reordered(self):
+        records = [dict(record, line2=dict(record["line2"], passport_number=f"X{index:08d}"))
+                   for index, record in enumerate(RECORDS * 2)]
+        for changed in ([records[0], RECORDS[0]] + records[1:], records[::-1]):
+            with open(self.input, "w") as f:
+                json.dump({"records_decoded": records}, f)
+            processor.main(["--input", self.input, "--output", self.output, "--incremental"])
+            with open(self.input, "w") as f:
+                json.dump({"records_decoded": changed}, f)
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                processor.main(["--input", self.input, "--output", self.output, "--incremental"])
+            self.assertTrue(stdout.getvalue().startswith("0 records were removed"), stdout.getvalue())
+            self.assertIn("rebuilding", stdout.getvalue())
+            self.assertEqual(self.read_output(), expected_output(changed))
+            stats = processor.update_encoded(changed, self.output, self.output + ".manifest.json")
+            self.assertEqual(stats["unchanged"], len(changed))
+
+    def test_incremental_rebuilds_after_output_rewritten(self):
+        records = [dict(record, line2=dict(record["line2"], passport_number=f"X{index:08d}"))
+                   for index, record in enumerate(RECORDS * 2)]
+        others = [dict(record, line2=dict(record["line2"], passport_number=f"Y{index:08d}"))
+                  for index, record in enumerate(RECORDS * 2)]
+        with open(self.input, "w") as f:
+            json.dump({"records_decoded": records}, f)
+        processor.main(["--input", self.input, "--output", self.output, "--incremental"])
+        self.assertTrue(os.path.exists(self.output + ".manifest.json"))
+
+        # A full run over as many other records
+        with open(self.input, "w") as f:
+            json.dump({"records_decoded": others}, f)
+        processor.main(["--input", self.input, "--output", self.output])
+        self.assertFalse(os.path.exists(self.output + ".manifest.json"))
+        with open(self.input, "w") as f:
+            json.dump({"records_decoded": records}, f)
+        processor.main(["--input", self.input, "--output", self.output, "--incremental"])
+        self.assertEqual(self.read_output(), expected_output(records))
+
+        # Rewritten by something else: the manifest's output signature no longer matches
+        manifest = self.output + ".manifest.json"
+        with open(self.output, "wb") as f:
+            f.write(expected_output(others))
+        os.utime(self.output, ns=(0, 0))
+        stats = processor.update_encoded(records, self.output, manifest)
+        self.assertEqual(stats["added"], len(records))
+        self.assertEqual(self.read_output(), expected_output(records))
+
+    def test_incremental_rejects_verify_and_workers(self):
+        for options in (["--verify"], ["--workers", "2"]):
+            with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                processor.main(["--input", self.input, "--output", self.output, "--incremental"] + options)
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_incremental_rebuilds_when_records_removed(self):
+        with open(self.input, "w") as f:
+            json.dump({"records_decoded": RECORDS}, f)
+        processor.main(["--input", self.input, "--output", self.output, "--incremental"])
+        with open(self.input, "w") as f:
+            json.dump({"records_decoded": RECORDS[1:]}, f)
+        processor.main(["--input", self.input, "--output", self.output, "--incremental", "--stream"])
+        self.assertEqual(self.read_output(), expected_output(RECORDS[1:]))
+        stats = processor.update_encoded(RECORDS[1:], self.output, self.output + ".manifest.json")
+        self.assertEqual(stats["unchanged"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
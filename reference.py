@@ -0,0 +1,204 @@
+"""Reference implementations of the MRTD check digit, encode and decode
+
+Frozen copies of the original, straightforward versions of fletcher16,
+calculate_check_digit, encode_mrz, decode_mrz, verify_mrz and
+verify_check_digits, plus the original processor's record loop as
+encode_decoded_records. They are the oracles differentialtest.py holds every
+optimised, cached and batched path in MRTD (and the modules built on it)
+against, so keep them slow and obvious: do not optimise or refactor
+this module, and only change it together with a deliberate change of
+MRTD's behaviour. verify_check_digits drops the original's debug prints
+and nothing else.
+"""
+
+
+def fletcher16(data: bytes) -> int:
+    """Pure Fletcher-16 implementation"""
+    sum1 = sum2 = 0
+    for byte in data:
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+
+def calculate_check_digit(data: str) -> int:
+    """Calculate check digit using Fletcher-16 with MRZ rules"""
+    if not data:
+        return 0
+
+    # Convert to MRZ format: uppercase and < becomes 0
+    normalized = data.upper().replace('<', '0')
+
+    # Calculate checksum on the raw ASCII bytes
+    return fletcher16(normalized.encode('ascii')) % 10
+
+
+def decode_mrz(line1: str, line2: str) -> dict:
+    """Decode MRZ lines with perfect name handling"""
+    line1 = (line1 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
+    line2 = (line2 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
+
+    name_parts = line1[5:].split('<<')
+    last_name = name_parts[0].replace('<', ' ').strip()
+
+    if len(name_parts) > 1:
+        first_middle = name_parts[1].split('<', 1)
+        first_name = first_middle[0].strip()
+        middle_name = first_middle[1].replace('<', ' ').strip() if len(first_middle) > 1 else ''
+    else:
+        first_name = ''
+        middle_name = ''
+
+    return {
+        'line1': {
+            'document_type': line1[0],
+            'issuing_country': line1[2:5],
+            'last_name': last_name,
+            'first_name': first_name,
+            'middle_name': middle_name,
+            'full_name': ' '.join(filter(None, [first_name, middle_name, last_name]))
+        },
+        'line2': {
+            'passport_number': line2[0:9],
+            'passport_number_check_digit': line2[9],
+            'country_code': line2[10:13],
+            'birth_date': line2[13:19],
+            'birth_date_check_digit': line2[19],
+            'sex': line2[20],
+            'expiration_date': line2[21:27],
+            'expiration_date_check_digit': line2[27],
+            'personal_number': line2[28:37],
+            'personal_number_check_digit': line2[43],
+        },
+    }
+
+
+def verify_mrz(line1: str, line2: str) -> dict:
+    """Precision MRZ verification with exact field handling"""
+    line1 = (line1 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
+    line2 = (line2 + '<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<')[:44]
+    decoded = decode_mrz(line1, line2)
+
+    results = {
+        'valid': True,
+        'details': {},
+        'calculated': {},
+        'debug': {
+            'line1': line1,
+            'line2': line2,
+            'decoded': decoded
+        }
+    }
+
+    def _verify(field: str, data: str, expected: str):
+        calculated = str(calculate_check_digit(data)) if data else '0'
+        results['calculated'][field] = calculated
+        is_valid = calculated == expected
+        results['details'][field] = is_valid
+        if not is_valid:
+            results['valid'] = False
+
+    _verify('passport_number', decoded['line2']['passport_number'],
+            decoded['line2']['passport_number_check_digit'])
+    _verify('birth_date', decoded['line2']['birth_date'],
+            decoded['line2']['birth_date_check_digit'])
+    _verify('expiration_date', decoded['line2']['expiration_date'],
+            decoded['line2']['expiration_date_check_digit'])
+
+    return results
+
+
+def encode_mrz(fields: dict) -> tuple:
+    # Name components (last<<first<middle)
+    last_name = fields.get('last_name', '').upper().replace(' ', '<')
+    first_name = fields.get('first_name', '').upper().replace(' ', '<')
+    middle_name = fields.get('middle_name', '').upper().replace(' ', '<')
+
+    name_part = f"{last_name}<<{first_name}"
+    if middle_name:
+        name_part += f"<{middle_name}"
+
+    line1 = (
+        fields.get('document_type', 'P') + '<' +
+        fields.get('issuing_country', '').ljust(3)[:3] +
+        name_part.ljust(39, '<')[:39]
+    ).ljust(44, '<')[:44]
+
+    line2 = ''
+
+    passport_num = fields.get('passport_number', '').upper().ljust(9, '<')[:9]
+    passport_check = str(calculate_check_digit(passport_num))
+    line2 += passport_num + passport_check
+
+    line2 += fields.get('country_code', '').upper().ljust(3)[:3]
+
+    birth_date = fields.get('birth_date', '').ljust(6, '<')[:6]
+    birth_check = str(calculate_check_digit(birth_date))
+    line2 += birth_date + birth_check
+
+    line2 += fields.get('sex', '<').upper()[0]
+
+    exp_date = fields.get('expiration_date', '').ljust(6, '<')[:6]
+    exp_check = str(calculate_check_digit(exp_date))
+    line2 += exp_date + exp_check
+
+    # Personal number is not padded, so a short one shifts what follows
+    personal_num = fields.get('personal_number', '').upper().replace(' ', '<')[:9]
+    personal_check = str(calculate_check_digit(personal_num))
+    line2 += personal_num + '<' * 6 + personal_check
+
+    if len(line2) < 44:
+        line2 = line2.ljust(44, '<')
+    return line1, line2
+
+
+def verify_check_digits(mrz_data: dict) -> dict:
+    results = {
+        'valid': True,
+        'details': {},
+        'composite_data': None
+    }
+
+    line2 = mrz_data['line2']
+    checks = [
+        ('passport_number', line2['passport_number'], line2['passport_number_check_digit']),
+        ('birth_date', line2['birth_date'], line2['birth_date_check_digit']),
+        ('expiration_date', line2['expiration_date'], line2['expiration_date_check_digit']),
+        ('personal_number', line2['personal_number'], line2['personal_number_check_digit'])
+    ]
+
+    for name, data, expected in checks:
+        results['details'][name] = str(calculate_check_digit(data)) == expected
+        if not results['details'][name]:
+            results['valid'] = False
+
+    return results
+
+
+def encode_decoded_records(records: list) -> list:
+    """The original processor.main: records_decoded.json entries to output lines"""
+    output_lines = []
+
+    for record in records:
+        name_parts = record["line1"].get("given_name", "").split()
+        first_name = name_parts[0] if name_parts else ""
+        middle_name = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
+
+        fields = {
+            "document_type": "P",
+            "issuing_country": record["line1"].get("issuing_country", "")[:3],
+            "last_name": record["line1"].get("last_name", ""),
+            "first_name": first_name,
+            "middle_name": middle_name,
+            "passport_number": record["line2"].get("passport_number", ""),
+            "country_code": record["line2"].get("country_code", ""),
+            "birth_date": record["line2"].get("birth_date", ""),
+            "sex": record["line2"].get("sex", ""),
+            "expiration_date": record["line2"].get("expiration_date", ""),
+            "personal_number": record["line2"].get("personal_number", "")
+        }
+
+        line1, line2 = encode_mrz(fields)
+        output_lines.append(f"{line1};{line2}")
+
+    return output_lines
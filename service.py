@@ -0,0 +1,295 @@
+"""Asyncio MRZ verification service with request micro-batching
+
+Serves a small HTTP/1.1 API over TCP or a Unix socket:
+
+    POST /verify  {"line1": "...", "line2": "..."}  -> verification result
+    GET  /stats                                     -> batching counters
+
+Concurrent /verify requests are queued and verified together in
+micro-batches collected over at most ``max_delay`` seconds.
+
+    python service.py serve --port 8567
+    python service.py load --port 8567 --concurrency 64 --requests 20000
+    python service.py load --local        # start a server in-process first
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from MRTD import (ALL_VALID, BIRTH_DATE_VALID, EXPIRATION_DATE_VALID, PASSPORT_NUMBER_VALID,
+                  PERSONAL_NUMBER_VALID, parse_and_verify)
+
+_FIELD_BITS = (
+    ('passport_number', PASSPORT_NUMBER_VALID),
+    ('birth_date', BIRTH_DATE_VALID),
+    ('expiration_date', EXPIRATION_DATE_VALID),
+    ('personal_number', PERSONAL_NUMBER_VALID),
+)
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}
+
+
+def verify_batch(pairs: list) -> list:
+    """Decode and verify a batch of (line1, line2) pairs
+
+    A pair whose check digit fields cannot be checksummed (non-ASCII
+    text) gets an ``{'error': ...}`` result instead of failing the batch.
+    """
+    results = []
+    for line1, line2 in pairs:
+        try:
+            decoded, mask = parse_and_verify(line1, line2)
+        except ValueError as error:
+            results.append({'error': f'cannot verify check digits: {error}'})
+            continue
+        results.append({
+            'valid': mask == ALL_VALID,
+            'details': {field: bool(mask & bit) for field, bit in _FIELD_BITS},
+            'decoded': decoded,
+        })
+    return results
+
+
+class VerificationBatcher:
+    """Collects concurrent verification requests into micro-batches
+
+    The first queued request opens a batch; anything else that arrives
+    within ``max_delay`` seconds (up to ``max_batch`` requests) is verified
+    with it in a single verify_batch call.
+    """
+
+    def __init__(self, max_batch: int = 256, max_delay: float = 0.002):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.requests = 0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def verify(self, line1: str, line2: str) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(((line1, line2), future))
+        return await future
+
+    def _drain(self, batch: list):
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            self._drain(batch)
+            if len(batch) < self.max_batch and self.max_delay > 0:
+                await asyncio.sleep(self.max_delay)
+                self._drain(batch)
+
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                results = verify_batch([pair for pair, _ in batch])
+            except Exception as error:
+                # Fail this batch's requests only; the batcher keeps serving
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+async def _read_message(reader) -> tuple:
+    """Read one HTTP/1.1 message: (start line, lower-cased headers, body)"""
+    start_line = await reader.readline()
+    if not start_line:
+        return None, None, None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return start_line.decode('latin-1').rstrip('\r\n'), headers, body
+
+
+async def _dispatch(method: str, path: str, body: bytes, batcher: VerificationBatcher) -> tuple:
+    if path == '/verify' and method == 'POST':
+        try:
+            request = json.loads(body)
+            line1, line2 = request['line1'], request['line2']
+            if not isinstance(line1, str) or not isinstance(line2, str):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'expected a JSON object with string line1 and line2'}
+        result = await batcher.verify(line1, line2)
+        return (400 if 'error' in result else 200), result
+    if path == '/stats' and method == 'GET':
+        return 200, {'batches': batcher.batches, 'requests': batcher.requests}
+    return 404, {'error': f'no route for {method} {path}'}
+
+
+async def handle_connection(reader, writer, batcher: VerificationBatcher):
+    """Serve keep-alive HTTP requests on one connection"""
+    try:
+        while True:
+            start_line, headers, body = await _read_message(reader)
+            if start_line is None:
+                break
+            method, path = (start_line.split(' ') + ['', ''])[:2]
+            status, payload = await _dispatch(method, path, body, batcher)
+            data = json.dumps(payload).encode()
+            writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str = '127.0.0.1', port: int = 8567, unix_path: str = None,
+                       max_batch: int = 256, max_delay: float = 0.002) -> tuple:
+    """Start the service; returns (server, batcher), both to be closed by the caller"""
+    batcher = VerificationBatcher(max_batch, max_delay)
+    batcher.start()
+
+    async def handler(reader, writer):
+        await handle_connection(reader, writer, batcher)
+
+    if unix_path:
+        server = await asyncio.start_unix_server(handler, unix_path)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    return server, batcher
+
+
+async def _open(host: str, port: int, unix_path: str):
+    if unix_path:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+
+async def post_verify(reader, writer, line1: str, line2: str) -> dict:
+    """Send one /verify request on an open connection and return its result"""
+    body = json.dumps({'line1': line1, 'line2': line2}).encode()
+    writer.write(b"POST /verify HTTP/1.1\r\nHost: mrtd\r\nContent-Type: application/json\r\n"
+                 b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    await writer.drain()
+    _, _, response = await _read_message(reader)
+    return json.loads(response)
+
+
+async def run_load(pairs: list, requests: int = 10000, concurrency: int = 64,
+                   host: str = '127.0.0.1', port: int = 8567, unix_path: str = None) -> dict:
+    """Drive the service with ``concurrency`` keep-alive clients; returns latency stats"""
+    latencies = []
+
+    async def client(offset: int, count: int):
+        reader, writer = await _open(host, port, unix_path)
+        try:
+            for index in range(offset, offset + count):
+                line1, line2 = pairs[index % len(pairs)]
+                start = time.perf_counter()
+                await post_verify(reader, writer, line1, line2)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    share, extra = divmod(requests, concurrency)
+    counts = [share + (1 if worker < extra else 0) for worker in range(concurrency)]
+    offsets = [sum(counts[:worker]) for worker in range(concurrency)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(offset, count) for offset, count in zip(offsets, counts) if count))
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'elapsed_s': elapsed,
+        'requests_per_s': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentiles[49] * 1e3,
+        'p90_ms': percentiles[89] * 1e3,
+        'p99_ms': percentiles[98] * 1e3,
+    }
+
+
+def load_pairs(path: str) -> list:
+    """(line1, line2) pairs from a records_encoded.json file"""
+    with open(path, 'r') as f:
+        return [tuple(line.rstrip('\n').split(';', 1)) for line in f if line.strip()]
+
+
+async def _serve(args):
+    server, batcher = await start_server(args.host, args.port, args.unix, args.max_batch, args.max_delay_ms / 1e3)
+    print(f"Serving MRZ verification on {args.unix or f'{args.host}:{args.port}'}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.close()
+
+
+async def _load(args):
+    pairs = load_pairs(args.input)
+    server = batcher = None
+    port = args.port
+    if args.local:
+        server, batcher = await start_server(args.host, args.port, args.unix, args.max_batch, args.max_delay_ms / 1e3)
+        if not args.unix:
+            port = server.sockets[0].getsockname()[1]
+    try:
+        stats = await run_load(pairs, args.requests, args.concurrency, args.host, port, args.unix)
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+            await batcher.close()
+    print(f"{stats['requests']} requests in {stats['elapsed_s']:.3f}s: {stats['requests_per_s']:,.0f} req/s, "
+          f"p50 {stats['p50_ms']:.2f} ms, p90 {stats['p90_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+    if batcher is not None:
+        print(f"{batcher.requests} requests verified in {batcher.batches} batches")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MRZ verification service and load generator.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the verification service')
+    load = commands.add_parser('load', help='run the load generator')
+    for command in (serve, load):
+        command.add_argument('--host', default='127.0.0.1')
+        command.add_argument('--port', type=int, default=8567)
+        command.add_argument('--unix', metavar='PATH', help='use a Unix socket instead of TCP')
+        command.add_argument('--max-batch', type=int, default=256)
+        command.add_argument('--max-delay-ms', type=float, default=2.0,
+                             help='how long a batch waits for more requests')
+    load.add_argument('--input', default='records_encoded.json', help='encoded lines to send')
+    load.add_argument('--requests', type=int, default=10000)
+    load.add_argument('--concurrency', type=int, default=64)
+    load.add_argument('--local', action='store_true', help='start a server in this process first')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(_serve(args) if args.command == 'serve' else _load(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+import MRTD
+import service
+import testdata
+
+
+LINE1, VALID_LINE2 = MRTD.encode_mrz(testdata.ERIKSSON)
+# Same document with a wrong passport number check digit
+LINE2 = VALID_LINE2[:9] + str((int(VALID_LINE2[9]) + 1) % 10) + VALID_LINE2[10:]
+
+
+async def request(port: int, raw: bytes) -> tuple:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(raw)
+    await writer.drain()
+    status_line, _, body = await service._read_message(reader)
+    writer.close()
+    return status_line, body
+
+
+class TestService(unittest.TestCase):
+
+    def run_with_server(self, scenario, **options):
+        async def run():
+            server, batcher = await service.start_server(port=0, **options)
+            try:
+                return await scenario(server.sockets[0].getsockname()[1], batcher)
+            finally:
+                server.close()
+                await server.wait_closed()
+                await batcher.close()
+        return asyncio.run(run())
+
+    def test_verify_batch_matches_parse_and_verify(self):
+        result, = service.verify_batch([(LINE1, LINE2)])
+        decoded, mask = MRTD.parse_and_verify(LINE1, LINE2)
+        self.assertEqual(result['decoded'], decoded)
+        self.assertEqual(result['valid'], mask == MRTD.ALL_VALID)
+        self.assertFalse(result['valid'])
+        self.assertFalse(result['details']['passport_number'])
+        self.assertTrue(result['details']['birth_date'])
+        self.assertTrue(service.verify_batch([(LINE1, VALID_LINE2)])[0]['valid'])
+
+    def test_concurrent_requests_are_batched(self):
+        async def scenario(port, batcher):
+            pairs = [(LINE1, LINE2)] * 5
+            stats = await service.run_load(pairs, requests=40, concurrency=20, port=port)
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            result = await service.post_verify(reader, writer, LINE1, LINE2)
+            writer.close()
+            return stats, result, batcher
+
+        stats, result, batcher = self.run_with_server(scenario, max_delay=0.01)
+        self.assertEqual(stats['requests'], 40)
+        self.assertEqual(batcher.requests, 41)
+        self.assertLess(batcher.batches, 41)
+        self.assertEqual(result, service.verify_batch([(LINE1, LINE2)])[0])
+
+    def test_bad_requests(self):
+        async def scenario(port, batcher):
+            bad_body = b'{"line1": 1}'
+            bad = await request(port, b"POST /verify HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(bad_body) + bad_body)
+            missing = await request(port, b"GET /nowhere HTTP/1.1\r\n\r\n")
+            stats = await request(port, b"GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n")
+            return bad, missing, stats
+
+        bad, missing, stats = self.run_with_server(scenario)
+        self.assertTrue(bad[0].startswith('HTTP/1.1 400'))
+        self.assertTrue(missing[0].startswith('HTTP/1.1 404'))
+        self.assertTrue(stats[0].startswith('HTTP/1.1 200'))
+        self.assertEqual(stats[1], b'{"batches": 0, "requests": 0}')
+
+    def test_non_ascii_line_does_not_stop_the_batcher(self):
+        async def scenario(port, batcher):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            bad = await service.post_verify(reader, writer, LINE1, 'L8989\u00e902C36UTO')
+            good = await service.post_verify(reader, writer, LINE1, VALID_LINE2)
+            writer.close()
+            return bad, good
+
+        bad, good = self.run_with_server(scenario)
+        self.assertIn('error', bad)
+        self.assertTrue(good['valid'])
+
+
+if __name__ == '__main__':
+    unittest.main()
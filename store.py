@@ -0,0 +1,142 @@
+import os
+import sqlite3
+from MRTD import decode_mrz
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    row INTEGER PRIMARY KEY,
+    passport_number TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    birth_date TEXT NOT NULL,
+    line1 TEXT NOT NULL,
+    line2 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS source (
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS records_passport_number ON records (passport_number);
+CREATE INDEX IF NOT EXISTS records_last_name_birth_date ON records (last_name, birth_date);
+"""
+
+
+def source_signature(encoded_path: str) -> tuple:
+    """(modification time in ns, size) of an encoded file, to tell when a store is stale"""
+    stat = os.stat(encoded_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def normalize_passport_number(passport_number: str) -> str:
+    """Pad/truncate a passport number the way encode_mrz stores it"""
+    return passport_number.upper().ljust(9, '<')[:9]
+
+
+class PassportStore:
+    """SQLite store of encoded MRZ records indexed for lookups
+
+    Rows keep the original line pair plus the key columns; B-tree indexes
+    on passport_number and (last_name, birth_date) make each lookup
+    O(log n) instead of a scan over every decoded record.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def source(self) -> tuple:
+        """source_signature of the file last loaded, or None"""
+        return self._connection.execute("SELECT mtime_ns, size FROM source").fetchone()
+
+    def load(self, encoded_path: str, batch_size: int = 50000) -> int:
+        """Bulk load a records_encoded.json file, replacing the current contents
+
+        Rows are inserted in one transaction with journaling off and the
+        indexes are built once at the end. Returns the number of rows.
+        """
+        # Taken before reading, so a write during the load leaves the store stale
+        signature = source_signature(encoded_path)
+        connection = self._connection
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.executescript("""
+            DROP INDEX IF EXISTS records_passport_number;
+            DROP INDEX IF EXISTS records_last_name_birth_date;
+            DELETE FROM records;
+            DELETE FROM source;
+        """)
+
+        count = 0
+        batch = []
+        with connection, open(encoded_path, 'r') as f:
+            for row, line in enumerate(f):
+                line1, _, line2 = line.rstrip('\n').partition(';')
+                decoded = decode_mrz(line1, line2)
+                batch.append((row, decoded['line2']['passport_number'], decoded['line1']['last_name'],
+                              decoded['line2']['birth_date'], line1, line2))
+                if len(batch) >= batch_size:
+                    connection.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", batch)
+                    count += len(batch)
+                    batch = []
+            connection.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", batch)
+            count += len(batch)
+            connection.executescript(_INDEXES)
+            connection.execute("INSERT INTO source VALUES (?, ?)", signature)
+        return count
+
+    def find(self, passport_number: str = None, last_name: str = None, birth_date: str = None) -> list:
+        """Decoded records matching every given key, in file order"""
+        clauses = []
+        params = []
+        if passport_number is not None:
+            clauses.append("passport_number = ?")
+            params.append(normalize_passport_number(passport_number))
+        if last_name is not None:
+            clauses.append("last_name = ?")
+            params.append(last_name.upper())
+        if birth_date is not None:
+            clauses.append("birth_date = ?")
+            params.append(birth_date)
+        if not clauses:
+            raise ValueError("At least one of passport_number, last_name or birth_date is required.")
+
+        rows = self._connection.execute(
+            f"SELECT row, line1, line2 FROM records WHERE {' AND '.join(clauses)} ORDER BY row", params)
+        return [dict(decode_mrz(line1, line2), row=row) for row, line1, line2 in rows]
+
+
+def open_store(encoded_path: str) -> PassportStore:
+    """Open the sidecar store of an encoded file, (re)building it when stale
+
+    The store is stale when it was loaded from a file with a different
+    modification time or size than ``encoded_path`` has now.
+    """
+    db_path = encoded_path + '.sqlite'
+    if os.path.exists(db_path):
+        store = PassportStore(db_path)
+        if store.source() == source_signature(encoded_path):
+            return store
+        store.close()
+    # Build beside the real path so an interrupted load is never picked up
+    building = db_path + '.tmp'
+    if os.path.exists(building):
+        os.remove(building)
+    with PassportStore(building) as store:
+        store.load(encoded_path)
+    os.replace(building, db_path)
+    return PassportStore(db_path)
@@ -0,0 +1,64 @@
+import os
+import unittest
+import MRTD
+import store
+import testdata
+
+
+FIELDS = [
+    testdata.ERIKSSON,
+    dict(testdata.ERIKSSON, issuing_country='CAN', last_name='VAN DER BERG', first_name='JAN', middle_name='',
+         passport_number='A1234', country_code='CAN', sex='M', expiration_date='300101',
+         personal_number='123456789'),
+]
+
+
+class TestPassportStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path, self.lines = testdata.encoded_file(self, FIELDS)
+
+    def test_load_and_find(self):
+        with store.PassportStore() as passports:
+            self.assertEqual(passports.load(self.path), 2)
+            self.assertEqual(len(passports), 2)
+            found, = passports.find(passport_number='a1234')
+            self.assertEqual(found['row'], 1)
+            self.assertEqual(found['line2'], MRTD.decode_mrz(*self.lines[1])['line2'])
+            found, = passports.find(last_name='van der berg', birth_date='740812')
+            self.assertEqual(found['line1']['first_name'], 'JAN')
+            self.assertEqual([r['row'] for r in passports.find(birth_date='740812')], [0, 1])
+            self.assertEqual(passports.find(passport_number='Z99999999'), [])
+            with self.assertRaises(ValueError):
+                passports.find()
+
+    def test_open_store_builds_and_reuses_sidecar(self):
+        passports = store.open_store(self.path)
+        passports.close()
+        self.assertTrue(os.path.exists(self.path + '.sqlite'))
+        self.assertFalse(os.path.exists(self.path + '.sqlite.tmp'))
+        with store.open_store(self.path) as passports:
+            self.assertEqual(len(passports), 2)
+            self.assertEqual(passports.source(), store.source_signature(self.path))
+
+        with open(self.path, 'a') as f:
+            f.write(f"{self.lines[0][0]};{self.lines[0][1]}\n")
+        with store.open_store(self.path) as passports:
+            self.assertEqual(len(passports), 3)
+
+    def test_query_database(self):
+        self.assertIsNone(MRTD.query_database(database=self.path))
+        found, = MRTD.query_database(passport_number='L898902C3', database=self.path)
+        self.assertEqual(found['line1']['last_name'], 'ERIKSSON')
+        self.assertEqual(MRTD.query_database(last_name='ERIKSSON', birth_date='120415', database=self.path), [])
+        self.addCleanup(lambda: MRTD._STORES.pop(self.path)[1].close())
+
+        # Rewritten in the same process: the cached store must not answer from the old file
+        testdata.write_encoded(self.path, [dict(FIELDS[0], passport_number='B2')])
+        self.assertEqual(MRTD.query_database(passport_number='L898902C3', database=self.path), [])
+        found, = MRTD.query_database(passport_number='B2', database=self.path)
+        self.assertEqual(found['row'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""Records and files shared by the test modules
+
+ERIKSSON is the ICAO 9303 specimen passport; tests build their other
+records from it with dict(ERIKSSON, ...).
+"""
+import os
+import tempfile
+import MRTD
+
+ERIKSSON = {
+    'document_type': 'P',
+    'issuing_country': 'UTO',
+    'last_name': 'ERIKSSON',
+    'first_name': 'ANNA',
+    'middle_name': 'MARIA',
+    'passport_number': 'L898902C3',
+    'country_code': 'UTO',
+    'birth_date': '740812',
+    'sex': 'F',
+    'expiration_date': '120415',
+    'personal_number': 'ZE184226B'
+}
+
+
+def write_encoded(path: str, fields_list) -> list:
+    """Write the encode_mrz lines of each fields dict as a records_encoded.json file; returns the line pairs"""
+    lines = [MRTD.encode_mrz(fields) for fields in fields_list]
+    with open(path, 'w', encoding='utf-8') as f:
+        for line1, line2 in lines:
+            f.write(f"{line1};{line2}\n")
+    return lines
+
+
+def encoded_file(test, fields_list) -> tuple:
+    """(path, line pairs) of a records_encoded.json in a directory removed when ``test`` ends"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, 'records_encoded.json')
+    return path, write_encoded(path, fields_list)
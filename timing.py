@@ -1,67 +1,501 @@
+"""Benchmark suite for MRTD and processor
+
+Runs every benchmark with warmup rounds and repeated timed runs and
+reports median/p90/p99 time, records/sec and peak traced memory. Input
+is synthetic unless --input points at a records_decoded.json file.
+
+    python timing.py                          # run everything
+    python timing.py --only encode_mrz decode_mrz
+    python timing.py --save baseline.json     # store results
+    python timing.py --compare baseline.json  # flag regressions, exit 1
+    python timing.py --scaling                # old timings_<mode>.csv
+    python timing.py --store-scan --records 10000000
+                                              # passport store vs scan, streamed
+"""
+import argparse
+import contextlib
+import csv
+import io
 import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
 import time
-import csv
-from MRTD import encode_mrz, decode_mrz
+import tracemalloc
+import MRTD
+import archive
+import dateindex
+import dedup
+import processor
+import store
+from MRTD import MRZRecord, encode_mrz, decode_mrz
 
-def time_encode(fields_list, k):
-    start = time.perf_counter()
-    for fields in fields_list[:k]:
-        encode_mrz(fields)
-    return time.perf_counter() - start
+COUNTRIES = ["UTO", "CAN", "USA", "GBR", "FRA", "DEU", "IND", "CHN", "BRA", "NGA", "CIV", "REU"]
+SYLLABLES = ["AN", "BER", "CA", "DO", "EL", "FOR", "GAN", "HAR", "IS", "JO", "KEL", "LIN",
+             "MAR", "NO", "OL", "PER", "RI", "SON", "TA", "VEN", "WIL", "ZE"]
+ALNUM = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+def synthetic_records(count, seed=567):
+    """Deterministic records in the records_decoded.json shape"""
+    return list(iter_synthetic_records(count, seed))
+
+
+def iter_synthetic_records(count, seed=567):
+    """synthetic_records one at a time"""
+    rng = random.Random(seed)
+
+    def name(parts):
+        return "".join(rng.choice(SYLLABLES) for _ in range(parts))
+
+    def date():
+        return f"{rng.randrange(100):02d}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+
+    def code(length):
+        return "".join(rng.choice(ALNUM) for _ in range(length))
+
+    for _ in range(count):
+        country = rng.choice(COUNTRIES)
+        given = " ".join(name(rng.randint(1, 3)) for _ in range(rng.randint(1, 3)))
+        yield {
+            "line1": {"issuing_country": country, "last_name": name(rng.randint(1, 4)), "given_name": given},
+            "line2": {"passport_number": code(9), "country_code": country, "birth_date": date(),
+                      "sex": rng.choice("MF"), "expiration_date": date(), "personal_number": code(9)},
+        }
+
+
+def load_records(path):
+    with open(path, "r") as f:
+        return json.load(f)["records_decoded"]
+
+
+def build_benchmarks(records, workdir):
+    """name -> (setup, run, record_count); setup runs untimed before each run"""
+    fields_list = [processor.record_to_fields(record) for record in records]
+    columns = processor.records_to_columns(records)
+    encoded_lines = [encode_mrz(fields) for fields in fields_list]
+    decoded_list = [decode_mrz(line1, line2) for line1, line2 in encoded_lines]
+    check_fields = [value for fields in fields_list
+                    for value in (fields["passport_number"], fields["birth_date"],
+                                  fields["expiration_date"], fields["personal_number"])]
+    check_bytes = [value.upper().replace("<", "0").encode("ascii") for value in check_fields]
+
+    # Passport numbers paired with a check digit they fail, as after a misread
+    misread_numbers = [(fields["passport_number"], (MRTD.calculate_check_digit(fields["passport_number"]) + 1) % 10)
+                       for fields in fields_list[:1000]]
+
+    input_path = os.path.join(workdir, "records_decoded.json")
+    output_path = os.path.join(workdir, "records_encoded.json")
+    with open(input_path, "w") as f:
+        json.dump({"records_decoded": records}, f)
+
+    # Encoded file the file-based benchmarks read; store vs scan lookups run apart, see store_comparison
+    store_path = os.path.join(workdir, "store_encoded.json")
+    with open(store_path, "w") as f:
+        for line1, line2 in encoded_lines:
+            f.write(f"{line1};{line2}\n")
+
+    # Birth date range queries: sorted date index vs decoding every row
+    birth_index = dateindex.DateIndex.build(store_path)
+    birth_ranges = [(19000101 + year * 10000, 19000101 + (year + 10) * 10000) for year in range(0, 120, 10)]
+
+    def index_queries():
+        for first, last in birth_ranges:
+            birth_index.between(first, last)
+
+    def decode_queries():
+        for first, last in birth_ranges:
+            pivot = dateindex.DEFAULT_PIVOTS["birth_date"]
+            rows = []
+            for row, (line1, line2) in enumerate(encoded_lines):
+                birth_date = decode_mrz(line1, line2)["line2"]["birth_date"]
+                if birth_date.isdigit():
+                    packed = int(birth_date) + (20000000 if int(birth_date[:2]) <= pivot else 19000000)
+                    if first <= packed <= last:
+                        rows.append(row)
+
+    archive_path = os.path.join(workdir, "records.mrza")
+    archive.write_archive(encoded_lines, archive_path)
+
+    def read_archive():
+        with archive.MRZArchive(archive_path) as records:
+            list(records)
+
+    def read_archive_decoded():
+        with archive.MRZArchive(archive_path) as records:
+            list(records.iter_decoded())
+
+    def read_archive_column():
+        with archive.MRZArchive(archive_path) as records:
+            records.column("birth_date")
+
+    def read_text():
+        list(archive.read_encoded_pairs(store_path))
+
+    def read_text_decoded():
+        [decode_mrz(line1, line2) for line1, line2 in archive.read_encoded_pairs(store_path)]
+
+    def read_text_column():
+        [decode_mrz(line1, line2)["line2"]["birth_date"] for line1, line2 in archive.read_encoded_pairs(store_path)]
+
+    # Scanner feed: encoded pairs as OCR text with CRLF breaks, read in 4 KB chunks
+    ocr_text = "".join(f"{line1}\r\n{line2}\r\n\r\n" for line1, line2 in encoded_lines)
+    ocr_chunks = [ocr_text[start:start + 4096] for start in range(0, len(ocr_text), 4096)]
+
+    def reset_cache():
+        MRTD.configure_check_digit_cache()
+
+    def verify_file():
+        with contextlib.redirect_stdout(io.StringIO()):
+            processor.main(["verify", "--input", store_path])
+
+    def run_processor(*args):
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                processor.main(["--input", input_path, "--output", output_path, *args])
+        return run
+
+    return {
+        "fletcher16": (None, lambda: [MRTD.fletcher16(data) for data in check_bytes], len(check_bytes)),
+        "calculate_check_digit": (reset_cache, lambda: [MRTD.calculate_check_digit(value) for value in check_fields],
+                                  len(check_fields)),
+        "calculate_check_digit_cached": (None, lambda: [MRTD.calculate_check_digit(value) for value in check_fields],
+                                         len(check_fields)),
+        "encode_mrz": (reset_cache, lambda: [encode_mrz(fields) for fields in fields_list], len(records)),
+        "encode_mrz_batch": (reset_cache, lambda: MRTD.encode_mrz_batch(columns), len(records)),
+        "decode_names": (None, lambda: MRTD.decode_names([line1 for line1, _ in encoded_lines]), len(records)),
+        "decode_mrz": (None, lambda: [decode_mrz(line1, line2) for line1, line2 in encoded_lines], len(records)),
+        "verify_mrz": (reset_cache, lambda: [MRTD.verify_mrz(line1, line2) for line1, line2 in encoded_lines],
+                       len(records)),
+        "verify_check_digits": (reset_cache, lambda: [MRTD.verify_check_digits(decoded) for decoded in decoded_list],
+                                len(records)),
+        "parse_and_verify": (reset_cache, lambda: [MRTD.parse_and_verify(line1, line2) for line1, line2 in encoded_lines],
+                             len(records)),
+        "correct_check_digit": (None, lambda: [MRTD.correct_check_digit(number, digit)
+                                               for number, digit in misread_numbers], len(misread_numbers)),
+        "scan_mrz": (reset_cache, lambda: list(MRTD.scan_mrz(ocr_chunks)), len(records)),
+        "dedup_passport": (None, lambda: dedup.passport_collisions(store_path), len(records)),
+        "dedup_identity_fuzzy": (None, lambda: dedup.identity_collisions(store_path, fuzzy=True), len(records)),
+        "dedup_partitioned": (None, lambda: dedup.passport_collisions(store_path, partitions=16, workdir=workdir),
+                              len(records)),
+        "dateindex_build": (None, lambda: dateindex.DateIndex.build(store_path), len(records)),
+        "date_range_index": (None, index_queries, len(birth_ranges)),
+        "date_range_decode": (None, decode_queries, len(birth_ranges)),
+        "archive_write": (None, lambda: archive.write_archive(encoded_lines, archive_path), len(records)),
+        "archive_read": (None, read_archive, len(records)),
+        "archive_decoded": (None, read_archive_decoded, len(records)),
+        "archive_column": (None, read_archive_column, len(records)),
+        "text_read": (None, read_text, len(records)),
+        "text_decoded": (None, read_text_decoded, len(records)),
+        "text_column": (None, read_text_column, len(records)),
+        "processor": (reset_cache, run_processor(), len(records)),
+        "processor_stream": (reset_cache, run_processor("--stream"), len(records)),
+        "processor_verify": (reset_cache, verify_file, len(records)),
+    }
+
+
+def scan_passport(path, number):
+    """Lines of an encoded file holding ``number``, found by reading every line"""
+    key = store.normalize_passport_number(number)
+    with open(path, "r", encoding="utf-8") as f:
+        return [line for line in f if line[45:54] == key]
+
+
+def store_comparison(records, lookups, workdir, seed=567):
+    """Passport lookups through the indexed store vs scans of the encoded file
+
+    ``records`` is read once, streamed into the encoded file, so memory
+    does not grow with the record count; ``lookups`` passport numbers are
+    sampled on the way. Times the store build (open_store), then each
+    lookup both ways once.
+    """
+    rng = random.Random(seed)
+    numbers = []
+
+    def sampled(records):
+        for index, record in enumerate(records):
+            number = record["line2"].get("passport_number", "")
+            if index < lookups:
+                numbers.append(number)
+            elif rng.randrange(index + 1) < lookups:
+                numbers[rng.randrange(lookups)] = number
+            yield record
+
+    path = os.path.join(workdir, "store_encoded.json")
+    with open(path, "wb") as out:
+        count, _ = processor.write_encoded(sampled(records), out)
 
-def time_decode(encoded_lines, k):
     start = time.perf_counter()
-    for line1, line2 in encoded_lines[:k]:
-        decode_mrz(line1, line2)
-    return time.perf_counter() - start
-
-def main():
-    # 1) load your decoded→fields JSON
-    with open("records_decoded.json", "r") as f:
-        data = json.load(f)
-    records = data["records_decoded"]
-
-    # 2) build the dicts you pass to encode_mrz
-    fields_list = []
-    for rec in records:
-        name_parts = rec["line1"].get("given_name", "").split()
-        first = name_parts[0] if name_parts else ""
-        middle = " ".join(name_parts[1:]) if len(name_parts) > 1 else ""
-        fields_list.append({
-            "document_type": "P",
-            "issuing_country": rec["line1"].get("issuing_country", "")[:3],
-            "last_name": rec["line1"].get("last_name", ""),
-            "first_name": first,
-            "middle_name": middle,
-            "passport_number": rec["line2"].get("passport_number", ""),
-            "country_code": rec["line2"].get("country_code", ""),
-            "birth_date": rec["line2"].get("birth_date", ""),
-            "sex": rec["line2"].get("sex", ""),
-            "expiration_date": rec["line2"].get("expiration_date", ""),
-            "personal_number": rec["line2"].get("personal_number", "")
-        })
-
-    # 3) pre‑encode every record once (outside timing)
-    encoded_lines = [encode_mrz(f) for f in fields_list]
-
-    # 4) choose your k’s
-    ks = [100] + list(range(1000, 10001, 1000))
+    passports = store.open_store(path)
+    load_s = time.perf_counter() - start
+    with passports:
+        store_s = []
+        for number in numbers:
+            start = time.perf_counter()
+            passports.find(passport_number=number)
+            store_s.append(time.perf_counter() - start)
+    scan_s = []
+    for number in numbers:
+        start = time.perf_counter()
+        scan_passport(path, number)
+        scan_s.append(time.perf_counter() - start)
+    return {
+        "records": count,
+        "lookups": len(numbers),
+        "load_s": load_s,
+        "store_kb": os.path.getsize(path + ".sqlite") / 1024,
+        "store_lookup_median_s": statistics.median(store_s) if store_s else 0.0,
+        "scan_lookup_median_s": statistics.median(scan_s) if scan_s else 0.0,
+    }
+
+
+def measure(setup, run, record_count, repeats, warmup):
+    """Time repeated runs after warmup, then trace one extra run for peak memory"""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        run()
+
+    samples = []
+    for _ in range(repeats):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    percentiles = statistics.quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+    median = statistics.median(samples)
+    return {
+        "records": record_count,
+        "repeats": repeats,
+        "min_s": min(samples),
+        "median_s": median,
+        "p90_s": percentiles[89],
+        "p99_s": percentiles[98],
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "records_per_s": record_count / median if median else 0.0,
+        "peak_kb": peak / 1024,
+    }
+
+
+def bytes_per_record(decode, encoded_lines):
+    """Average traced memory held per decoded record"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    decoded = [decode(line1, line2) for line1, line2 in encoded_lines]
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return held / len(decoded)
+
+
+def processor_peak_rss_kb(processor_args):
+    """Peak RSS of one processor run in a fresh interpreter (KB on Linux)"""
+    # VmHWM belongs to the child's own address space; ru_maxrss would carry
+    # over this (much larger) benchmark process's peak through fork/exec
+    code = ("import sys, processor\n"
+            "processor.main(sys.argv[1:])\n"
+            "try:\n"
+            "    print(open('/proc/self/status').read().split('VmHWM:')[1].split()[0])\n"
+            "except OSError:\n"
+            "    import resource\n"
+            "    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n")
+    result = subprocess.run(
+        [sys.executable, "-c", code, *processor_args, "--output", os.devnull],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    return int(result.stdout.split()[-1])
+
+
+COLD_START_CODE = """\
+import time
+start = time.perf_counter()
+import MRTD
+MRTD.verify_mrz('P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<', 'L898902C32UTO7408123F1204154ZE184226B<<<<<<6')
+print((time.perf_counter() - start) * 1e3)
+import processor
+"""
+
+
+def cold_start_ms(runs=5):
+    """Best-of-``runs`` startup costs in fresh interpreters, in ms
+
+    Import times are the cumulative ``-X importtime`` figures; bytecode is
+    cached in a scratch directory first, as it would be on an installed
+    system, so compiling the sources is not counted.
+    """
+    env = {key: value for key, value in os.environ.items() if key != "PYTHONDONTWRITEBYTECODE"}
+    best = {}
+    with tempfile.TemporaryDirectory() as pycache:
+        for run in range(runs + 1):
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-X", f"pycache_prefix={pycache}", "-c", COLD_START_CODE],
+                capture_output=True, text=True, check=True, env=env,
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+            if not run:
+                continue  # writes the bytecode
+            times = {"MRTD import + verify_mrz": float(result.stdout)}
+            for line in result.stderr.splitlines():
+                # import time: <self us> | <cumulative us> | <module, indented by depth>
+                fields = line.split("|")
+                if len(fields) == 3 and fields[2].strip() in ("MRTD", "processor"):
+                    times[f"{fields[2].strip()} import"] = int(fields[1]) / 1e3
+            for label, ms in times.items():
+                best[label] = min(ms, best.get(label, ms))
+    return best
+
+
+def compare(results, baseline, threshold):
+    """Names of benchmarks whose median is more than ``threshold`` slower than the baseline"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous and result["median_s"] > previous["median_s"] * (1 + threshold):
+            regressions.append(name)
+    return regressions
 
-    # detect mode
-    mode = "with_tests" if __debug__ else "without_tests"
-    out_csv = f"timings_{mode}.csv"
 
-    # 5) time and write CSV
+def print_table(results, baseline=None):
+    print(f"{'benchmark':<30}{'median ms':>11}{'p90 ms':>10}{'p99 ms':>10}{'records/s':>13}{'peak KB':>10}"
+          + (f"{'vs base':>9}" if baseline else ""))
+    for name, result in results.items():
+        row = (f"{name:<30}{result['median_s'] * 1e3:>11.3f}{result['p90_s'] * 1e3:>10.3f}"
+               f"{result['p99_s'] * 1e3:>10.3f}{result['records_per_s']:>13,.0f}{result['peak_kb']:>10.0f}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            row += f"{result['median_s'] / previous['median_s'] - 1:>+9.1%}"
+        print(row)
+
+
+def write_scaling_csv(records, mode):
+    """Encode/decode totals for growing k, as the original timing.py wrote them"""
+    fields_list = [processor.record_to_fields(record) for record in records]
+    encoded_lines = [encode_mrz(fields) for fields in fields_list]
+    out_csv = f"timings_{mode}.csv"
+    ks = [100] + list(range(1000, len(records) + 1, 1000))
     with open(out_csv, "w", newline="") as csvf:
         w = csv.writer(csvf)
         w.writerow(["n_records", "encode_s", "decode_s"])
         for k in ks:
-            t_e = time_encode(fields_list, k)
-            t_d = time_decode(encoded_lines, k)
+            start = time.perf_counter()
+            for fields in fields_list[:k]:
+                encode_mrz(fields)
+            t_e = time.perf_counter() - start
+            start = time.perf_counter()
+            for line1, line2 in encoded_lines[:k]:
+                decode_mrz(line1, line2)
+            t_d = time.perf_counter() - start
             w.writerow([k, f"{t_e:.6f}", f"{t_d:.6f}"])
             print(f"[{mode}] k={k:5d} → encode {t_e:.6f}s, decode {t_d:.6f}s")
-
     print(f"Done: wrote {out_csv}")
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark MRTD and processor.")
+    parser.add_argument("--input", help="records_decoded.json to use instead of synthetic records")
+    parser.add_argument("--records", type=int, default=10000, help="synthetic record count")
+    parser.add_argument("--repeats", type=int, default=15)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these benchmarks")
+    parser.add_argument("--save", metavar="PATH", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="flag regressions against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative median slowdown counted as a regression")
+    parser.add_argument("--scaling", action="store_true", help="write timings_<mode>.csv and exit")
+    parser.add_argument("--store-scan", action="store_true",
+                        help="only compare passport store lookups with file scans, streaming the records "
+                             "so --records can run to millions")
+    parser.add_argument("--lookups", type=int, default=100, help="passport lookups for --store-scan")
+    args = parser.parse_args(argv)
+
+    # detect mode
+    mode = "with_tests" if __debug__ else "without_tests"
+
+    if args.store_scan:
+        with contextlib.ExitStack() as stack:
+            if args.input:
+                records = processor.iter_decoded_records(stack.enter_context(open(args.input, "r")))
+            else:
+                records = iter_synthetic_records(args.records)
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+            result = store_comparison(records, args.lookups, workdir)
+        print(f"[{mode}] {result['records']} records: store built in {result['load_s']:.2f}s "
+              f"({result['store_kb'] / 1024:.1f} MB)")
+        print(f"[{mode}] passport lookup, median of {result['lookups']}: "
+              f"store {result['store_lookup_median_s'] * 1e3:.3f} ms, "
+              f"scan {result['scan_lookup_median_s'] * 1e3:.3f} ms")
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump({"mode": mode, "store_scan": result}, f, indent=2)
+        return 0
+    records = load_records(args.input) if args.input else synthetic_records(args.records)
+
+    if args.scaling:
+        write_scaling_csv(records, mode)
+        return 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks = build_benchmarks(records, workdir)
+        names = args.only or list(benchmarks)
+        unknown = sorted(set(names) - set(benchmarks))
+        if unknown:
+            parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+        results = {}
+        for name in names:
+            results[name] = measure(*benchmarks[name], args.repeats, args.warmup)
+
+        input_path = os.path.join(workdir, "records_decoded.json")
+        rss = {label: processor_peak_rss_kb(["--input", input_path, *processor_args])
+               for label, processor_args in (("load", []), ("stream", ["--stream"]))}
+        storage = {label: os.path.getsize(os.path.join(workdir, name)) / len(records)
+                   for label, name in (("text", "store_encoded.json"), ("archive", "records.mrza"))}
+
+    cold_start = cold_start_ms()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+
+    print(f"[{mode}] {len(records)} records, {args.repeats} runs after {args.warmup} warmups")
+    print_table(results, baseline)
+
+    encoded_lines = [encode_mrz(processor.record_to_fields(record)) for record in records]
+    for label, decode in (("decode_mrz", decode_mrz), ("MRZRecord", MRZRecord)):
+        print(f"[{mode}] {label}: {bytes_per_record(decode, encoded_lines):.0f} bytes/record")
+    for label, kb in rss.items():
+        print(f"[{mode}] processor {label}: peak RSS {kb} KB")
+    for label, size in storage.items():
+        print(f"[{mode}] {label} storage: {size:.1f} bytes/record")
+    for label, ms in cold_start.items():
+        print(f"[{mode}] cold start {label}: {ms:.2f} ms")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"mode": mode, "records": len(records), "results": results,
+                       "processor_peak_rss_kb": rss, "cold_start_ms": cold_start}, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name in regressions:
+            print(f"REGRESSION {name}: median {results[name]['median_s'] * 1e3:.3f} ms vs "
+                  f"{baseline[name]['median_s'] * 1e3:.3f} ms baseline")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())